@@ -0,0 +1,100 @@
+"""
+药片计数的性能测试：每帧的轮廓分离和完整计数耗时
+
+用法（在 dispensing-gui 目录下运行）:
+    python benchmarks/pill_counter_benchmark.py [--images 录制数据目录] [--pills 5 20 50 100] [--repeat 20]
+
+不指定 --images 时使用合成的药盘图像（见 benchmarks/tray_images.py），药片数由 --pills 指定。
+对每张图像：
+1. 用空药盘捕捉背景，预处理得到二值图
+2. 轮廓分离：原来的逐个连通组件膨胀（保留在本文件中作为对照）和 PillCounter.separate_contours，
+   两者的结果必须逐像素相同
+3. 完整的 count_pills 耗时和计数结果
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import statistics
+import sys
+import time
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from tray_images import load_recorded, synthetic_dataset
+from pill_counter import PillCounter
+
+
+def separate_contours_per_component(binary):
+    """原来的实现：每个连通组件单独生成整帧掩码、膨胀、合并"""
+    separation_kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3))
+    eroded = cv2.erode(binary, separation_kernel, iterations=2)
+    num_labels, labels, stats, centroids = cv2.connectedComponentsWithStats(eroded, connectivity=8)
+    separated = np.zeros_like(binary)
+    recovery_kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (4, 4))
+    for i in range(1, num_labels):
+        component_mask = (labels == i).astype(np.uint8) * 255
+        recovered = cv2.dilate(component_mask, recovery_kernel, iterations=2)
+        separated = cv2.bitwise_or(separated, recovered)
+    return separated
+
+
+def count_new_frame(counter, frame):
+    """把 frame 当作新的一帧计数（不使用上一次缓存的预处理结果）"""
+    counter.begin_frame(frame)
+    return counter.count_pills(frame)
+
+
+def measure(func, repeat):
+    """运行 repeat 次，返回 (每次耗时的中位数 ms, 最后一次的结果)"""
+    timings = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='药片计数每帧耗时')
+    parser.add_argument('--images', help='录制的药盘图像目录（默认使用合成图像）')
+    parser.add_argument('--pills', type=int, nargs='+', default=[5, 20, 50, 100], help='合成图像的药片数')
+    parser.add_argument('--repeat', type=int, default=20, help='每张图像重复测量的次数')
+    args = parser.parse_args()
+
+    if args.images:
+        background, samples = load_recorded(args.images)
+    else:
+        background, samples = synthetic_dataset(args.pills)
+
+    counter = PillCounter(camera_id=None)
+    counter.capture_background(background)
+
+    print(f"{'图像':<24}{'药片':>6}{'组件':>6}{'逐个组件(ms)':>14}{'一次膨胀(ms)':>14}{'加速':>8}"
+          f"{'count_pills(ms)':>17}{'计数':>6}")
+    mismatches = 0
+    for pills, name, frame in samples:
+        binary = counter.preprocess_image(frame)
+        components = cv2.connectedComponents(cv2.erode(binary, counter.separation_kernel, iterations=2))[0] - 1
+        old_ms, old = measure(lambda: separate_contours_per_component(binary), args.repeat)
+        new_ms, new = measure(lambda: counter.separate_contours(binary), args.repeat)
+        if not np.array_equal(old, new):
+            mismatches += 1
+        # count_pills 会打印重新分类的信息，测量时不输出
+        with contextlib.redirect_stdout(io.StringIO()):
+            count_ms, (count, _) = measure(lambda: count_new_frame(counter, frame), args.repeat)
+        print(f"{name:<24}{pills:>6}{components:>6}{old_ms:>14.2f}{new_ms:>14.2f}{old_ms / new_ms:>7.1f}x"
+              f"{count_ms:>17.2f}{count:>6}")
+
+    if mismatches:
+        print(f"错误: {mismatches} 张图像的分离结果与原来的实现不同")
+        sys.exit(1)
+    print("分离结果与原来的实现逐像素相同")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+"""
+药盘图像：读取录制的药盘照片，或者生成合成的药盘图像，供药片计数的性能测试和一致性测试使用
+
+录制的数据目录格式:
+    <目录>/background.jpg        空药盘（用来捕捉背景）
+    <目录>/<药片数>_<任意名称>.jpg  放了药片的药盘，例如 20_晚饭后.jpg
+可以用 tests/cam_function_test 的“保存图片”按钮录制（计数模式下先保存一张空药盘）。
+
+没有录制数据时生成合成图像：深色药盘（带光照渐变和噪声）上随机摆放椭圆形药片，
+药片多时会有相互接触的药片，和真实药盘一样需要分离。
+"""
+
+import os
+import re
+import sys
+
+import cv2
+import numpy as np
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')
+if SRC_DIR not in sys.path:
+    sys.path.insert(0, SRC_DIR)
+
+# 和 CamController 的默认分辨率相同
+FRAME_HEIGHT = 960
+FRAME_WIDTH = 1280
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+
+def read_image(path):
+    """读取图像（支持中文文件名）"""
+    image = cv2.imdecode(np.fromfile(path, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        raise ValueError(f"无法读取图像: {path}")
+    return image
+
+
+def load_recorded(image_dir):
+    """
+    读取录制的药盘图像
+    Args:
+        image_dir: 数据目录
+    Returns:
+        background: 空药盘图像
+        samples: [(药片数, 文件名, 图像)]，按药片数排序
+    """
+    background = None
+    samples = []
+    for name in sorted(os.listdir(image_dir)):
+        stem, ext = os.path.splitext(name)
+        if ext.lower() not in IMAGE_EXTENSIONS:
+            continue
+        if stem == 'background':
+            background = read_image(os.path.join(image_dir, name))
+            continue
+        match = re.match(r'(\d+)_', stem)
+        if match:
+            samples.append((int(match.group(1)), name, read_image(os.path.join(image_dir, name))))
+    if background is None:
+        raise ValueError(f"{image_dir} 中没有 background 图像")
+    samples.sort(key=lambda sample: sample[0])
+    return background, samples
+
+
+def synthetic_background(seed=0, height=FRAME_HEIGHT, width=FRAME_WIDTH):
+    """深色药盘：左上到右下的光照渐变加上传感器噪声"""
+    rng = np.random.default_rng(seed)
+    ys, xs = np.mgrid[0:height, 0:width]
+    shade = 50 + 20 * (xs / width) + 10 * (ys / height)
+    gray = shade + rng.normal(0, 2.0, (height, width))
+    gray = np.clip(gray, 0, 255).astype(np.uint8)
+    return cv2.merge([gray, gray, gray])
+
+
+def synthetic_tray(pills, seed=0, background=None, pill_size=(22, 14), touching=0.2):
+    """
+    在空药盘上摆放药片
+    Args:
+        pills: 药片数
+        seed: 随机种子
+        background: 空药盘图像，默认 synthetic_background(seed)
+        pill_size: 药片椭圆的半长轴、半短轴（像素）
+        touching: 紧挨着上一片药片摆放的比例
+    Returns:
+        frame: 放了药片的图像（带噪声）
+    """
+    rng = np.random.default_rng(seed + 1000)
+    if background is None:
+        background = synthetic_background(seed)
+    height, width = background.shape[:2]
+    frame = background.copy()
+    margin = 50 + max(pill_size) * 2
+    major, minor = pill_size
+    centers = []
+    for _ in range(pills):
+        for _attempt in range(200):
+            if centers and rng.random() < touching:
+                # 贴着上一片药片摆放（中心距离略小于两个半短轴之和）
+                cx, cy = centers[-1]
+                angle = rng.uniform(0, 2 * np.pi)
+                x = int(cx + np.cos(angle) * minor * 2.1)
+                y = int(cy + np.sin(angle) * minor * 2.1)
+            else:
+                x = int(rng.uniform(margin, width - margin))
+                y = int(rng.uniform(margin, height - margin))
+            if not (margin <= x < width - margin and margin <= y < height - margin):
+                continue
+            # 不能和已有药片重叠太多
+            if all((x - px) ** 2 + (y - py) ** 2 >= (minor * 2) ** 2 for px, py in centers):
+                break
+        centers.append((x, y))
+        color = int(rng.uniform(190, 235))
+        cv2.ellipse(frame, (x, y), (major, minor), float(rng.uniform(0, 180)), 0, 360,
+                    (color, color, color), -1, cv2.LINE_AA)
+    noise = rng.normal(0, 2.0, frame.shape[:2])
+    noisy = np.clip(frame.astype(np.float32) + noise[..., None], 0, 255).astype(np.uint8)
+    return noisy
+
+
+def synthetic_dataset(pill_counts, seed=0):
+    """
+    生成一组合成药盘图像
+    Returns:
+        background, samples: 与 load_recorded() 相同
+    """
+    background = synthetic_background(seed)
+    samples = [(pills, f"{pills}_synthetic.png", synthetic_tray(pills, seed + pills, background))
+               for pills in pill_counts]
+    return background, samples
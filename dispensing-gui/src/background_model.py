@@ -0,0 +1,142 @@
+import cv2
+import numpy as np
+
+
+class BackgroundModel:
+    """
+    自适应背景模型
+    以前捕捉一帧背景后就固定不变，光照慢慢变化后背景减法逐渐失效，只能按 'b' 或切换模式重新等待场景稳定。
+    这里维护空药盘灰度图的滑动平均：
+    - 计数时只更新药片（前景）以外的像素，药盘上没有药片时整帧更新
+    - 用背景区域与模型的平均差异估算置信度（0~1），差异越大置信度越低
+    - 换药盘（换患者）后，只要新画面与模型吻合就直接恢复背景，不需要重新等待十几帧稳定
+    """
+    def __init__(self, learning_rate=0.1, drift_limit=20.0, confidence_smoothing=0.2,
+                 max_foreground_fraction=0.5, mask_margin=2):
+        """
+        初始化背景模型
+        Args:
+            learning_rate: 每次更新时新画面的权重
+            drift_limit: 背景区域平均灰度差达到这个值时置信度为0
+            confidence_smoothing: 置信度的平滑系数（新观测的权重）
+            max_foreground_fraction: 前景超过画面的这个比例时（例如手挡住药盘、灯光突变）认为背景不可信
+            mask_margin: 前景掩码向外扩展的像素数（前景图的分辨率），药片边缘的模糊过渡不参与更新和置信度估计
+        """
+        self.learning_rate = learning_rate
+        self.drift_limit = drift_limit
+        self.confidence_smoothing = confidence_smoothing
+        self.max_foreground_fraction = max_foreground_fraction
+        self.mask_kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (2 * mask_margin + 1, 2 * mask_margin + 1))
+
+        self.mean = None  # 背景灰度图的滑动平均（float32，裁切后的原始分辨率）
+        self.confidence = 0.0
+        self.version = 0  # 每次模型变化加一
+        self.updates = 0
+        self._images = {}  # 比例 -> 该分辨率下模糊后的背景（当前版本）
+
+    @property
+    def ready(self):
+        """是否已经有背景"""
+        return self.mean is not None
+
+    def reset(self):
+        """丢弃背景"""
+        self.mean = None
+        self.confidence = 0.0
+        self.version += 1
+        self._images = {}
+
+    def initialize(self, gray):
+        """
+        用一帧空药盘初始化背景
+        Args:
+            gray: 裁切后的灰度图（原始分辨率）
+        """
+        self.mean = gray.astype(np.float32)
+        self.confidence = 1.0
+        self.version += 1
+        self._images = {}
+
+    def image(self, scale, resize):
+        """
+        某个分辨率下的背景：与当前帧的处理顺序相同，先缩小再模糊
+        Args:
+            scale: 比例
+            resize: 缩小图像的函数 (image, scale)
+        Returns:
+            uint8 背景图
+        """
+        image = self._images.get(scale)
+        if image is None:
+            gray = cv2.convertScaleAbs(self.mean)
+            image = self._images[scale] = cv2.GaussianBlur(resize(gray, scale), (5, 5), 0)
+        return image
+
+    def _background_mask(self, foreground):
+        """前景向外扩展后取反，得到可以用来估计和更新背景的像素"""
+        return cv2.bitwise_not(cv2.dilate(foreground, self.mask_kernel))
+
+    def match(self, diff, foreground):
+        """
+        当前画面与背景的吻合程度（不改变模型）
+        Args:
+            diff: 当前帧与背景的差值图（通常是降采样后的）
+            foreground: 同分辨率的前景二值图
+        Returns:
+            这一帧的置信度（0~1）
+        """
+        if cv2.countNonZero(foreground) > self.max_foreground_fraction * foreground.size:
+            return 0.0
+        background_mask = self._background_mask(foreground)
+        if not cv2.countNonZero(background_mask):
+            return 0.0
+        residual = cv2.mean(diff, mask=background_mask)[0]
+        return float(np.clip(1.0 - residual / self.drift_limit, 0.0, 1.0))
+
+    def observe(self, diff, foreground):
+        """
+        用一帧的观测更新（平滑后的）置信度
+        Returns:
+            平滑后的置信度
+        """
+        current = self.match(diff, foreground)
+        self.confidence += self.confidence_smoothing * (current - self.confidence)
+        return self.confidence
+
+    def illumination_shift(self, current, reference, foreground):
+        """
+        背景区域中当前帧比模型平均亮多少
+        Args:
+            current: 当前帧（与 foreground 同分辨率）
+            reference: 同分辨率的背景
+            foreground: 前景二值图
+        Returns:
+            平均灰度差（可以为负）
+        """
+        background_mask = self._background_mask(foreground)
+        if not cv2.countNonZero(background_mask):
+            return 0.0
+        return cv2.mean(current, mask=background_mask)[0] - cv2.mean(reference, mask=background_mask)[0]
+
+    def update(self, gray, foreground, shift=0.0):
+        """
+        把当前帧中药片以外的像素并入背景；药片挡住的像素看不到，只按整体的光照变化调整，
+        否则光照变化后药片周围的背景与模型的差异越来越大，会被当成药片的一部分
+        Args:
+            gray: 裁切后的灰度图（原始分辨率）
+            foreground: 前景二值图（任意分辨率，会放大到原始分辨率）
+            shift: 整体的光照变化（见 illumination_shift）
+        """
+        if cv2.countNonZero(foreground) > self.max_foreground_fraction * foreground.size:
+            return
+        # 在前景的分辨率上扩展掩码，再放大到原始分辨率
+        background_mask = self._background_mask(foreground)
+        if background_mask.shape != gray.shape:
+            background_mask = cv2.resize(background_mask, (gray.shape[1], gray.shape[0]),
+                                         interpolation=cv2.INTER_NEAREST)
+        cv2.accumulateWeighted(gray, self.mean, self.learning_rate, mask=background_mask)
+        if shift:
+            cv2.add(self.mean, self.learning_rate * shift, dst=self.mean, mask=cv2.bitwise_not(background_mask))
+        self.updates += 1
+        self.version += 1
+        self._images = {}
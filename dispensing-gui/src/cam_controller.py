@@ -131,10 +131,8 @@ class CamController(QObject):
                     # 初始化 pill counter（不使用摄像头，我们会传入帧）
                     if self.pill_counter is None:
                         self.pill_counter = PillCounter(camera_id=None)  # 不初始化摄像头
-                    # 重置 pill counter 状态
-                    self.pill_counter.background_captured = False
-                    self.pill_counter.stable_count = 0
-                    self.pill_counter.recent_edge_counts.clear()
+                    # 重置 pill counter 状态（保留背景模型：药盘与上次的背景吻合时不需要重新等待稳定）
+                    self.pill_counter.reset_background(keep_model=True)
                     self.pills_count_detected = 0
                 
                 # 发出模式改变信号
@@ -389,11 +387,16 @@ class CamController(QObject):
             # 如果 pill_counter 未初始化，创建一个（不使用摄像头）
             self.pill_counter = PillCounter(camera_id=None)
         
-        # 检测边缘以确定场景稳定性
-        edge_count, edges = self.pill_counter.detect_edges(frame)
+        # 这一帧的稳定性检测、背景捕捉和计数共用灰度、模糊等预处理结果
+        self.pill_counter.begin_frame(frame)
         
-        # 如果还没有背景，尝试捕捉
-        if not self.pill_counter.background_captured:
+        # 如果还没有背景，先尝试用背景模型恢复
+        if not self.pill_counter.background_captured and self.pill_counter.restore_background(frame):
+            cv2.putText(frame, 'Background restored!', (10, 30), 
+                       cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
+        # 否则检测边缘以确定场景稳定性，尝试捕捉
+        elif not self.pill_counter.background_captured:
+            edge_count, edges = self.pill_counter.detect_edges(frame)
             if self.pill_counter.is_scene_stable(edge_count):
                 self.pill_counter.capture_background(frame)
                 cv2.putText(frame, 'Background captured!', (10, 30), 
@@ -423,6 +426,7 @@ class CamController(QObject):
             if self.pills_count_callback:
                 self.pills_count_callback({
                     'total_count': pill_count,
+                    'background_confidence': self.pill_counter.background_confidence,
                     'timestamp': time.time(),
                     'method': 'pill_counter'
                 })
@@ -374,7 +374,8 @@ class MainController(QObject):
     def complete_dispensing(self):
         """Complete the dispensing process"""
         try:
-            self.rx_manager.upload_prescriptions_to_server()
+            # Only upload the prescriptions whose expiry date changed in this cycle
+            self.rx_manager.patch_prescriptions_to_server()
             self.is_dispensing = False
             self.monitor_timer.stop()
             print("[Dispensing] All medicines dispensed successfully")
@@ -12,6 +12,11 @@ class PatientPrescriptionManager:
         self.current_prescription_data = None
         self.current_dispensing_days = {}  # 存储每个药物的配药天数
         self.server_url = server_url
+        # 服务器数据版本，用于 If-None-Match 和 since 增量同步
+        self.server_etag = None
+        self.server_revision = None
+        # 本地修改但尚未提交到服务器的处方字段: {(patientId, medicine_name): {字段: 值}}
+        self.pending_changes = {}
 
     def load_prescriptions(self):
         """load prescriptions from server, if can't, read local prescriptions"""
@@ -58,10 +63,29 @@ class PatientPrescriptionManager:
     def fetch_online_prescriptions(self):
         """load prescriptions from server"""
         try:
-            response = requests.get(f"{self.server_url}/prescriptions", timeout=10)
+            # 已经从服务器同步过时，带上版本信息：没有变化返回304，有变化只返回变化的行
+            headers = {}
+            params = {}
+            if self.df is not None and self.server_revision is not None:
+                headers['If-None-Match'] = self.server_etag
+                params['since'] = self.server_revision
+            response = requests.get(f"{self.server_url}/prescriptions", headers=headers, params=params, timeout=10)
+            if response.status_code == 304:
+                print("[Info] Prescriptions unchanged on server")
+                return True
             if response.status_code == 200:
                 data = response.json()
                 if data.get('success'):
+                    self.server_etag = response.headers.get('ETag')
+                    self.server_revision = data.get('revision')
+
+                    if data.get('delta'):
+                        # 增量：合并变化的行，删除被删除的行
+                        self._apply_prescriptions_delta(data.get('data', []), data.get('deleted', []))
+                        print(f"[Info] Applied {len(data.get('data', []))} changed and "
+                              f"{len(data.get('deleted', []))} deleted prescriptions from server")
+                        return True
+
                     # 无论数据是否为空，都要处理
                     prescription_data = data.get('data', [])
                     
@@ -101,6 +125,35 @@ class PatientPrescriptionManager:
             print(f"[Error] Error fetching online prescriptions: {e}")
             return None  # 其他错误    
 
+    def _apply_prescriptions_delta(self, changed, deleted):
+        """
+        Merge incremental changes from server into self.df, keyed by (patientId, medicine_name)
+        Args:
+            changed: rows added or modified on server
+            deleted: keys ({patientId, medicine_name}) of rows removed on server
+        """
+        def key(row):
+            return (str(row.get('patientId')), str(row.get('medicine_name')))
+
+        changed_by_key = {key(row): row for row in changed}
+        deleted_keys = {key(row) for row in deleted}
+
+        # 保持原有行顺序：原地替换修改的行，新增的行追加在末尾
+        merged = []
+        for row in self.df.to_dict('records'):
+            row_key = key(row)
+            if row_key in deleted_keys:
+                continue
+            merged.append(changed_by_key.pop(row_key, row))
+        merged.extend(changed_by_key.values())
+
+        self.df = pd.DataFrame(merged, columns=self.df.columns if not merged else None)
+        if self.df.empty:
+            # write_local_prescriptions 不会写空表，这里直接写只有表头的CSV
+            self.df.to_csv(self.csv_file_path, index=False, encoding='utf-8')
+        else:
+            self.write_local_prescriptions()
+
     def upload_prescriptions_to_server(self):
         """Upload local prescriptions to server"""
         try:
@@ -148,6 +201,86 @@ class PatientPrescriptionManager:
             print(f"[Error] Error uploading prescriptions to server: {e}")
             return False
 
+    def patch_prescriptions_to_server(self, retry=True):
+        """
+        Upload only the locally changed prescription fields (PATCH /prescriptions)
+        
+        Args:
+            retry: on revision conflict, re-sync from server once and retry
+            
+        Returns:
+            bool: True if successful (or nothing to upload), False otherwise
+        """
+        if not self.pending_changes:
+            return True
+        
+        try:
+            upserts = [
+                {'patientId': patient_id, 'medicine_name': medicine_name, **fields}
+                for (patient_id, medicine_name), fields in self.pending_changes.items()
+            ]
+            payload = {"upserts": upserts}
+            if self.server_revision is not None:
+                payload["base_revision"] = self.server_revision
+            
+            response = requests.patch(
+                f"{self.server_url}/prescriptions",
+                json=payload,
+                headers={'Content-Type': 'application/json'},
+                timeout=10
+            )
+            
+            if response.status_code == 200:
+                result = response.json()
+                self.pending_changes = {}
+                # 期间服务器上没有其它修改时，本地数据已是最新，直接推进版本
+                if self.server_revision is not None and result.get('previous_revision') == self.server_revision:
+                    self.server_revision = result.get('revision')
+                    self.server_etag = None
+                print(f"[Info] Uploaded {len(upserts)} changed prescriptions to server")
+                return True
+            
+            if response.status_code == 409 and retry:
+                # 服务器上这些处方被修改过：先同步，再把本地修改重新应用后重试
+                print("[Warning] Prescription revision conflict, re-syncing from server")
+                pending = self.pending_changes
+                if self.fetch_online_prescriptions() is None:
+                    return False
+                self._reapply_pending_changes(pending)
+                return self.patch_prescriptions_to_server(retry=False)
+            
+            if response.status_code in (404, 405):
+                # 旧版本服务器没有增量接口，退回整表上传
+                print("[Warning] Server does not support incremental upload, uploading all prescriptions")
+                if self.upload_prescriptions_to_server():
+                    self.pending_changes = {}
+                    return True
+                return False
+            
+            print(f"[Error] Incremental upload failed with status code: {response.status_code}")
+            return False
+            
+        except requests.exceptions.RequestException as e:
+            print(f"[Error] Network error uploading prescription changes: {e}")
+            return False
+        except Exception as e:
+            print(f"[Error] Error uploading prescription changes to server: {e}")
+            return False
+
+    def _reapply_pending_changes(self, pending):
+        """Re-apply local changes on top of freshly synced data"""
+        self.pending_changes = pending
+        if self.df is None:
+            return
+        for (patient_id, medicine_name), fields in pending.items():
+            mask = (
+                (self.df['patientId'].astype(str) == patient_id) &
+                (self.df['medicine_name'] == medicine_name)
+            )
+            for field, value in fields.items():
+                self.df.loc[mask, field] = value
+        self.write_local_prescriptions()
+
     def get_patient_prescription(self, patientId):
         """
         Get patient prescription information by patient ID
@@ -425,6 +558,10 @@ class PatientPrescriptionManager:
                 # Update the DataFrame
                 self.df.loc[mask, 'last_dispensed_expiry_date'] = new_date
                 
+                # Remember the change for incremental upload
+                key = (str(patient_id), medicine_name)
+                self.pending_changes.setdefault(key, {})['last_dispensed_expiry_date'] = new_date
+                
                 # Save back to CSV file
                 self.df.to_csv(self.csv_file_path, index=False, encoding='utf-8')
                 print(f"[Info] Updated CSV: {medicine_name} expiry date -> {new_date}")
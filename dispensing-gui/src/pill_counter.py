@@ -1,7 +1,124 @@
 import cv2
 import numpy as np
-from collections import deque
-import statistics
+from collections import deque, namedtuple
+from background_model import BackgroundModel
+
+# 一帧中所有轮廓的形状特征（结构数组：每个字段是按轮廓编号排列的 NumPy 数组）
+ContourFeatures = namedtuple('ContourFeatures', [
+    'area', 'hull_area', 'aspect_ratio', 'perimeter', 'circularity', 'convexity', 'solidity'])
+
+
+def contour_features(contours):
+    """
+    一次计算一帧中所有轮廓的形状特征
+    面积（鞋带公式）、周长、外接矩形在拼接后的点数组上用 reduceat 按轮廓分段求和，
+    只有凸包需要逐个轮廓调用 OpenCV
+    Args:
+        contours: findContours 返回的轮廓列表
+    Returns:
+        ContourFeatures，没有轮廓时各字段为空数组
+    """
+    count = len(contours)
+    if count == 0:
+        empty = np.zeros(0)
+        return ContourFeatures(*([empty] * len(ContourFeatures._fields)))
+
+    lengths = np.array([len(contour) for contour in contours])
+    starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    points = np.concatenate(contours).reshape(-1, 2).astype(np.float64)
+    x, y = points[:, 0], points[:, 1]
+
+    # 每个点的下一个点（每个轮廓的最后一个点连回第一个点）
+    following = np.arange(1, len(points) + 1)
+    following[starts + lengths - 1] = starts
+    next_x, next_y = x[following], y[following]
+
+    area = np.abs(np.add.reduceat(x * next_y - next_x * y, starts)) / 2
+    perimeter = np.add.reduceat(np.hypot(next_x - x, next_y - y), starts)
+
+    # 外接矩形（与 cv2.boundingRect 相同，宽高包含两端的像素）
+    width = np.maximum.reduceat(x, starts) - np.minimum.reduceat(x, starts) + 1
+    height = np.maximum.reduceat(y, starts) - np.minimum.reduceat(y, starts) + 1
+    aspect_ratio = np.maximum(width, height) / np.minimum(width, height)
+
+    hull_area = np.array([cv2.contourArea(cv2.convexHull(contour)) for contour in contours])
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        convexity = np.where(hull_area > 0, area / hull_area, 0.0)
+        # 圆形度 (4*pi*area/perimeter^2)
+        circularity = np.where(perimeter > 0, 4 * np.pi * area / (perimeter * perimeter), 0.0)
+
+    return ContourFeatures(area, hull_area, aspect_ratio, perimeter, circularity, convexity, convexity)
+
+
+def scaled_size(shape, scale):
+    """图像按比例缩小后的 (宽, 高)"""
+    height, width = shape[:2]
+    return max(1, int(round(width * scale))), max(1, int(round(height * scale)))
+
+
+class FrameContext:
+    """
+    一帧的预处理上下文
+    裁切、灰度、缩小、模糊后的图像（以及二值图）在同一帧内只计算一次，稳定性检测、背景捕捉、
+    计数和调试显示共用；结果写入跨帧复用的缓冲区（OpenCV 的 dst= 参数），分辨率不变时每帧不再分配新图像。
+    注意：返回的图像在处理下一帧时会被覆盖，需要保留时请复制
+    """
+    def __init__(self):
+        self.frame = None
+        self.cropped = None
+        self._buffers = {}  # 名称 -> 复用的缓冲区
+        self._planes = {}   # 名称 -> 这一帧已经计算好的图像
+
+    def begin(self, frame, crop_margin):
+        """
+        开始处理新的一帧
+        Args:
+            frame: 当前帧
+            crop_margin: 裁切边距
+        """
+        h, w = frame.shape[:2]
+        self.frame = frame
+        self.cropped = frame[crop_margin:h-crop_margin, crop_margin:w-crop_margin]
+        self._planes.clear()
+
+    def buffer(self, name, shape):
+        """名称对应的 uint8 缓冲区，尺寸变化时重新分配"""
+        buffer = self._buffers.get(name)
+        if buffer is None or buffer.shape != shape:
+            buffer = self._buffers[name] = np.empty(shape, dtype=np.uint8)
+        return buffer
+
+    def plane(self, name, compute):
+        """这一帧中名称对应的图像，第一次用到时调用 compute() 计算"""
+        image = self._planes.get(name)
+        if image is None:
+            image = self._planes[name] = compute()
+        return image
+
+    def gray(self):
+        """裁切后的灰度图"""
+        return self.plane('gray', lambda: cv2.cvtColor(
+            self.cropped, cv2.COLOR_BGR2GRAY, dst=self.buffer('gray', self.cropped.shape[:2])))
+
+    def scaled_gray(self, scale):
+        """按比例缩小的灰度图"""
+        if scale == 1.0:
+            return self.gray()
+
+        def compute():
+            size = scaled_size(self.cropped.shape, scale)
+            return cv2.resize(self.gray(), size, dst=self.buffer(('gray', scale), (size[1], size[0])),
+                              interpolation=cv2.INTER_AREA)
+        return self.plane(('gray', scale), compute)
+
+    def blurred(self, scale=1.0):
+        """按比例缩小后高斯模糊的灰度图"""
+        def compute():
+            gray = self.scaled_gray(scale)
+            return cv2.GaussianBlur(gray, (5, 5), 0, dst=self.buffer(('blurred', scale), gray.shape))
+        return self.plane(('blurred', scale), compute)
+
 
 class PillCounter:
     def __init__(self, camera_id=1):
@@ -15,7 +132,6 @@ class PillCounter:
         else:
             self.cap = None
             
-        self.background = None
         self.background_captured = False
 
         self.edge_threshold = 1000  # 边缘检测阈值
@@ -28,6 +144,36 @@ class PillCounter:
         
         # 形态学操作参数
         self.morph_kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3))
+        # 轮廓分离：先腐蚀断开粘连，再膨胀恢复大小
+        self.separation_kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3))
+        self.recovery_kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (4, 4))
+        
+        # 处理金字塔：稳定性检测在 1/4 分辨率的灰度图上进行；
+        # 分割默认在原始分辨率上进行，也可以根据标定的药片面积降采样，轮廓再映射回原始分辨率绘制
+        self.stability_scale = 0.25
+        self.processing_scales = (1.0, 0.5, 0.25)  # 可选的分割分辨率
+        # 降采样后单个药片至少要有的面积（像素），再小时形态学操作会改变计数。
+        # 多个随机种子的合成药盘上，降采样后药片面积不到约800像素时都出现过计数与原始分辨率不同
+        self.min_scaled_pill_area = 1000
+        # 默认固定在原始分辨率；None 表示根据标定的药片面积自动选择（药片很大时才会降采样），
+        # 也可以固定为 processing_scales 中的比例
+        self.processing_scale = 1.0
+        self.calibrated_pill_area = None  # 单个药片的面积（原始分辨率），捕捉背景后第一次计数时标定
+        self._scaled_kernels = {}  # (核大小, 比例) -> 结构元素
+        self._background_version = 0  # 每次捕捉/恢复背景加一，缓存的二值图随之失效
+        
+        # 自适应背景模型：计数时跟踪光照变化，换药盘后画面与模型吻合时直接恢复背景
+        self.background_model = BackgroundModel()
+        self.diff_threshold = 40  # 背景减法的二值化阈值
+        self.background_update_interval = 2  # 每隔几帧把药片以外的像素并入背景（0 表示不更新）
+        self.min_background_confidence = 0.3  # 背景置信度低于这个值时提示重新捕捉背景
+        self.restore_confidence = 0.7  # 恢复背景需要的单帧置信度
+        self.restore_frames_needed = 3  # 连续多少帧与背景模型吻合才恢复背景
+        self._restore_count = 0
+        self._frames_since_update = 0
+        
+        # 当前帧的预处理上下文：各个步骤共用灰度、模糊等中间图像，缓冲区跨帧复用
+        self.frame_context = FrameContext()
         
         # 轮廓过滤参数
         self.min_contour_area = 50
@@ -50,19 +196,54 @@ class PillCounter:
         return frame[self.crop_margin:h-self.crop_margin, 
                     self.crop_margin:w-self.crop_margin]
         
+    @staticmethod
+    def resize(image, scale):
+        """按比例缩小图像（比例为1时原样返回）"""
+        if scale == 1.0:
+            return image
+        return cv2.resize(image, scaled_size(image.shape, scale), interpolation=cv2.INTER_AREA)
+    
+    def begin_frame(self, frame):
+        """
+        开始处理新的一帧（每读到一帧调用一次），之后对这一帧的各个步骤共用预处理结果
+        直接调用各个步骤时，传入的帧与当前帧不是同一个对象会自动开始新的一帧；
+        如果摄像头把新帧读到同一个数组里，必须先调用本方法
+        Args:
+            frame: 当前帧
+        Returns:
+            FrameContext
+        """
+        self.frame_context.begin(frame, self.crop_margin)
+        return self.frame_context
+    
+    def context_for(self, frame):
+        """frame 对应的预处理上下文"""
+        if self.frame_context.frame is not frame:
+            return self.begin_frame(frame)
+        return self.frame_context
+    
+    def scaled_kernel(self, size, scale):
+        """按分割分辨率缩放的椭圆结构元素（边长至少为1）"""
+        key = (size, scale)
+        kernel = self._scaled_kernels.get(key)
+        if kernel is None:
+            scaled = max(1, int(round(size * scale)))
+            kernel = self._scaled_kernels[key] = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (scaled, scaled))
+        return kernel
+    
     def detect_edges(self, frame):
         """
-        检测图像中的边缘
+        检测图像中的边缘（在 stability_scale 分辨率的灰度图上）
         Args:
             frame: 输入图像
         Returns:
-            edge_count: 边缘像素数量
+            edge_count: 边缘像素数量，换算到原始分辨率（边缘长度与分辨率成正比），阈值不随比例变化
+            edges: 缩小后的边缘图
         """
-        cropped = self.crop_frame(frame)
-        gray = cv2.cvtColor(cropped, cv2.COLOR_BGR2GRAY)
-        blurred = cv2.GaussianBlur(gray, (5, 5), 0)
-        edges = cv2.Canny(blurred, 50, 150)
-        edge_count = np.sum(edges > 0)
+        context = self.context_for(frame)
+        blurred = context.blurred(self.stability_scale)
+        edges = cv2.Canny(blurred, 50, 150, edges=context.buffer('edges', blurred.shape))
+        edge_count = int(cv2.countNonZero(edges) / self.stability_scale)
         return edge_count, edges
     
     def is_scene_stable(self, edge_count):
@@ -96,36 +277,153 @@ class PillCounter:
         Args:
             frame: 当前帧
         """
-        cropped = self.crop_frame(frame)
-        gray = cv2.cvtColor(cropped, cv2.COLOR_BGR2GRAY)
-        self.background = cv2.GaussianBlur(gray, (5, 5), 0)
-        self.background_captured = True
+        self.background_model.initialize(self.context_for(frame).gray())
+        self._activate_background()
         print("背景已捕捉")
     
-    def preprocess_image(self, frame):
+    def _activate_background(self):
+        """捕捉或恢复背景后开始计数"""
+        self._background_version += 1
+        # 换了背景（例如换了药盘或药品）后重新标定药片大小
+        self.calibrated_pill_area = None
+        self._restore_count = 0
+        self._frames_since_update = 0
+        self.background_captured = True
+    
+    def reset_background(self, keep_model=True):
+        """
+        重新捕捉背景
+        Args:
+            keep_model: 是否保留背景模型。保留时（切换模式、换药盘）画面与模型吻合就能直接恢复，
+                        不保留时（按 'b'）必须重新等待场景稳定
+        """
+        self.background_captured = False
+        self.stable_count = 0
+        self.recent_edge_counts.clear()
+        self._restore_count = 0
+        if not keep_model:
+            self.background_model.reset()
+    
+    def restore_background(self, frame):
+        """
+        尝试用保存的背景模型恢复背景：连续 restore_frames_needed 帧中，药片以外的区域与模型吻合
+        （单帧置信度不低于 restore_confidence）时直接开始计数，不需要重新等待场景稳定
+        Args:
+            frame: 当前帧
+        Returns:
+            bool: 是否已恢复
+        """
+        if not self.background_model.ready:
+            return False
+        diff, foreground = self._tracking_difference(self.context_for(frame))
+        confidence = self.background_model.match(diff, foreground)
+        
+        self._restore_count = self._restore_count + 1 if confidence >= self.restore_confidence else 0
+        if self._restore_count < self.restore_frames_needed:
+            return False
+        self.background_model.confidence = confidence
+        self._activate_background()
+        print(f"背景已恢复（置信度 {confidence:.2f}）")
+        return True
+    
+    @property
+    def background(self):
+        """原始分辨率下模糊后的背景，还没有背景时为None"""
+        return self.scaled_background(1.0) if self.background_model.ready else None
+    
+    @property
+    def background_confidence(self):
+        """背景模型的置信度（0~1）"""
+        return self.background_model.confidence
+    
+    def scaled_background(self, scale):
+        """某个分辨率下的背景（与当前帧的处理顺序相同：先缩小再模糊）"""
+        return self.background_model.image(scale, self.resize)
+    
+    def track_background(self, frame):
+        """
+        自适应背景：用这一帧药片以外的区域估计背景置信度，
+        每隔 background_update_interval 帧把药片以外的像素并入背景模型
+        Args:
+            frame: 当前帧
+        Returns:
+            confidence: 平滑后的背景置信度（0~1）
+        """
+        context = self.context_for(frame)
+        diff, foreground = self._tracking_difference(context)
+        confidence = self.background_model.observe(diff, foreground)
+        
+        if self.background_update_interval:
+            self._frames_since_update += 1
+            if self._frames_since_update >= self.background_update_interval:
+                self._frames_since_update = 0
+                # 这一帧已经计算好的二值图仍然使用更新前的背景，下一帧开始使用新背景
+                shift = self.background_model.illumination_shift(
+                    context.blurred(self.stability_scale), self.scaled_background(self.stability_scale), foreground)
+                self.background_model.update(context.gray(), foreground, shift)
+        return confidence
+    
+    def _tracking_difference(self, context):
+        """
+        背景跟踪和恢复用的背景减法：在稳定性检测的分辨率上进行，代价很小
+        Returns:
+            diff: 与背景的差值图
+            foreground: 二值化后的前景
+        """
+        def compute():
+            scale = self.stability_scale
+            diff = cv2.absdiff(self.scaled_background(scale), context.blurred(scale))
+            _, foreground = cv2.threshold(diff, self.diff_threshold, 255, cv2.THRESH_BINARY)
+            return diff, foreground
+        return context.plane(('tracking', self.background_model.version), compute)
+    
+    def segmentation_scale(self):
+        """
+        选择分割的分辨率
+        固定了 processing_scale 时直接使用；否则在标定了药片面积后，选择药片仍不小于
+        min_scaled_pill_area 的最小比例，还没有标定时使用原始分辨率
+        """
+        if self.processing_scale is not None:
+            return self.processing_scale
+        if not self.calibrated_pill_area:
+            return 1.0
+        for scale in sorted(self.processing_scales):
+            if self.calibrated_pill_area * scale * scale >= self.min_scaled_pill_area:
+                return scale
+        return 1.0
+    
+    def preprocess_image(self, frame, scale=1.0):
         """
         图像预处理：背景减法、二值化和腐蚀操作
         Args:
             frame: 当前帧
+            scale: 分割分辨率（相对裁切后的画面），形态学操作的核按比例缩小
         Returns:
-            binary: 预处理后的二值化图像
+            binary: 预处理后的二值化图像（scale 分辨率，同一帧内只计算一次）
         """
-        cropped = self.crop_frame(frame)
-        gray = cv2.cvtColor(cropped, cv2.COLOR_BGR2GRAY)
-        blurred = cv2.GaussianBlur(gray, (5, 5), 0)
+        context = self.context_for(frame)
+        return context.plane(('binary', scale, self._background_version),
+                             lambda: self._binarize(context, scale))
+    
+    def _binarize(self, context, scale):
+        """背景减法、二值化和腐蚀，中间结果写入上下文的缓冲区"""
+        blurred = context.blurred(scale)
+        shape = blurred.shape
         
         # 背景减法
-        diff = cv2.absdiff(self.background, blurred)
+        diff = cv2.absdiff(self.scaled_background(scale), blurred, dst=context.buffer(('diff', scale), shape))
         
         # 二值化，使用更严格的阈值
-        _, binary = cv2.threshold(diff, 40, 255, cv2.THRESH_BINARY)
+        _, binary = cv2.threshold(diff, self.diff_threshold, 255, cv2.THRESH_BINARY,
+                                  dst=context.buffer(('threshold', scale), shape))
         
         # 形态学操作去除噪声，保持分离效果
-        binary = cv2.morphologyEx(binary, cv2.MORPH_OPEN, self.morph_kernel)
+        binary = cv2.morphologyEx(binary, cv2.MORPH_OPEN, self.scaled_kernel(3, scale),
+                                  dst=context.buffer(('opened', scale), shape))
         
         # 腐蚀操作：断开轻微相连的轮廓
-        erosion_kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (6, 6))
-        binary = cv2.erode(binary, erosion_kernel, iterations=2)
+        binary = cv2.erode(binary, self.scaled_kernel(6, scale), dst=context.buffer(('binary', scale), shape),
+                           iterations=2)
         
         # # 膨胀操作：恢复轮廓大小，但保持分离效果
         # dilation_kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (5, 5))
@@ -141,57 +439,59 @@ class PillCounter:
         Returns:
             dict: 形状特征字典
         """
-        area = cv2.contourArea(contour)
-        
-        # 计算轮廓的边界矩形
-        x, y, w, h = cv2.boundingRect(contour)
-        aspect_ratio = max(w, h) / min(w, h) if min(w, h) > 0 else 0
-        
-        # 计算凸包
-        hull = cv2.convexHull(contour)
-        hull_area = cv2.contourArea(hull)
-        convexity = area / hull_area if hull_area > 0 else 0
-        
-        # 计算实心度 (solidity)
-        solidity = area / hull_area if hull_area > 0 else 0
-        
-        # 计算周长
-        perimeter = cv2.arcLength(contour, True)
+        features = contour_features([contour])
+        return {field: float(getattr(features, field)[0])
+                for field in ('area', 'aspect_ratio', 'convexity', 'solidity', 'circularity', 'perimeter')}
+    
+    def classify_single_pills(self, features):
+        """
+        判断每个轮廓是否为单个药片（更严格的判断）
+        Args:
+            features: contour_features() 的结果
+        Returns:
+            布尔数组：是否为单个药片
+        """
+        # 面积过滤
+        in_range = (features.area >= self.min_contour_area) & (features.area <= self.max_contour_area)
         
-        # 计算圆形度 (4*pi*area/perimeter^2)
-        circularity = 4 * np.pi * area / (perimeter * perimeter) if perimeter > 0 else 0
+        # 多重判断条件
+        is_convex = features.convexity >= self.convexity_threshold
+        is_solid = features.solidity >= self.solidity_threshold
+        is_reasonable_ratio = features.aspect_ratio <= self.aspect_ratio_threshold
+        is_circular_enough = features.circularity > 0.3  # 不能太细长
         
-        return {
-            'area': area,
-            'aspect_ratio': aspect_ratio,
-            'convexity': convexity,
-            'solidity': solidity,
-            'circularity': circularity,
-            'perimeter': perimeter
-        }
+        # 综合判断：必须同时满足多个条件
+        return in_range & is_convex & is_solid & is_reasonable_ratio & is_circular_enough
     
     def is_single_pill(self, contour):
         """
-        判断轮廓是否为单个药片（更严格的判断）
+        判断轮廓是否为单个药片
         Args:
             contour: 输入轮廓
         Returns:
             bool: 是否为单个药片
         """
-        features = self.analyze_contour_shape(contour)
-        
-        # 面积过滤
-        if features['area'] < self.min_contour_area or features['area'] > self.max_contour_area:
-            return False
+        return bool(self.classify_single_pills(contour_features([contour]))[0])
+    
+    def estimate_pills_by_area(self, areas, reference_area):
+        """
+        基于面积估算每个轮廓中的药片数量
+        Args:
+            areas: 轮廓面积数组
+            reference_area: 参考药片面积
+        Returns:
+            estimated_counts: 估算的药片数量（整数数组）
+        """
+        areas = np.asarray(areas, dtype=np.float64)
+        if reference_area == 0:
+            return np.ones(len(areas), dtype=int)
         
-        # 多重判断条件
-        is_convex = features['convexity'] >= self.convexity_threshold
-        is_solid = features['solidity'] >= self.solidity_threshold
-        is_reasonable_ratio = features['aspect_ratio'] <= self.aspect_ratio_threshold
-        is_circular_enough = features['circularity'] > 0.3  # 不能太细长
+        ratio = areas / reference_area
         
-        # 综合判断：必须同时满足多个条件
-        return is_convex and is_solid and is_reasonable_ratio and is_circular_enough
+        # 更精确的估算：<0.7 是噪声，其余按面积比分档，超过 4.8 倍时四舍五入
+        counts = np.searchsorted(np.array([1.2, 2.4, 3.6, 4.8]), ratio, side='left') + 1
+        counts = np.where(ratio < 0.7, 0, counts)
+        return np.where(ratio > 4.8, np.maximum(1, np.round(ratio)), counts).astype(int)
     
     def detect_multiple_pills_by_area(self, contour, reference_area):
         """
@@ -202,25 +502,7 @@ class PillCounter:
         Returns:
             estimated_count: 估算的药片数量
         """
-        if reference_area == 0:
-            return 1
-        
-        contour_area = cv2.contourArea(contour)
-        ratio = contour_area / reference_area
-        
-        # 更精确的估算
-        if ratio < 0.7:
-            return 0  # 太小，可能是噪声
-        elif ratio <= 1.2:
-            return 1  # 单个药片
-        elif ratio <= 2.4:
-            return 2  # 两个药片
-        elif ratio <= 3.6:
-            return 3  # 三个药片
-        elif ratio <= 4.8:
-            return 4  # 三个药片
-        else:
-            return max(1, round(ratio))  # 更多药片
+        return int(self.estimate_pills_by_area([cv2.contourArea(contour)], reference_area)[0])
     
     def detect_multiple_pills_by_geometry(self, contour):
         """
@@ -240,28 +522,26 @@ class PillCounter:
         
         return 1
     
-    def calculate_reference_area(self, single_pill_contours):
+    def calculate_reference_area(self, single_pill_areas):
         """
         计算参考药片面积（使用中位数更稳定）
         Args:
-            single_pill_contours: 单个药片轮廓列表
+            single_pill_areas: 单个药片的面积数组
         Returns:
             reference_area: 参考面积
         """
-        if not single_pill_contours:
+        areas = np.asarray(single_pill_areas, dtype=np.float64)
+        if areas.size == 0:
             return 0
         
-        areas = [cv2.contourArea(contour) for contour in single_pill_contours]
-        
         # 使用中位数
-        median_area = statistics.median(areas)
+        median_area = float(np.median(areas))
         
         # 过滤异常值（距离中位数太远的值）
-        filtered_areas = [area for area in areas 
-                         if 0.6 * median_area <= area <= 1.4 * median_area]
+        filtered_areas = areas[(areas >= 0.6 * median_area) & (areas <= 1.4 * median_area)]
         
-        if filtered_areas:
-            return statistics.median(filtered_areas)
+        if filtered_areas.size:
+            return float(np.median(filtered_areas))
         else:
             return median_area
     
@@ -277,82 +557,69 @@ class PillCounter:
         if not self.background_captured:
             return 0, frame
         
-        # # 裁切画面
-        cropped_frame = self.crop_frame(frame)
+        # 分割分辨率：标定药片大小后药片足够大时降采样处理
+        scale = self.segmentation_scale()
         
         # 预处理图像（包含腐蚀分离）
-        binary = self.preprocess_image(frame)
+        binary = self.preprocess_image(frame, scale)
+        
+        # 跟踪背景的光照变化
+        self.track_background(frame)
         # cv2.imshow("第一次腐蚀操作", binary)
         # 额外的轮廓分离处理
-        processed_binary = self.separate_contours(binary)
+        processed_binary = self.separate_contours(binary, scale)
         # cv2.imshow("第二次腐蚀操作", binary)
         
         # 查找轮廓
         contours, _ = cv2.findContours(processed_binary, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
         
-        # 过滤轮廓
-        valid_contours = []
-        for contour in contours:
-            area = cv2.contourArea(contour)
-            if self.min_contour_area <= area <= self.max_contour_area:
-                valid_contours.append(contour)
+        # 每个轮廓的形状特征只计算一次，之后的过滤、分类和估算都在特征数组上进行
+        features = contour_features(contours)
+        if scale != 1.0:
+            # 面积和周长换算到原始分辨率，阈值和参考面积不随分辨率变化
+            features = features._replace(area=features.area / (scale * scale),
+                                         hull_area=features.hull_area / (scale * scale),
+                                         perimeter=features.perimeter / scale)
         
-        if not valid_contours:
+        # 过滤轮廓
+        valid = (features.area >= self.min_contour_area) & (features.area <= self.max_contour_area)
+        if not valid.any():
             return 0, frame
         
         # 分类轮廓
-        single_pill_contours = []
-        multiple_pill_contours = []
-        
-        for contour in valid_contours:
-            if self.is_single_pill(contour):
-                single_pill_contours.append(contour)
-            else:
-                multiple_pill_contours.append(contour)
+        single = self.classify_single_pills(features)
+        multiple = valid & ~single
         
         # 计算参考面积
-        reference_area = self.calculate_reference_area(single_pill_contours)
+        reference_area = self.calculate_reference_area(features.area[single])
 
-        # 将大于基准面积120%的single_pill_contours 打入 multiple_pill_contours
+        # 将大于基准面积120%的单个药片轮廓重新分类为多药片
+        reclassified = np.zeros(len(contours), dtype=bool)
         if reference_area > 0:
             area_threshold = reference_area * 1.2  # 改回120%阈值，更精确
-            final_single_contours = []
-            reclassified_contours = []
-            
-            for contour in single_pill_contours:
-                contour_area = cv2.contourArea(contour)
-                if contour_area > area_threshold:
-                    # 面积过大，重新分类为多药片
-                    multiple_pill_contours.append(contour)
-                    reclassified_contours.append(contour)
-                    print(f"轮廓重新分类: 面积{contour_area:.0f} > 阈值{area_threshold:.0f}")
-                else:
-                    # 保持为单个药片
-                    final_single_contours.append(contour)
-            
-            # 更新单个药片轮廓列表
-            single_pill_contours = final_single_contours
+            reclassified = single & (features.area > area_threshold)
+            for contour_area in features.area[reclassified]:
+                print(f"轮廓重新分类: 面积{contour_area:.0f} > 阈值{area_threshold:.0f}")
+            single &= ~reclassified
+            multiple |= reclassified
             
             # 重新计算参考面积（基于重新分类后的单个药片）
-            if single_pill_contours:
-                reference_area = self.calculate_reference_area(single_pill_contours)
+            if single.any():
+                reference_area = self.calculate_reference_area(features.area[single])
         
-            print(f"重新分类完成: 单个药片{len(single_pill_contours)}个, 多药片{len(multiple_pill_contours)}个")
-        else:
-            reclassified_contours = []
+            print(f"重新分类完成: 单个药片{int(single.sum())}个, 多药片{int(multiple.sum())}个")
+            
+            # 第一次得到参考面积时标定药片大小，之后的帧据此选择分割分辨率
+            if self.calibrated_pill_area is None:
+                self.calibrated_pill_area = reference_area
         
-        # 计算总药片数量
-        total_pills = len(single_pill_contours)  # 单个药片直接计数
+        # 计算总药片数量：单个药片直接计数，多药片轮廓按面积估算
+        # （基于几何特征的估算 detect_multiple_pills_by_geometry 目前不参与计数）
+        total_pills = int(single.sum()) + int(self.estimate_pills_by_area(features.area[multiple], reference_area).sum())
         
-        # 处理多药片轮廓
-        for contour in multiple_pill_contours:
-            # 结合面积和几何特征估算
-            estimated_pills = area_estimate = self.detect_multiple_pills_by_area(contour, reference_area)
-            # geometry_estimate = self.detect_multiple_pills_by_geometry(contour)
-            
-            # # 取较大值作为最终估算（更保守）
-            # estimated_pills = max(area_estimate, geometry_estimate)
-            total_pills += estimated_pills
+        single_pill_contours = [contours[i] for i in np.flatnonzero(single)]
+        multiple_pill_contours = [contours[i] for i in np.flatnonzero(multiple)]
+        reclassified_contours = [contours[i] for i in np.flatnonzero(reclassified)]
         
         # 绘制结果（在原始frame上，考虑裁切偏移）
         result_frame = frame.copy()
@@ -364,23 +631,12 @@ class PillCounter:
                      (w-self.crop_margin, h-self.crop_margin), 
                      (255, 255, 0), 2)
         
-        # 调整轮廓坐标（考虑裁切偏移）
-        offset_single = []
-        offset_multiple = []
-        offset_reclassified = []
-        
-        for contour in single_pill_contours:
-            offset_contour = contour + [self.crop_margin, self.crop_margin]
-            offset_single.append(offset_contour)
-        
-        for contour in multiple_pill_contours:
-            offset_contour = contour + [self.crop_margin, self.crop_margin]
-            offset_multiple.append(offset_contour)
+        # 调整轮廓坐标（映射回原始分辨率，并考虑裁切偏移）
+        offset_single = [self.to_frame_coordinates(contour, scale) for contour in single_pill_contours]
+        offset_multiple = [self.to_frame_coordinates(contour, scale) for contour in multiple_pill_contours]
         
         # 单独处理重新分类的轮廓，用于特殊显示
-        for contour in reclassified_contours:
-            offset_contour = contour + [self.crop_margin, self.crop_margin]
-            offset_reclassified.append(offset_contour)
+        offset_reclassified = [self.to_frame_coordinates(contour, scale) for contour in reclassified_contours]
         
         # 绘制轮廓
         cv2.drawContours(result_frame, offset_single, -1, (0, 255, 0), 2)  # 绿色：单个药片
@@ -401,41 +657,52 @@ class PillCounter:
                    cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 165, 255), 2)
         cv2.putText(result_frame, f"Ref Area: {reference_area:.0f}", (10, 190), 
                    cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 255), 2)
+        # 背景置信度过低时（光照突变、药盘移动）计数可能不准，提示重新捕捉背景
+        if self.background_confidence < self.min_background_confidence:
+            cv2.putText(result_frame, f"BG Confidence: {self.background_confidence:.2f} (press 'b')", (10, 230), 
+                       cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 255), 2)
+        else:
+            cv2.putText(result_frame, f"BG Confidence: {self.background_confidence:.2f}", (10, 230), 
+                       cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 255), 2)
         
         return total_pills, result_frame
     
-    def separate_contours(self, binary):
+    def to_frame_coordinates(self, contour, scale=1.0):
+        """
+        把分割分辨率下的轮廓坐标映射回原始画面
+        Args:
+            contour: 轮廓（scale 分辨率、裁切后画面的坐标）
+            scale: 分割分辨率
+        Returns:
+            原始画面坐标的轮廓
+        """
+        if scale != 1.0:
+            # 像素中心对齐：缩小后的像素 p 覆盖原始像素 [p/scale, (p+1)/scale)
+            contour = np.round((contour + 0.5) / scale - 0.5).astype(np.int32)
+        return contour + [self.crop_margin, self.crop_margin]
+    
+    def separate_contours(self, binary, scale=1.0):
         """
         额外的轮廓分离处理
+        以前对每个连通组件单独膨胀再合并（每个组件都要处理一张整帧的掩码，药片多时很慢）。
+        膨胀对并集可分配：各组件膨胀结果的并集 = 所有组件（即腐蚀后的图像）整体膨胀，
+        所以一次膨胀得到的结果与逐个组件处理完全相同
         Args:
             binary: 输入二值化图像
+            scale: 分割分辨率，形态学操作的核按比例缩小
         Returns:
             separated_binary: 分离后的二值化图像
         """
-        # 使用更强的腐蚀来分离粘连的轮廓
-        separation_kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3))
-        eroded = cv2.erode(binary, separation_kernel, iterations=2)
-        
-        # 查找连通组件
-        num_labels, labels, stats, centroids = cv2.connectedComponentsWithStats(eroded, connectivity=8)
-        
-        # 创建分离后的图像
-        separated = np.zeros_like(binary)
+        separation_kernel = self.separation_kernel if scale == 1.0 else self.scaled_kernel(3, scale)
+        recovery_kernel = self.recovery_kernel if scale == 1.0 else self.scaled_kernel(4, scale)
         
-        # 对每个连通组件进行膨胀恢复
-        recovery_kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (4, 4))
-        
-        for i in range(1, num_labels):  # 跳过背景标签0
-            # 提取单个连通组件
-            component_mask = (labels == i).astype(np.uint8) * 255
-            
-            # 膨胀恢复大小
-            recovered = cv2.dilate(component_mask, recovery_kernel, iterations=2)
-            
-            # 合并到结果图像
-            separated = cv2.bitwise_or(separated, recovered)
+        # 使用更强的腐蚀来分离粘连的轮廓
+        eroded = cv2.erode(binary, separation_kernel, dst=self.frame_context.buffer(('separation', scale), binary.shape),
+                           iterations=2)
         
-        return separated
+        # 膨胀恢复大小
+        return cv2.dilate(eroded, recovery_kernel, dst=self.frame_context.buffer(('separated', scale), binary.shape),
+                          iterations=2)
     
     def run(self):
         """
@@ -455,11 +722,12 @@ class PillCounter:
                 print("无法读取摄像头")
                 break
             
-            # 检测边缘
-            edge_count, edges = self.detect_edges(frame)
+            # 这一帧的各个步骤共用灰度、模糊和二值图
+            self.begin_frame(frame)
             
-            # 如果还没有背景，尝试捕捉
-            if not self.background_captured:
+            # 如果还没有背景，先尝试用背景模型恢复，否则检测边缘判断场景是否稳定，尝试捕捉
+            if not self.background_captured and not self.restore_background(frame):
+                edge_count, edges = self.detect_edges(frame)
                 if self.is_scene_stable(edge_count):
                     self.capture_background(frame)
                 else:
@@ -481,8 +749,8 @@ class PillCounter:
                 pill_count, result_frame = self.count_pills(frame)
                 cv2.imshow('Pill Counter', result_frame)
                 
-                # 显示二值化图像（调试用）
-                binary = self.preprocess_image(frame)
+                # 显示二值化图像（调试用，计数时已经计算过，直接取缓存）
+                binary = self.preprocess_image(frame, self.segmentation_scale())
                 cv2.imshow('Binary', binary)
             
             # 处理按键
@@ -490,9 +758,7 @@ class PillCounter:
             if key == ord('q'):
                 break
             elif key == ord('b'):
-                self.background_captured = False
-                self.stable_count = 0
-                self.recent_edge_counts.clear()
+                self.reset_background(keep_model=False)
                 print("重新捕捉背景...")
         
         if self.cap:
@@ -0,0 +1,156 @@
+"""
+自适应背景模型的模拟测试：光照漂移和换药盘
+
+用法（在 dispensing-gui 目录下运行）:
+    python tests/background_model_test.py [--pills 20] [--drift 60] [--frames 150]
+
+使用合成的药盘图像（见 benchmarks/tray_images.py），每一帧加上新的传感器噪声：
+1. 光照漂移：捕捉背景后整个画面的亮度在 --frames 帧内逐渐增加 --drift 个灰度级，
+   比较固定背景（以前的做法）和自适应背景每帧计数正确的比例
+2. 换药盘：计数一段时间后移走药盘（几帧被手挡住），换上亮度略有不同的空药盘，
+   比较重新等待场景稳定（以前切换模式时的做法）和用背景模型恢复需要的帧数，然后放上药片检查计数
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import sys
+
+import cv2
+import numpy as np
+
+BENCHMARK_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks')
+sys.path.insert(0, BENCHMARK_DIR)
+from tray_images import synthetic_background, synthetic_tray
+from pill_counter import PillCounter
+
+
+class FrameSource:
+    """给图像加上亮度偏移和每帧不同的噪声"""
+    def __init__(self, seed=0):
+        self.rng = np.random.default_rng(seed)
+
+    def frame(self, image, brightness=0.0):
+        noise = self.rng.normal(brightness, 2.0, image.shape[:2]).astype(np.float32)
+        return np.clip(image.astype(np.float32) + noise[..., None], 0, 255).astype(np.uint8)
+
+
+def process(counter, frame):
+    """
+    与 CamController._process_pills_count 相同的流程
+    Returns:
+        药片数，背景还没有准备好时为None
+    """
+    counter.begin_frame(frame)
+    if not counter.background_captured and not counter.restore_background(frame):
+        edge_count, _ = counter.detect_edges(frame)
+        if counter.is_scene_stable(edge_count):
+            counter.capture_background(frame)
+        return None
+    pills, _ = counter.count_pills(frame)
+    return pills
+
+
+def hand_frame(background):
+    """手伸进画面挡住大半个药盘"""
+    frame = background.copy()
+    h, w = frame.shape[:2]
+    cv2.rectangle(frame, (w // 6, h // 8), (w * 5 // 6, h), (150, 170, 200), -1)
+    return frame
+
+
+def drift_test(args):
+    background = synthetic_background(seed=1)
+    tray = synthetic_tray(args.pills, seed=2, background=background)
+    results = {}
+    for name, adaptive in (('固定背景', False), ('自适应背景', True)):
+        counter = PillCounter(camera_id=None)
+        if not adaptive:
+            counter.background_update_interval = 0
+        source = FrameSource(seed=3)
+        correct = 0
+        first_wrong = None
+        counter.capture_background(source.frame(background))
+        for i in range(args.frames):
+            brightness = args.drift * i / (args.frames - 1)
+            pills = process(counter, source.frame(tray, brightness))
+            if pills == args.pills:
+                correct += 1
+            elif first_wrong is None:
+                first_wrong = brightness
+        results[name] = (correct, first_wrong, counter.background_confidence)
+
+    print(f"光照漂移 0 -> {args.drift:+g} 灰度级（{args.frames} 帧，{args.pills} 片药）:")
+    for name, (correct, first_wrong, confidence) in results.items():
+        wrong = '无' if first_wrong is None else f"{first_wrong:+.0f}"
+        print(f"  {name:<8} 计数正确 {correct}/{args.frames} 帧，第一次出错时亮度 {wrong}，最终置信度 {confidence:.2f}")
+    return results['自适应背景'][0] == args.frames
+
+
+def swap_test(args):
+    background = synthetic_background(seed=1)
+    tray_a = synthetic_tray(args.pills, seed=4, background=background)
+    # 换上的药盘亮度略有不同，药片数也不同
+    background_b = np.clip(background.astype(np.int16) + 4, 0, 255).astype(np.uint8)
+    tray_b = synthetic_tray(args.pills // 2 + 1, seed=5, background=background_b)
+    expected_b = args.pills // 2 + 1
+
+    results = {}
+    for name, keep_model in (('重新等待稳定', False), ('背景模型恢复', True)):
+        counter = PillCounter(camera_id=None)
+        source = FrameSource(seed=6)
+        counter.capture_background(source.frame(background))
+        for _ in range(10):
+            process(counter, source.frame(tray_a))
+
+        # 换患者：切换模式时重置背景，手挡住药盘几帧后换上空药盘
+        counter.reset_background(keep_model=keep_model)
+        for _ in range(5):
+            process(counter, source.frame(hand_frame(background)))
+        frames_to_ready = None
+        for i in range(60):
+            process(counter, source.frame(background_b))
+            if counter.background_captured:
+                frames_to_ready = i + 1
+                break
+
+        # 放上药片
+        counts = [process(counter, source.frame(tray_b)) for _ in range(5)]
+        results[name] = (frames_to_ready, counts[-1])
+
+    print(f"换药盘（新药盘亮度 +4，放 {expected_b} 片药）:")
+    for name, (frames_to_ready, pills) in results.items():
+        ready = '超过60帧' if frames_to_ready is None else f"{frames_to_ready} 帧"
+        print(f"  {name:<8} 空药盘出现后开始计数需要 {ready}，放上药片后计数 {pills}")
+    ready, pills = results['背景模型恢复']
+    return ready is not None and pills == expected_b
+
+
+def main():
+    parser = argparse.ArgumentParser(description='自适应背景模型的模拟测试')
+    parser.add_argument('--pills', type=int, default=20, help='药片数')
+    parser.add_argument('--drift', type=float, default=60, help='光照漂移的灰度级')
+    parser.add_argument('--frames', type=int, default=150, help='光照漂移测试的帧数')
+    args = parser.parse_args()
+
+    drift_ok = run_quietly(drift_test, args)
+    swap_ok = run_quietly(swap_test, args)
+    if not (drift_ok and swap_ok):
+        print("错误: 自适应背景没有达到预期")
+        sys.exit(1)
+    print("自适应背景模型测试通过")
+
+
+def run_quietly(test, args):
+    """运行测试，只输出测试自己的结果（PillCounter 的打印信息不输出）"""
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        ok = test(args)
+    lines = [line for line in output.getvalue().splitlines() if line.startswith(('光照', '换药盘', '  '))]
+    print('\n'.join(lines))
+    return ok
+
+
+if __name__ == '__main__':
+    main()
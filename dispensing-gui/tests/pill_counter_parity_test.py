@@ -0,0 +1,118 @@
+"""
+降采样分割与原始分辨率计数的一致性测试
+
+用法（在 dispensing-gui 目录下运行）:
+    python tests/pill_counter_parity_test.py [--images 录制数据目录] [--pills 5 20 50 100] [--sizes 22x14 44x28]
+                                             [--seeds 100 101 102] [--touching 0.2 0.3]
+
+录制数据的格式见 benchmarks/tray_images.py；不指定 --images 时对每种药片大小、药片数、贴着摆放的比例，
+用多个随机种子生成合成药盘（同一配置换一个种子就可能出现降采样后数错，只测一张不够）。
+对每张图像：
+1. 固定在原始分辨率计数（processing_scale=1.0），作为基准
+2. 自动选择分辨率：第一帧在原始分辨率计数并标定药片大小，第二帧按标定结果降采样计数，
+   计数必须与基准相同（允许的差别由 --tolerance 指定）
+3. 另外列出固定 1/2、1/4 分辨率的计数和耗时（仅供参考，不参与判断）
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import sys
+import time
+
+import numpy as np
+
+BENCHMARK_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks')
+sys.path.insert(0, BENCHMARK_DIR)
+from tray_images import load_recorded, synthetic_background, synthetic_tray
+from pill_counter import PillCounter
+
+# 合成药盘中药片最多占可摆放区域的比例（再多药片会大面积重叠，原始分辨率也数不准）
+MAX_COVERAGE = 0.3
+
+
+def count(counter, frame, repeat=1):
+    """计数 repeat 次，返回 (药片数, 每次耗时 ms)（count_pills 的打印信息不输出）"""
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            counter.begin_frame(frame)  # 每次都当作新的一帧，不使用上一次缓存的预处理结果
+            pills, _ = counter.count_pills(frame)
+        return pills, (time.perf_counter() - start) / repeat * 1000
+
+
+def new_counter(background, processing_scale=None):
+    counter = PillCounter(camera_id=None)
+    counter.processing_scale = processing_scale
+    with contextlib.redirect_stdout(io.StringIO()):
+        counter.capture_background(background)
+    return counter
+
+
+def parse_size(text):
+    major, minor = text.lower().split('x')
+    return int(major), int(minor)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='降采样分割与原始分辨率计数的一致性测试')
+    parser.add_argument('--images', help='录制的药盘图像目录（默认使用合成图像）')
+    parser.add_argument('--pills', type=int, nargs='+', default=[5, 20, 50, 100], help='合成图像的药片数')
+    parser.add_argument('--sizes', nargs='+', default=['22x14', '32x20', '44x28', '60x38'],
+                        help='合成药片的半长轴x半短轴（像素）')
+    parser.add_argument('--seeds', type=int, nargs='+', default=list(range(100, 110)), help='合成图像的随机种子')
+    parser.add_argument('--touching', type=float, nargs='+', default=[0.2, 0.3], help='合成药片贴着摆放的比例')
+    parser.add_argument('--tolerance', type=int, default=0, help='自动分辨率允许与基准相差的药片数')
+    parser.add_argument('--repeat', type=int, default=3, help='测量耗时的重复次数')
+    args = parser.parse_args()
+
+    if args.images:
+        background, samples = load_recorded(args.images)
+        datasets = [(background, samples)]
+    else:
+        datasets = []
+        for size in map(parse_size, args.sizes):
+            background = synthetic_background()
+            height, width = background.shape[:2]
+            margin = 50 + max(size) * 2
+            tray_area = (width - 2 * margin) * (height - 2 * margin)
+            samples = []
+            for pills in args.pills:
+                if pills * np.pi * size[0] * size[1] > MAX_COVERAGE * tray_area:
+                    print(f"跳过 {pills} 片 {size[0]}x{size[1]} 的药片：药盘放不下")
+                    continue
+                for touching in args.touching:
+                    for seed in args.seeds:
+                        samples.append((pills, f"{pills}_{size[0]}x{size[1]}_t{touching:g}_s{seed}.png",
+                                        synthetic_tray(pills, seed, background, size, touching)))
+            datasets.append((background, samples))
+
+    print(f"{'图像':<28}{'实际':>6}{'原始':>6}{'原始ms':>9}{'自动比例':>9}{'自动':>6}{'自动ms':>9}"
+          f"{'1/2':>6}{'1/2 ms':>9}{'1/4':>6}{'1/4 ms':>9}")
+    failures = 0
+    for background, samples in datasets:
+        for pills, name, frame in samples:
+            full_count, full_ms = count(new_counter(background, 1.0), frame, args.repeat)
+
+            auto = new_counter(background)
+            count(auto, frame)  # 第一帧标定药片大小
+            auto_scale = auto.segmentation_scale()
+            auto_count, auto_ms = count(auto, frame, args.repeat)
+
+            half_count, half_ms = count(new_counter(background, 0.5), frame, args.repeat)
+            quarter_count, quarter_ms = count(new_counter(background, 0.25), frame, args.repeat)
+
+            ok = abs(auto_count - full_count) <= args.tolerance
+            failures += not ok
+            print(f"{name:<28}{pills:>6}{full_count:>6}{full_ms:>9.2f}{auto_scale:>9.2f}{auto_count:>6}{auto_ms:>9.2f}"
+                  f"{half_count:>6}{half_ms:>9.2f}{quarter_count:>6}{quarter_ms:>9.2f}{'' if ok else '  不一致'}")
+
+    if failures:
+        print(f"错误: {failures} 张图像自动分辨率的计数与原始分辨率不同")
+        sys.exit(1)
+    print("自动分辨率的计数与原始分辨率一致")
+
+
+if __name__ == '__main__':
+    main()
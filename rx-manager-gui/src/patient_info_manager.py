@@ -22,6 +22,9 @@ class PatientInfoManager:
             self.csv_file_path = csv_file_path
         self.server_url = server_url.rstrip('/')
         self.patient_df = None
+        # Server data version, used for If-None-Match and since-based delta sync
+        self.server_etag = None
+        self.server_revision = None
 
         # Load patients from server or local csv file
         self.load_patient_list()
@@ -181,12 +184,26 @@ class PatientInfoManager:
     def fetch_online_patient_list(self) -> bool:
         """load patient list from server"""
         try:
-            response = requests.get(f"{self.server_url}/patients", timeout=10)
-            
+            # Send version info once synced: 304 if unchanged, only changed rows otherwise
+            headers = {}
+            params = {}
+            if self.patient_df is not None and self.server_revision is not None:
+                headers['If-None-Match'] = self.server_etag
+                params['since'] = self.server_revision
+            response = requests.get(f"{self.server_url}/patients", headers=headers, params=params, timeout=10)
+            
+            if response.status_code == 304:
+                print("Patient list unchanged on server")
+                return True
             if response.status_code == 200:
                 data = response.json()
                 if data.get('success'):
+                    self.server_etag = response.headers.get('ETag')
+                    self.server_revision = data.get('revision')
                     patients_data = data.get('data', [])
+
+                    if data.get('delta'):
+                        patients_data = self._merge_patients_delta(patients_data, data.get('deleted', []))
                     
                     if patients_data:
                         # 有数据：转换为DataFrame
@@ -236,6 +253,29 @@ class PatientInfoManager:
             return None  # 其他错误
 
 
+    def _merge_patients_delta(self, changed: List[Dict], deleted: List[Dict]) -> List[Dict]:
+        """
+        Merge incremental changes from server into the current patient list, keyed by patientId
+        
+        Args:
+            changed: Patients added or modified on server
+            deleted: Keys ({patientId}) of patients removed on server
+            
+        Returns:
+            List[Dict]: Full merged patient list, in the original order
+        """
+        changed_by_id = {str(patient.get('patientId')): patient for patient in changed}
+        deleted_ids = {str(patient.get('patientId')) for patient in deleted}
+        
+        merged = []
+        for patient in self.patient_df.to_dict('records'):
+            patient_id = str(patient.get('patientId'))
+            if patient_id in deleted_ids:
+                continue
+            merged.append(changed_by_id.pop(patient_id, patient))
+        merged.extend(changed_by_id.values())
+        return merged
+
     def upload_patient_list(self) -> bool:
         """upload self.patient_df to server"""
         try:
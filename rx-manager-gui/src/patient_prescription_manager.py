@@ -9,6 +9,9 @@ class PatientPrescriptionManager:
         self.df = None
         self.csv_file_path = "local_prescriptions_data.csv"
         self.server_url = server_url
+        # 服务器数据版本，用于 If-None-Match 和 since 增量同步
+        self.server_etag = None
+        self.server_revision = None
 
 ####################
 # For Loading Data #
@@ -58,10 +61,29 @@ class PatientPrescriptionManager:
     def fetch_online_prescriptions(self):
         """load prescriptions from server"""
         try:
-            response = requests.get(f"{self.server_url}/prescriptions", timeout=10)
+            # 已经从服务器同步过时，带上版本信息：没有变化返回304，有变化只返回变化的行
+            headers = {}
+            params = {}
+            if self.df is not None and self.server_revision is not None:
+                headers['If-None-Match'] = self.server_etag
+                params['since'] = self.server_revision
+            response = requests.get(f"{self.server_url}/prescriptions", headers=headers, params=params, timeout=10)
+            if response.status_code == 304:
+                print("[Info] Prescriptions unchanged on server")
+                return True
             if response.status_code == 200:
                 data = response.json()
                 if data.get('success'):
+                    self.server_etag = response.headers.get('ETag')
+                    self.server_revision = data.get('revision')
+
+                    if data.get('delta'):
+                        # 增量：合并变化的行，删除被删除的行
+                        self._apply_prescriptions_delta(data.get('data', []), data.get('deleted', []))
+                        print(f"[Info] Applied {len(data.get('data', []))} changed and "
+                              f"{len(data.get('deleted', []))} deleted prescriptions from server")
+                        return True
+
                     # 无论数据是否为空，都要处理
                     prescription_data = data.get('data', [])
                     
@@ -101,6 +123,35 @@ class PatientPrescriptionManager:
             print(f"[Error] Error fetching online prescriptions: {e}")
             return None  # 其他错误           
 
+    def _apply_prescriptions_delta(self, changed, deleted):
+        """
+        Merge incremental changes from server into self.df, keyed by (patientId, medicine_name)
+        Args:
+            changed: rows added or modified on server
+            deleted: keys ({patientId, medicine_name}) of rows removed on server
+        """
+        def key(row):
+            return (str(row.get('patientId')), str(row.get('medicine_name')))
+
+        changed_by_key = {key(row): row for row in changed}
+        deleted_keys = {key(row) for row in deleted}
+
+        # 保持原有行顺序：原地替换修改的行，新增的行追加在末尾
+        merged = []
+        for row in self.df.to_dict('records'):
+            row_key = key(row)
+            if row_key in deleted_keys:
+                continue
+            merged.append(changed_by_key.pop(row_key, row))
+        merged.extend(changed_by_key.values())
+
+        self.df = pd.DataFrame(merged, columns=self.df.columns if not merged else None)
+        if self.df.empty:
+            # write_local_prescriptions 不会写空表，这里直接写只有表头的CSV
+            self.df.to_csv(self.csv_file_path, index=False, encoding='utf-8')
+        else:
+            self.write_local_prescriptions()
+
     def upload_prescriptions_to_server(self):
         """Upload local prescriptions to server"""
         try:
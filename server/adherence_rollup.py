@@ -0,0 +1,201 @@
+"""
+服药依从性日汇总
+
+护士想知道“这周哪些患者漏服了”，以前要逐天打开任务文件，再像 manage_tasks 那样关联患者表和时间段表。
+这里每天结束后把当天的任务汇总成一张很小的表，按月保存为 data/adherence_<YYYY-MM>.csv：
+- level=patient: 每个患者一行（任务数、已服药数、延迟服药数、漏服的时间段），记录当时负责的护工
+- level=auntie:  每个护工一行
+- level=slot:    每个时间段一行
+一个月的汇总只有几万行，按周、按月统计时只读汇总表（按表格签名缓存并按日期建立索引），不再读取任务。
+“延迟服药”指完成时间晚于时间段结束时间 LATE_GRACE_MINUTES 分钟以上。
+"""
+
+import threading
+from collections import OrderedDict
+
+ROLLUP_FIELDNAMES = ['date', 'level', 'key', 'auntieId', 'total', 'completed', 'late', 'missed']
+LEVELS = ('patient', 'auntie', 'slot')
+COMPLETED_STATUS = '已服药'
+
+# 完成时间晚于时间段结束多少分钟算延迟服药
+LATE_GRACE_MINUTES = 30
+
+
+def _minutes(hhmm):
+    """'07:35' -> 455，格式错误时返回None"""
+    try:
+        hour, minute = hhmm.split(':')[:2]
+        return int(hour) * 60 + int(minute)
+    except (AttributeError, ValueError):
+        return None
+
+
+def slot_deadlines(timeslots, grace=LATE_GRACE_MINUTES):
+    """时间段名称 -> 晚于这个时间（分钟）完成算延迟"""
+    deadlines = {}
+    for slot in timeslots:
+        try:
+            deadlines[slot['name']] = int(slot.get('endHour') or 0) * 60 + grace
+        except ValueError:
+            continue
+    return deadlines
+
+
+def rollup_day(date_str, tasks, patient_aunties, deadlines):
+    """
+    汇总某一天的任务
+    Args:
+        date_str: 日期
+        tasks: 任务字典列表
+        patient_aunties: patientId -> auntieId
+        deadlines: slot_deadlines() 的结果
+    Returns:
+        汇总行（字段见 ROLLUP_FIELDNAMES）
+    """
+    counters = {level: OrderedDict() for level in LEVELS}
+    for task in tasks:
+        patient_id = task.get('patientId', '')
+        slot = task.get('timeSlotName', '')
+        auntie_id = patient_aunties.get(patient_id, '')
+        completed = task.get('status') == COMPLETED_STATUS
+        finished_at = _minutes(task.get('completionTime')) if completed else None
+        late = completed and finished_at is not None and slot in deadlines and finished_at > deadlines[slot]
+        for level, key in (('patient', patient_id), ('auntie', auntie_id), ('slot', slot)):
+            entry = counters[level].get(key)
+            if entry is None:
+                entry = counters[level][key] = {'auntieId': auntie_id if level != 'slot' else '',
+                                                'total': 0, 'completed': 0, 'late': 0, 'missed': []}
+            entry['total'] += 1
+            entry['completed'] += completed
+            entry['late'] += late
+            if level == 'patient' and not completed:
+                entry['missed'].append(slot)
+
+    rows = []
+    for level in LEVELS:
+        for key, entry in counters[level].items():
+            rows.append({'date': date_str, 'level': level, 'key': key, 'auntieId': entry['auntieId'],
+                         'total': entry['total'], 'completed': entry['completed'], 'late': entry['late'],
+                         'missed': ';'.join(entry['missed'])})
+    return rows
+
+
+class AdherenceRollups:
+    def __init__(self, read_rows, write_rows, signature, list_files, data_dir='data'):
+        """
+        初始化日汇总存储
+        Args:
+            read_rows: 读取表格的函数，返回只读行
+            write_rows: 写入表格的函数 (filename, rows, fieldnames)
+            signature: 计算表格签名的函数，表不存在时返回None
+            list_files: 列出数据目录下所有表格文件名的函数
+            data_dir: 数据目录
+        """
+        self.read_rows = read_rows
+        self.write_rows = write_rows
+        self.signature = signature
+        self.list_files = list_files
+        self.data_dir = data_dir
+        self._lock = threading.Lock()
+        self._months = {}  # 月份 -> (签名, {日期: {级别: [汇总行]}})
+
+    def month_filename(self, month):
+        return f"{self.data_dir}/adherence_{month}.csv"
+
+    def _month_index(self, month):
+        """某个月的汇总按 日期 -> 级别 建立索引（按表格签名缓存），没有汇总时返回空字典"""
+        filename = self.month_filename(month)
+        signature = self.signature(filename)
+        if signature is None:
+            return {}
+        with self._lock:
+            cached = self._months.get(month)
+            if cached is not None and cached[0] == signature:
+                return cached[1]
+        index = {}
+        for row in self.read_rows(filename):
+            index.setdefault(row['date'], {}).setdefault(row['level'], []).append({
+                'key': row['key'], 'auntieId': row['auntieId'], 'total': int(row['total']),
+                'completed': int(row['completed']), 'late': int(row['late']),
+                'missed': row['missed'].split(';') if row['missed'] else []})
+        with self._lock:
+            self._months[month] = (signature, index)
+        return index
+
+    def rolled_up_dates(self):
+        """所有已经汇总的日期"""
+        dates = set()
+        for filename in self.list_files(self.data_dir):
+            if filename.startswith('adherence_') and filename.endswith('.csv'):
+                dates.update(self._month_index(filename[len('adherence_'):-len('.csv')]))
+        return dates
+
+    def save_days(self, rows_by_date):
+        """
+        保存若干天的汇总（同一天已有的汇总被替换），每个月只写一次
+        Args:
+            rows_by_date: {日期: rollup_day() 的结果}
+        """
+        by_month = {}
+        for date_str, rows in rows_by_date.items():
+            by_month.setdefault(date_str[:7], {})[date_str] = rows
+        for month, days in sorted(by_month.items()):
+            filename = self.month_filename(month)
+            try:
+                existing = [row for row in self.read_rows(filename) if row['date'] not in days]
+            except FileNotFoundError:
+                existing = []
+            merged = existing + [row for date_str in sorted(days) for row in days[date_str]]
+            merged.sort(key=lambda row: row['date'])
+            self.write_rows(filename, merged, ROLLUP_FIELDNAMES)
+
+    def summarize(self, dates, level, auntie_id=None, extra_days=None):
+        """
+        按级别汇总若干天
+        Args:
+            dates: 日期字符串列表
+            level: patient / auntie / slot
+            auntie_id: 只统计这个护工负责的患者。slot 级别的行不区分护工（auntieId 为空），
+                       与 auntie_id 一起使用时不会匹配任何行，调用方需要先拒绝这种组合
+            extra_days: {日期: {级别: [汇总行]}}，尚未保存的日期（例如今天）
+        Returns:
+            groups: {key: {'total', 'completed', 'late', 'missed': [(日期, [时间段])], 'auntieId'}}
+            covered: 有汇总数据的日期列表
+        """
+        groups = {}
+        covered = []
+        for date_str in sorted(dates):
+            day = (extra_days or {}).get(date_str)
+            if day is None:
+                day = self._month_index(date_str[:7]).get(date_str)
+            if day is None:
+                continue
+            covered.append(date_str)
+            for row in day.get(level, ()):
+                if auntie_id is not None and row['auntieId'] != auntie_id:
+                    continue
+                entry = groups.get(row['key'])
+                if entry is None:
+                    entry = groups[row['key']] = {'auntieId': row['auntieId'], 'total': 0, 'completed': 0,
+                                                  'late': 0, 'missed': []}
+                entry['total'] += row['total']
+                entry['completed'] += row['completed']
+                entry['late'] += row['late']
+                if row['missed']:
+                    entry['missed'].append((date_str, row['missed']))
+        return groups, covered
+
+    def stats(self):
+        with self._lock:
+            return {'cached_months': len(self._months)}
+
+
+def index_rows(rows):
+    """rollup_day() 的结果 -> {级别: [汇总行]}（与 AdherenceRollups 内部的格式相同）"""
+    index = {}
+    for row in rows:
+        index.setdefault(row['level'], []).append({
+            'key': row['key'], 'auntieId': row['auntieId'], 'total': row['total'],
+            'completed': row['completed'], 'late': row['late'],
+            'missed': row['missed'].split(';') if row['missed'] else []})
+    return index
@@ -0,0 +1,79 @@
+"""
+分级、缓冲的日志
+
+以前路由和后台任务里到处是 print(f"[{time.ctime()}] ...")：每次请求都要格式化时间、
+在请求线程里同步写标准输出，生产环境也无法关掉。这里统一使用标准库 logging：
+- 各模块用 get_logger(__name__) 获取日志器，按级别输出（DEBUG / INFO / WARNING / ERROR）
+- 请求线程只把日志记录放进队列（QueueHandler），由单独的线程（QueueListener）格式化并写出，
+  输出慢（终端、管道、磁盘）时不会拖慢请求
+- 级别由环境变量 EZDOSE_LOG_LEVEL 或 config.json 的 log_level 决定，默认 INFO；
+  每次请求都会打印的访问日志是 DEBUG 级别，生产环境设为 INFO 或 WARNING 即可关掉
+- config.json 的 log_file 指定时同时写入按大小轮转的日志文件
+"""
+
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+
+ROOT_LOGGER = 'ezdose'
+LOG_FORMAT = '[%(asctime)s] %(levelname)s %(name)s: %(message)s'
+
+# 日志文件轮转：单个文件大小和保留个数
+LOG_FILE_MAX_BYTES = 10 * 1024 * 1024
+LOG_FILE_BACKUPS = 5
+
+_listener = None
+
+
+def get_logger(name):
+    """
+    获取某个模块的日志器
+    Args:
+        name: 模块名（通常是 __name__），日志器挂在 ezdose 下面，共用同一套输出
+    """
+    return logging.getLogger(f"{ROOT_LOGGER}.{name}")
+
+
+def setup_logging(level=None, log_file=None):
+    """
+    配置日志输出（重复调用时只修改级别）
+    Args:
+        level: 日志级别名称，为None时使用环境变量 EZDOSE_LOG_LEVEL，默认 INFO
+        log_file: 同时写入的日志文件路径
+    """
+    global _listener
+    root = logging.getLogger(ROOT_LOGGER)
+    level_name = (os.environ.get('EZDOSE_LOG_LEVEL') or level or 'INFO').upper()
+    root.setLevel(getattr(logging, level_name, logging.INFO))
+    if _listener is not None:
+        return
+
+    formatter = logging.Formatter(LOG_FORMAT)
+    handlers = [logging.StreamHandler(sys.stdout)]
+    if log_file:
+        log_dir = os.path.dirname(log_file)
+        if log_dir:
+            os.makedirs(log_dir, exist_ok=True)
+        handlers.append(logging.handlers.RotatingFileHandler(
+            log_file, maxBytes=LOG_FILE_MAX_BYTES, backupCount=LOG_FILE_BACKUPS, encoding='utf-8'))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue = queue.SimpleQueue()
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+    root.propagate = False
+    _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    # 退出前把队列里剩下的日志写完
+    atexit.register(flush_logging)
+
+
+def flush_logging():
+    """停止后台写日志的线程并写完队列中剩余的日志"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
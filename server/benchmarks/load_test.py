@@ -0,0 +1,224 @@
+"""
+多进程部署的压力测试：吞吐量随 worker 数量的变化
+
+用法（在 server 目录下运行，需要安装 gunicorn）:
+    python benchmarks/load_test.py [--workers 1 2 4] [--clients 16] [--duration 10]
+
+对每个 worker 数量：
+1. 把 server 目录复制到临时目录（不修改真实数据），用 gunicorn.conf.py 启动 wsgi:app
+2. 启动 --clients 个客户端进程，各自用长连接循环请求 /tasks?date=<今天> 和 /patients
+3. 统计每个接口的吞吐量（请求/秒）和延迟（p50 / p99）
+4. 跨进程一致性检查：通过一个连接修改任务状态后，用新连接多次读取（会落到不同的 worker 上），
+   每次都必须看到修改后的状态，并且 ETag 相同（测试数据中没有当天任务时，先在临时副本中新增一条处方）
+"""
+
+import argparse
+import http.client
+import json
+import multiprocessing
+import os
+import shutil
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def copy_server(target):
+    """复制代码和数据，跳过运行时生成的文件"""
+    shutil.copytree(SERVER_DIR, target, ignore=shutil.ignore_patterns('__pycache__', '.locks', '*.journal'))
+
+
+def start_server(workdir, port, workers, threads, worker_class='gthread'):
+    env = dict(os.environ, EZDOSE_BIND=f'127.0.0.1:{port}', EZDOSE_WORKERS=str(workers),
+               EZDOSE_THREADS=str(threads), EZDOSE_WORKER_CLASS=worker_class, EZDOSE_SCHEDULER='0')
+    process = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'wsgi:app'],
+                               cwd=workdir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=2)
+            conn.request('GET', '/patients')
+            conn.getresponse().read()
+            conn.close()
+            return process
+        except OSError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError('gunicorn 启动超时')
+
+
+def stop_server(process):
+    process.send_signal(signal.SIGTERM)
+    try:
+        process.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+def client_main(port, paths, duration, headers, results):
+    """客户端进程：长连接循环请求，返回 {path: [延迟ms]} 和错误数"""
+    latencies = {path: [] for path in paths}
+    errors = 0
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    deadline = time.perf_counter() + duration
+    i = 0
+    while time.perf_counter() < deadline:
+        path = paths[i % len(paths)]
+        i += 1
+        t0 = time.perf_counter()
+        try:
+            conn.request('GET', path, headers=headers)
+            response = conn.getresponse()
+            response.read()
+            if response.status != 200:
+                errors += 1
+                continue
+        except (OSError, http.client.HTTPException):
+            errors += 1
+            conn.close()
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+            continue
+        latencies[path].append((time.perf_counter() - t0) * 1000)
+    conn.close()
+    results.put((latencies, errors))
+
+
+def run_load(port, paths, clients, duration, headers):
+    results = multiprocessing.Queue()
+    processes = [multiprocessing.Process(target=client_main, args=(port, paths, duration, headers, results))
+                 for _ in range(clients)]
+    for process in processes:
+        process.start()
+    merged = {path: [] for path in paths}
+    errors = 0
+    for _ in processes:
+        latencies, client_errors = results.get()
+        errors += client_errors
+        for path, samples in latencies.items():
+            merged[path].extend(samples)
+    for process in processes:
+        process.join()
+    return merged, errors
+
+
+def request_json(port, method, path, body=None):
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+    payload = json.dumps(body).encode('utf-8') if body is not None else None
+    conn.request(method, path, body=payload, headers={'Content-Type': 'application/json'})
+    response = conn.getresponse()
+    data = response.read()
+    conn.close()
+    return response.status, response.getheader('ETag'), json.loads(data) if data else None
+
+
+def add_test_prescription(port, date_str):
+    """为第一个患者新增一条从 date_str 开始的处方（只修改临时副本中的数据）"""
+    _, _, patients = request_json(port, 'GET', '/patients')
+    if not patients:
+        return False
+    patient = patients[0]
+    status, _, _ = request_json(port, 'PATCH', '/packer/prescriptions', {'upserts': [{
+        'patient_name': patient['patientName'], 'patientId': patient['patientId'],
+        'medicine_name': 'load-test', 'morning_dosage': '1', 'noon_dosage': '1', 'evening_dosage': '1',
+        'meal_timing': 'after', 'start_date': date_str, 'duration_days': '1', 'pill_size': 'M'
+    }]})
+    return status == 200
+
+
+def check_consistency(port, date_str, reads):
+    """修改一个任务后从多个新连接读取，检查所有 worker 都看到了修改"""
+    status, _, tasks = request_json(port, 'GET', f'/tasks?date={date_str}')
+    if status == 200 and not tasks:
+        # 当天没有任务：换一个还没有任务文件的日期，先新增处方
+        date_str = (date.today() + timedelta(days=30)).strftime('%Y-%m-%d')
+        if add_test_prescription(port, date_str):
+            status, _, tasks = request_json(port, 'GET', f'/tasks?date={date_str}')
+    if status != 200 or not tasks:
+        return None
+    task = tasks[0]
+    marker = f"load-test-{time.time_ns()}"
+    status, _, _ = request_json(port, 'PUT', '/task', {
+        'date': date_str, 'patientId': task['patientId'], 'timeSlotName': task['timeSlotName'],
+        'status': task['status'], 'completionTime': task.get('completionTime', ''), 'remark': marker
+    })
+    if status != 200:
+        return False, 0, 0
+    stale = 0
+    etags = set()
+    for _ in range(reads):
+        _, etag, rows = request_json(port, 'GET', f'/tasks?date={date_str}')
+        etags.add(etag)
+        row = next((r for r in rows if r['patientId'] == task['patientId']
+                    and r['timeSlotName'] == task['timeSlotName']), None)
+        if row is None or row.get('remark') != marker:
+            stale += 1
+    return stale == 0 and len(etags) == 1, stale, len(etags)
+
+
+def percentile(samples, q):
+    if not samples:
+        return float('nan')
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * q))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='多进程部署压力测试')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4], help='worker 进程数')
+    parser.add_argument('--threads', type=int, default=4, help='每个 worker 的线程数')
+    parser.add_argument('--clients', type=int, default=16, help='并发客户端进程数')
+    parser.add_argument('--duration', type=float, default=10, help='每轮压测秒数')
+    parser.add_argument('--port', type=int, default=5077)
+    parser.add_argument('--gzip', action='store_true', help='请求头带 Accept-Encoding: gzip')
+    args = parser.parse_args()
+
+    try:
+        import gunicorn  # noqa: F401
+    except ImportError:
+        print("需要先安装 gunicorn: pip install gunicorn")
+        sys.exit(1)
+
+    date_str = date.today().strftime('%Y-%m-%d')
+    paths = [f'/tasks?date={date_str}', '/patients']
+    headers = {'Accept-Encoding': 'gzip'} if args.gzip else {}
+    print(f"CPU核数 {multiprocessing.cpu_count()}，{args.clients} 个客户端，每轮 {args.duration:g} 秒")
+    print(f"{'workers':>7} {'path':<24} {'req/s':>9} {'p50 ms':>8} {'p99 ms':>8} {'errors':>7}")
+
+    baseline = None
+    for workers in args.workers:
+        with tempfile.TemporaryDirectory() as tmp:
+            workdir = os.path.join(tmp, 'server')
+            copy_server(workdir)
+            process = start_server(workdir, args.port, workers, args.threads)
+            try:
+                # 预热：创建今天的任务文件、填充各 worker 的缓存
+                for _ in range(workers * 4):
+                    for path in paths:
+                        request_json(args.port, 'GET', path)
+                latencies, errors = run_load(args.port, paths, args.clients, args.duration, headers)
+                consistency = check_consistency(args.port, date_str, workers * 8)
+            finally:
+                stop_server(process)
+
+        total = sum(len(samples) for samples in latencies.values()) / args.duration
+        for path, samples in latencies.items():
+            print(f"{workers:>7} {path:<24} {len(samples) / args.duration:>9.0f} "
+                  f"{statistics.median(samples) if samples else float('nan'):>8.2f} "
+                  f"{percentile(samples, 0.99):>8.2f} {errors:>7}")
+        baseline = baseline or total
+        print(f"{workers:>7} {'total':<24} {total:>9.0f}   ({total / baseline:.2f}x)")
+        if consistency is None:
+            print("        一致性检查跳过：没有可以修改的任务")
+        else:
+            ok, stale, etag_count = consistency
+            print(f"        一致性检查: {'通过' if ok else '失败'}（读到旧数据 {stale} 次，不同ETag {etag_count} 个）")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""
+登录接口并发压测
+
+用法（在 server 目录下运行）:
+    python benchmarks/login_benchmark.py [--users 300] [--workers 32] [--rounds 2] [--plaintext]
+
+在临时目录中生成 --users 个护工/护士账号（默认保存哈希密码，--plaintext 模拟迁移前的明文），
+用 Flask 测试客户端模拟换班时所有设备同时登录，每一轮所有账号各登录一次，
+输出每一轮的 p50 / p99 延迟和吞吐量。第一轮需要计算pbkdf2，之后的轮次命中已验证缓存。
+"""
+
+import argparse
+import contextlib
+import csv
+import io
+import os
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SERVER_DIR)
+
+from credentials import hash_password, AUNTIE_FIELDNAMES, CAREGIVER_FIELDNAMES  # noqa: E402
+
+
+def write_accounts(data_dir, n_users, plaintext):
+    os.makedirs(data_dir, exist_ok=True)
+    n_caregivers = max(1, n_users // 10)
+    hashed = {}
+
+    def stored(password):
+        if plaintext:
+            return password
+        if password not in hashed:
+            hashed[password] = hash_password(password)
+        return hashed[password]
+
+    with open(os.path.join(data_dir, 'caregivers.csv'), 'w', encoding='utf-8-sig', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=CAREGIVER_FIELDNAMES)
+        writer.writeheader()
+        for i in range(n_caregivers):
+            writer.writerow({'caregiverId': i + 1, 'name': f'护士{i}', 'username': f'hushi{i}',
+                             'password': stored(f'pw{i % 10}')})
+    with open(os.path.join(data_dir, 'aunties.csv'), 'w', encoding='utf-8-sig', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=AUNTIE_FIELDNAMES)
+        writer.writeheader()
+        for i in range(n_users - n_caregivers):
+            writer.writerow({'auntieId': i + 1, 'name': f'护工{i}', 'username': f'hugong{i}',
+                             'password': stored(f'pw{i % 10}'), 'caregiverId': i % n_caregivers + 1})
+
+    return ([(f'hushi{i}', f'pw{i % 10}') for i in range(n_caregivers)] +
+            [(f'hugong{i}', f'pw{i % 10}') for i in range(n_users - n_caregivers)])
+
+
+def percentile(values, p):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='登录接口并发压测')
+    parser.add_argument('--users', type=int, default=300)
+    parser.add_argument('--workers', type=int, default=32, help='并发线程数')
+    parser.add_argument('--rounds', type=int, default=2)
+    parser.add_argument('--plaintext', action='store_true', help='使用迁移前的明文密码')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        accounts = write_accounts(os.path.join(work_dir, 'data'), args.users, args.plaintext)
+        os.chdir(work_dir)
+        # 屏蔽服务器导入和登录时的控制台输出，避免影响计时
+        with contextlib.redirect_stdout(io.StringIO()):
+            import main_packer
+        app = main_packer.app
+
+        def login(account):
+            client = app.test_client()
+            start = time.perf_counter()
+            response = client.post('/login', json={'username': account[0], 'password': account[1]})
+            elapsed = (time.perf_counter() - start) * 1000
+            assert response.status_code == 200, response.get_data(as_text=True)
+            return elapsed
+
+        for round_no in range(1, args.rounds + 1):
+            with contextlib.redirect_stdout(io.StringIO()):
+                start = time.perf_counter()
+                with ThreadPoolExecutor(max_workers=args.workers) as pool:
+                    latencies = list(pool.map(login, accounts))
+                total = time.perf_counter() - start
+            print(f"第{round_no}轮: {len(latencies)} 次登录, "
+                  f"p50={statistics.median(latencies):.2f}ms, p99={percentile(latencies, 99):.2f}ms, "
+                  f"吞吐={len(latencies) / total:.0f} 次/秒")
+
+
+if __name__ == '__main__':
+    main()
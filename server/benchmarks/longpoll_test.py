@@ -0,0 +1,110 @@
+"""
+长轮询通知的压力测试：大量空闲连接下的唤醒延迟
+
+用法（在 server 目录下运行，需要安装 gunicorn 和 gevent）:
+    python benchmarks/longpoll_test.py [--connections 2000] [--workers 2] [--worker-class gevent]
+
+1. 把 server 目录复制到临时目录，用 gunicorn 启动 wsgi:app，在一个还没有任务的日期上新增一条处方
+2. 打开 --connections 个 /tasks/watch 长轮询连接（一半按 auntieId 筛选），全部挂起等待
+3. 通过 PUT /task 修改一个任务，统计所有连接从修改到收到响应的延迟；
+   落在其它 worker 上的连接要等后台线程发现日志变化（默认1秒内）
+超过每个 worker 等待连接上限（EZDOSE_MAX_TASK_WATCHERS）的连接立即返回503，不计为失败；
+gthread 下上限只有线程数的一半，用来确认普通请求（PUT /task）不会被空闲连接挡住
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from load_test import (add_test_prescription, copy_server, percentile, request_json,  # noqa: E402
+                       start_server, stop_server)
+
+
+async def long_poll(port, path, ready, results):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    writer.write(f"GET {path} HTTP/1.1\r\nHost: 127.0.0.1\r\nConnection: close\r\n\r\n".encode('ascii'))
+    await writer.drain()
+    ready.append(1)
+    data = await reader.read()
+    writer.close()
+    results.append((time.perf_counter(), data))
+
+
+async def run(args, port, date_str, revision, auntie_id, change):
+    ready = []
+    results = []
+    tasks = []
+    for i in range(args.connections):
+        query = f"date={date_str}&since={revision}&timeout=60"
+        if i % 2 and auntie_id:
+            query += f"&auntieId={auntie_id}"
+        tasks.append(asyncio.create_task(long_poll(port, f"/tasks/watch?{query}", ready, results)))
+        if i % 200 == 199:
+            await asyncio.sleep(0.05)
+    while len(ready) < args.connections:
+        await asyncio.sleep(0.05)
+    # 等所有请求都进入等待
+    await asyncio.sleep(args.settle)
+    early = len(results)
+
+    t0 = time.perf_counter()
+    status, _, _ = await asyncio.to_thread(request_json, port, 'PUT', '/task', change)
+    await asyncio.gather(*tasks)
+    latencies = [(t - t0) * 1000 for t, _ in results[early:]]
+    ok = sum(1 for _, data in results if b' 200 ' in data.split(b'\r\n', 1)[0] and b'"delta":true' in data)
+    rejected = sum(1 for _, data in results if b' 503 ' in data.split(b'\r\n', 1)[0])
+    return status, early, latencies, ok, rejected
+
+
+def main():
+    parser = argparse.ArgumentParser(description='长轮询通知压力测试')
+    parser.add_argument('--connections', type=int, default=2000, help='同时挂起的长轮询连接数')
+    parser.add_argument('--workers', type=int, default=2, help='worker 进程数')
+    parser.add_argument('--worker-class', default='gevent', help='gunicorn worker 类型（gevent / gthread）')
+    parser.add_argument('--threads', type=int, default=4, help='gthread 时每个 worker 的线程数')
+    parser.add_argument('--settle', type=float, default=2, help='连接全部建立后再等待多少秒才修改任务')
+    parser.add_argument('--port', type=int, default=5079)
+    args = parser.parse_args()
+
+    date_str = (date.today() + timedelta(days=30)).strftime('%Y-%m-%d')
+    with tempfile.TemporaryDirectory() as tmp:
+        workdir = os.path.join(tmp, 'server')
+        copy_server(workdir)
+        process = start_server(workdir, args.port, args.workers, args.threads, args.worker_class)
+        try:
+            if not add_test_prescription(args.port, date_str):
+                print("测试数据中没有患者，无法测试")
+                sys.exit(1)
+            # /tasks 会根据处方创建当天的任务文件，/tasks/watch 只读取
+            request_json(args.port, 'GET', f'/tasks?date={date_str}')
+            _, _, body = request_json(args.port, 'GET', f'/tasks/watch?date={date_str}')
+            task = body['data'][0]
+            _, _, patients = request_json(args.port, 'GET', '/patients')
+            auntie_id = next((p['auntieId'] for p in patients if p['patientId'] == task['patientId']), '')
+            change = {'date': date_str, 'patientId': task['patientId'], 'timeSlotName': task['timeSlotName'],
+                      'status': '已服药', 'completionTime': time.strftime('%H:%M'), 'remark': ''}
+            t0 = time.perf_counter()
+            status, early, latencies, ok, rejected = asyncio.run(run(args, args.port, date_str, body['revision'],
+                                                          auntie_id, change))
+            elapsed = time.perf_counter() - t0
+        finally:
+            stop_server(process)
+
+    print(f"{args.workers} 个 {args.worker_class} worker，{args.connections} 个长轮询连接（建立和等待共 {elapsed:.1f} 秒）")
+    print(f"PUT /task 状态码 {status}，修改前提前返回的连接 {early} 个")
+    if latencies:
+        print(f"收到通知 {len(latencies)} 个，延迟 p50 {statistics.median(latencies):.1f} ms，"
+              f"p99 {percentile(latencies, 0.99):.1f} ms，最大 {max(latencies):.1f} ms")
+    print(f"响应为包含变化的增量: {ok} / {args.connections}，超过每个 worker 的连接上限返回503: {rejected}")
+    sys.exit(0 if ok + rejected == args.connections else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+"""
+排班生成：逐行算法与向量化引擎的性能对比
+
+用法（在 server 目录下运行）:
+    python benchmarks/schedule_benchmark.py [--sizes 1000 10000 50000] [--days 1 7 30] [--repeat 5]
+
+生成指定数量的随机处方（包括停用、已结束、未开始的处方以及同一病人的多种药物），分别测试：
+- loop:   原 generate_schedules_for_date 的逐行算法，对日期范围内每天各调用一次
+- engine: 向量化引擎，包括把处方表解析成数组的时间（处方表变化后第一次调用）
+- cached: 向量化引擎，处方数组已缓存（处方表没有变化时的常见情况）
+并核对两种算法每天的结果完全一致。
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from schedule_engine import PrescriptionArrays, schedules_for_date_loop  # noqa: E402
+
+
+def make_prescriptions(n_prescriptions, today):
+    prescriptions = []
+    n_patients = max(1, n_prescriptions // 4)
+    for i in range(n_prescriptions):
+        patient = random.randrange(n_patients)
+        start = today + timedelta(days=random.randint(-60, 20))
+        prescriptions.append({
+            'patient_name': f'患者{patient}',
+            'patientId': str(1000000 + patient),
+            'rfid': '',
+            'medicine_name': f'药物{i}',
+            'morning_dosage': str(random.choice([0, 1, 1, 2])),
+            'noon_dosage': str(random.choice([0, 0, 1])),
+            'evening_dosage': str(random.choice([0, 1, 2])),
+            'meal_timing': random.choice(['before', 'after']),
+            'start_date': start.strftime('%Y-%m-%d'),
+            'duration_days': str(random.randint(1, 90)),
+            'last_dispensed_expiry_date': '',
+            'is_active': random.choice(['1', '1', '1', '0']),
+            'pill_size': 'M',
+        })
+    return prescriptions
+
+
+def timed(fn, repeat):
+    samples = []
+    result = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = fn()
+        samples.append((time.perf_counter() - t0) * 1000)
+    return statistics.median(samples), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='排班生成性能对比')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 50000], help='处方数量')
+    parser.add_argument('--days', type=int, nargs='+', default=[1, 7, 30], help='日期范围天数')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    random.seed(0)
+    today = date.today()
+    print(f"{'rx':>7} {'days':>5} {'loop':>12} {'engine':>12} {'cached':>12} {'speedup':>8}   (ms, median)")
+
+    for size in args.sizes:
+        prescriptions = make_prescriptions(size, today)
+        arrays = PrescriptionArrays(prescriptions)
+        for days in args.days:
+            dates = [today + timedelta(days=offset) for offset in range(days)]
+
+            loop_ms, loop_result = timed(
+                lambda: {d.strftime('%Y-%m-%d'): schedules_for_date_loop(prescriptions, d) for d in dates}, args.repeat)
+            engine_ms, _ = timed(lambda: PrescriptionArrays(prescriptions).schedules_for_range(today, days), args.repeat)
+            cached_ms, engine_result = timed(lambda: arrays.schedules_for_range(today, days), args.repeat)
+
+            if loop_result != engine_result:
+                print(f"!!! 结果不一致: {size} 条处方, {days} 天")
+                sys.exit(1)
+            print(f"{size:>7} {days:>5} {loop_ms:>12.2f} {engine_ms:>12.2f} {cached_ms:>12.2f} "
+                  f"{loop_ms / cached_ms:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
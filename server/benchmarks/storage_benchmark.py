@@ -0,0 +1,114 @@
+"""
+CSV 与 SQLite 存储后端的性能对比
+
+用法（在 server 目录下运行）:
+    python benchmarks/storage_benchmark.py [--sizes 100 1000 10000] [--days 30] [--repeat 20]
+
+在临时目录中生成指定规模的患者、处方和每日任务数据，分别测试两个后端的：
+- 冷读取：新建后端后第一次读取整张患者表
+- 热读取：缓存命中时读取整张患者表
+- 按护工筛选患者（/patients?auntieId= 的查询）
+- 读取某一天的任务表
+- 写入一天的任务表
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from storage import CsvBackend, SqliteBackend  # noqa: E402
+
+PATIENT_FIELDS = ['patientId', 'auntieId', 'imageResourceId', 'patientName', 'patientBedNumber', 'patientBarcode']
+TASK_FIELDS = ['patientId', 'timeSlotName', 'status', 'completionTime', 'remark']
+TIME_SLOTS = ['BEFORE_BREAKFAST', 'AFTER_BREAKFAST', 'BEFORE_LUNCH', 'AFTER_LUNCH', 'BEFORE_DINNER', 'AFTER_DINNER']
+
+
+def make_patients(n_patients, n_aunties):
+    return [{
+        'patientId': str(1000000 + i),
+        'auntieId': str(i % n_aunties + 1),
+        'imageResourceId': '',
+        'patientName': f'患者{i}',
+        'patientBedNumber': str(100 + i),
+        'patientBarcode': str(1000000 + i)
+    } for i in range(n_patients)]
+
+
+def make_tasks(patients):
+    tasks = []
+    for patient in patients:
+        for slot in random.sample(TIME_SLOTS, 3):
+            tasks.append({
+                'patientId': patient['patientId'],
+                'timeSlotName': slot,
+                'status': random.choice(['待服药', '已服药']),
+                'completionTime': '',
+                'remark': ''
+            })
+    return tasks
+
+
+def timed(func, repeat):
+    """返回多次运行的耗时中位数（毫秒）"""
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        durations.append((time.perf_counter() - start) * 1000)
+    return statistics.median(durations)
+
+
+def run_backend(make_backend, data_dir, patients, tasks, days, repeat):
+    patients_file = os.path.join(data_dir, 'patients.csv')
+    dates = [(date(2025, 1, 1) + timedelta(days=d)).strftime('%Y-%m-%d') for d in range(days)]
+
+    backend = make_backend()
+    backend.write_rows(patients_file, patients, PATIENT_FIELDS)
+    for date_str in dates:
+        backend.write_rows(os.path.join(data_dir, f'tasks_{date_str}.csv'), tasks, TASK_FIELDS)
+
+    results = {}
+    results['cold_read'] = timed(lambda: make_backend().read_rows(patients_file), max(3, repeat // 4))
+    backend.read_rows(patients_file)
+    results['warm_read'] = timed(lambda: backend.read_rows(patients_file), repeat)
+    results['query_auntie'] = timed(lambda: backend.query_rows(patients_file, auntieId='3'), repeat)
+    task_file = os.path.join(data_dir, f'tasks_{dates[days // 2]}.csv')
+    results['cold_tasks_read'] = timed(lambda: make_backend().read_rows(task_file), max(3, repeat // 4))
+    results['write_tasks'] = timed(lambda: backend.write_rows(task_file, tasks, TASK_FIELDS), max(3, repeat // 4))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='CSV/SQLite 存储后端性能对比')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 10000])
+    parser.add_argument('--days', type=int, default=30, help='生成多少天的任务文件')
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    random.seed(0)
+    columns = ['cold_read', 'warm_read', 'query_auntie', 'cold_tasks_read', 'write_tasks']
+    print(f"{'patients':>8} {'backend':>7} " + ' '.join(f'{c:>16}' for c in columns) + '   (ms, median)')
+
+    for size in args.sizes:
+        patients = make_patients(size, max(1, size // 20))
+        tasks = make_tasks(patients)
+        for name in ('csv', 'sqlite'):
+            with tempfile.TemporaryDirectory() as data_dir:
+                if name == 'csv':
+                    make_backend = CsvBackend
+                else:
+                    db_path = os.path.join(data_dir, 'ez_dose.db')
+                    make_backend = lambda: SqliteBackend(db_path, data_dir)  # noqa: E731
+                results = run_backend(make_backend, data_dir, patients, tasks, args.days, args.repeat)
+                print(f"{size:>8} {name:>7} " + ' '.join(f'{results[c]:>16.3f}' for c in columns))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,240 @@
+"""
+生成指定规模的模拟医院数据（data 目录），供压测和性能对比使用
+
+用法（在 server 目录下运行）:
+    python benchmarks/synthetic_data.py --output /tmp/ezdose-data [--patients 2000] [--medicines 10] [--days 365]
+
+生成的文件与正式数据格式相同：
+- caregivers.csv / aunties.csv: 每个护工负责 --patients-per-auntie 个患者，每个护士管理10个护工，
+  用户名为 hushi001 / hugong001 ...，密码都是 SYNTHETIC_PASSWORD（以哈希保存）
+- patients.csv: 患者，平均分配给各护工
+- local_prescriptions_data.csv: 每个患者 --medicines 种药物，大部分是覆盖整个时间范围的长期用药，
+  少部分是短疗程、已停用的处方，剂量和饭前/饭后随机，因此每个患者每天有1到6个服药时间段
+- timeslots.csv / schedule_config.json: 标准的6个时间段和自动排班时间
+- tasks_<日期>.csv: 截止到今天的 --days 天任务，由排班引擎根据处方计算；
+  过去的任务大部分已服药（带完成时间和少量备注），今天的任务全部为待服药
+- schedules.csv / schedules_<今天>.csv: 今天的排班
+"""
+
+import argparse
+import csv
+import json
+import os
+import random
+import sys
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from credentials import AUNTIE_FIELDNAMES, CAREGIVER_FIELDNAMES, hash_password  # noqa: E402
+from schedule_engine import SCHEDULE_FIELDNAMES, PrescriptionArrays  # noqa: E402
+from task_store import TASK_FIELDNAMES  # noqa: E402
+
+# 所有模拟账号的密码
+SYNTHETIC_PASSWORD = 'bench123'
+
+PATIENT_FIELDNAMES = ['patientId', 'auntieId', 'imageResourceId', 'patientName', 'patientBedNumber', 'patientBarcode']
+PRESCRIPTION_FIELDNAMES = ['patient_name', 'patientId', 'rfid', 'medicine_name', 'morning_dosage',
+                           'noon_dosage', 'evening_dosage', 'meal_timing', 'start_date', 'duration_days',
+                           'last_dispensed_expiry_date', 'is_active', 'pill_size']
+TIMESLOTS = [
+    {'name': 'BEFORE_BREAKFAST', 'displayName': '早饭前', 'startHour': '6', 'endHour': '7', 'startMinute': '0'},
+    {'name': 'AFTER_BREAKFAST', 'displayName': '早饭后', 'startHour': '7', 'endHour': '8', 'startMinute': '30'},
+    {'name': 'BEFORE_LUNCH', 'displayName': '午饭前', 'startHour': '11', 'endHour': '12', 'startMinute': '0'},
+    {'name': 'AFTER_LUNCH', 'displayName': '午饭后', 'startHour': '12', 'endHour': '13', 'startMinute': '0'},
+    {'name': 'BEFORE_DINNER', 'displayName': '晚饭前', 'startHour': '17', 'endHour': '18', 'startMinute': '0'},
+    {'name': 'AFTER_DINNER', 'displayName': '晚饭后', 'startHour': '18', 'endHour': '19', 'startMinute': '0'},
+]
+SLOT_HOURS = {slot['name']: int(slot['startHour']) for slot in TIMESLOTS}
+
+MEDICINES = ['阿莫西林', '二甲双胍', '阿司匹林', '氨氯地平', '阿托伐他汀', '奥美拉唑', '美托洛尔', '缬沙坦',
+             '氯吡格雷', '格列美脲', '硝苯地平', '辛伐他汀', '多潘立酮', '甲钴胺', '维生素D', '碳酸钙']
+SURNAMES = '王李张刘陈杨黄赵吴周徐孙马朱胡郭何高林罗'
+GIVEN_NAMES = '秀英桂兰玉珍建国淑芬志强明华丽娟德福春梅'
+REMARKS = ['', '', '', '', '饭后半小时服用', '已提醒家属', '吞咽困难，研碎后服用', '拒服一次后补服']
+
+# 任务按多少天一批计算，避免一年的排班同时留在内存中
+TASK_CHUNK_DAYS = 30
+
+
+def write_csv(filename, rows, fieldnames):
+    """按正式数据的格式（utf-8-sig）写入CSV"""
+    with open(filename, 'w', encoding='utf-8-sig', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def person_name(rng, suffix=''):
+    return rng.choice(SURNAMES) + ''.join(rng.sample(GIVEN_NAMES, 2)) + suffix
+
+
+def make_accounts(rng, n_patients, patients_per_auntie):
+    """护士和护工账号，所有账号使用同一个密码哈希（只计算一次）"""
+    password_hash = hash_password(SYNTHETIC_PASSWORD)
+    n_aunties = max(1, -(-n_patients // patients_per_auntie))
+    n_caregivers = max(1, -(-n_aunties // 10))
+    caregivers = [{
+        'caregiverId': str(i + 1),
+        'name': person_name(rng, '护士'),
+        'username': f'hushi{i + 1:03d}',
+        'password': password_hash,
+    } for i in range(n_caregivers)]
+    aunties = [{
+        'auntieId': str(i + 1),
+        'name': person_name(rng, '护工'),
+        'username': f'hugong{i + 1:03d}',
+        'password': password_hash,
+        'caregiverId': str(i // 10 + 1),
+    } for i in range(n_aunties)]
+    return caregivers, aunties
+
+
+def make_patients(rng, n_patients, n_aunties):
+    patients = []
+    for i in range(n_patients):
+        bed = f'{i // 40 + 1}{i % 40 + 1:02d}'
+        patients.append({
+            'patientId': str(1700000000 + i),
+            'auntieId': str(i % n_aunties + 1),
+            'imageResourceId': '',
+            'patientName': person_name(rng),
+            'patientBedNumber': bed,
+            'patientBarcode': bed,
+        })
+    return patients
+
+
+def make_prescriptions(rng, patients, n_medicines, first_day, last_day):
+    """
+    每个患者 n_medicines 种药物
+    - 85% 是长期用药，覆盖 first_day 到 last_day 之后一段时间
+    - 其余是时间范围内随机开始的短疗程，其中一部分已停用
+    """
+    span = (last_day - first_day).days + 1
+    prescriptions = []
+    for patient in patients:
+        names = rng.sample(MEDICINES, n_medicines) if n_medicines <= len(MEDICINES) else \
+            [f'{rng.choice(MEDICINES)}{i + 1}' for i in range(n_medicines)]
+        for name in names:
+            if rng.random() < 0.85:
+                start = first_day - timedelta(days=rng.randint(0, 60))
+                duration = (last_day - start).days + rng.randint(30, 120)
+                active = '1'
+            else:
+                start = first_day + timedelta(days=rng.randrange(span))
+                duration = rng.randint(3, 14)
+                active = rng.choice(['1', '1', '0'])
+            expiry = min(last_day, start + timedelta(days=duration - 1))
+            prescriptions.append({
+                'patient_name': patient['patientName'],
+                'patientId': patient['patientId'],
+                'rfid': '',
+                'medicine_name': name,
+                'morning_dosage': str(rng.choice([0, 1, 1, 2])),
+                'noon_dosage': str(rng.choice([0, 0, 1])),
+                'evening_dosage': str(rng.choice([0, 1, 1, 2])),
+                'meal_timing': rng.choice(['before', 'after']),
+                'start_date': start.strftime('%Y-%m-%d'),
+                'duration_days': str(duration),
+                'last_dispensed_expiry_date': expiry.strftime('%Y-%m-%d'),
+                'is_active': active,
+                'pill_size': rng.choice(['S', 'M', 'M', 'L']),
+            })
+    return prescriptions
+
+
+def make_task(rng, schedule, is_today):
+    """根据排班生成一条任务；过去的任务大部分已服药"""
+    if is_today or rng.random() < 0.06:
+        return {'patientId': schedule['patientId'], 'timeSlotName': schedule['timeSlotName'],
+                'status': '待服药', 'completionTime': '', 'remark': ''}
+    hour = SLOT_HOURS[schedule['timeSlotName']]
+    return {'patientId': schedule['patientId'], 'timeSlotName': schedule['timeSlotName'],
+            'status': '已服药', 'completionTime': f'{hour:02d}:{rng.randrange(60):02d}',
+            'remark': rng.choice(REMARKS)}
+
+
+def generate_data_dir(data_dir, patients=2000, medicines=10, days=365, patients_per_auntie=20,
+                      seed=0, today=None, progress=None):
+    """
+    在 data_dir 中生成一套模拟数据（已有的同名文件会被覆盖）
+    Args:
+        data_dir: 输出目录（对应 server/data）
+        patients: 患者数量
+        medicines: 每个患者的药物数量
+        days: 生成截止到今天的多少天任务文件
+        patients_per_auntie: 每个护工负责的患者数
+        seed: 随机种子，相同参数生成相同的数据
+        today: 最后一天，默认今天
+        progress: 进度回调 (消息) -> None
+    Returns:
+        统计信息字典（各表行数、任务日期范围、账号密码）
+    """
+    rng = random.Random(seed)
+    today = today or date.today()
+    first_day = today - timedelta(days=days - 1)
+    os.makedirs(data_dir, exist_ok=True)
+    report = progress or (lambda message: None)
+
+    caregivers, aunties = make_accounts(rng, patients, patients_per_auntie)
+    patient_rows = make_patients(rng, patients, len(aunties))
+    prescriptions = make_prescriptions(rng, patient_rows, medicines, first_day, today)
+    write_csv(os.path.join(data_dir, 'caregivers.csv'), caregivers, CAREGIVER_FIELDNAMES)
+    write_csv(os.path.join(data_dir, 'aunties.csv'), aunties, AUNTIE_FIELDNAMES)
+    write_csv(os.path.join(data_dir, 'patients.csv'), patient_rows, PATIENT_FIELDNAMES)
+    write_csv(os.path.join(data_dir, 'local_prescriptions_data.csv'), prescriptions, PRESCRIPTION_FIELDNAMES)
+    write_csv(os.path.join(data_dir, 'timeslots.csv'), TIMESLOTS, list(TIMESLOTS[0]))
+    with open(os.path.join(data_dir, 'schedule_config.json'), 'w', encoding='utf-8') as f:
+        json.dump({'schedule_time': '04:00'}, f)
+    report(f"账号、患者和处方已生成: {len(caregivers)} 个护士，{len(aunties)} 个护工，"
+           f"{len(patient_rows)} 个患者，{len(prescriptions)} 条处方")
+
+    arrays = PrescriptionArrays(prescriptions)
+    today_str = today.strftime('%Y-%m-%d')
+    task_rows = 0
+    for offset in range(0, days, TASK_CHUNK_DAYS):
+        chunk_start = first_day + timedelta(days=offset)
+        for date_str, schedules in arrays.schedules_for_range(chunk_start, min(TASK_CHUNK_DAYS, days - offset)).items():
+            is_today = date_str == today_str
+            tasks = [make_task(rng, schedule, is_today) for schedule in schedules]
+            write_csv(os.path.join(data_dir, f'tasks_{date_str}.csv'), tasks, TASK_FIELDNAMES)
+            task_rows += len(tasks)
+            if is_today:
+                write_csv(os.path.join(data_dir, f'schedules_{date_str}.csv'), schedules, SCHEDULE_FIELDNAMES)
+                write_csv(os.path.join(data_dir, 'schedules.csv'), schedules, SCHEDULE_FIELDNAMES)
+        report(f"任务文件已生成到 {min(days, offset + TASK_CHUNK_DAYS)} / {days} 天")
+
+    return {
+        'caregivers': len(caregivers),
+        'aunties': len(aunties),
+        'patients': len(patient_rows),
+        'prescriptions': len(prescriptions),
+        'task_days': days,
+        'task_rows': task_rows,
+        'first_day': first_day.strftime('%Y-%m-%d'),
+        'last_day': today_str,
+        'password': SYNTHETIC_PASSWORD,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='生成模拟医院数据')
+    parser.add_argument('--output', required=True, help='输出目录（对应 server/data，不要指向正式数据）')
+    parser.add_argument('--patients', type=int, default=2000, help='患者数量')
+    parser.add_argument('--medicines', type=int, default=10, help='每个患者的药物数量')
+    parser.add_argument('--days', type=int, default=365, help='生成多少天的任务文件（截止到今天）')
+    parser.add_argument('--patients-per-auntie', type=int, default=20, help='每个护工负责的患者数')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    t0 = time.perf_counter()
+    summary = generate_data_dir(args.output, args.patients, args.medicines, args.days,
+                                args.patients_per_auntie, args.seed, progress=print)
+    print(f"完成，用时 {time.perf_counter() - t0:.1f} 秒: {summary['task_rows']} 条任务"
+          f"（{summary['first_day']} 至 {summary['last_day']}），账号密码 {summary['password']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,398 @@
+"""
+按角色模拟的整体压测：各接口的吞吐量和延迟分位数
+
+用法（在 server 目录下运行）:
+    python benchmarks/workload_benchmark.py [--patients 2000] [--medicines 10] [--days 365]
+                                            [--mode client http] [--duration 20] [--clients 8] [--workers 2]
+                                            [--mix caregiver=8 admin=1 dispenser=1]
+                                            [--keep /tmp/ezdose-bench] [--json result.json] [--baseline old.json]
+
+1. 把 server 代码复制到临时目录（--keep 指定的目录已经生成过时直接复用），
+   用 synthetic_data.py 生成指定规模的 data 目录，不接触正式数据
+2. 按 --mix 的比例反复运行三种脚本化的会话：
+   - caregiver（护工App）: 登录、读取自己的患者和排班、读取今天的任务，
+     逐个标记服药（PUT /task）并用 since 拉取增量，最后用 If-None-Match 确认没有变化（304）
+   - admin（管理后台）: 患者、护工、排班页面，以及过去某一天的服药记录页面
+   - dispenser（分药机）: 同步患者和处方，回写某个患者的发药有效期（PATCH，带 base_revision），再拉取增量
+3. 两种运行方式（--mode）:
+   - client: 进程内 Flask test client，单线程，没有网络开销，反映每个接口本身的耗时
+   - http:   gunicorn 启动真实的服务器（需要安装 gunicorn），--clients 个客户端进程并发请求
+4. 输出每个接口的请求数、吞吐量、p50 / p90 / p99 / 最大延迟和错误数；
+   --json 保存结果，--baseline 与之前保存的结果对比，p99 变慢超过 --threshold 百分比的接口标记为回退
+"""
+
+import argparse
+import csv
+import http.client
+import json
+import multiprocessing
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from load_test import SERVER_DIR, percentile, start_server, stop_server  # noqa: E402
+from synthetic_data import SYNTHETIC_PASSWORD, generate_data_dir  # noqa: E402
+
+ROLES = ('caregiver', 'admin', 'dispenser')
+
+
+def prepare_server(workdir, args):
+    """复制代码（不复制正式数据和上传的图片）并生成模拟数据；目录已经准备好时直接复用"""
+    marker = os.path.join(workdir, 'data', 'patients.csv')
+    if os.path.exists(marker):
+        print(f"复用已生成的数据: {workdir}")
+        return
+    shutil.copytree(SERVER_DIR, workdir, dirs_exist_ok=True, ignore=shutil.ignore_patterns(
+        '__pycache__', 'data', 'images_patients', '*.db'))
+    t0 = time.perf_counter()
+    summary = generate_data_dir(os.path.join(workdir, 'data'), args.patients, args.medicines, args.days,
+                                seed=args.seed)
+    print(f"已生成模拟数据（{time.perf_counter() - t0:.1f} 秒）: {summary['aunties']} 个护工，"
+          f"{summary['patients']} 个患者，{summary['prescriptions']} 条处方，"
+          f"{summary['task_days']} 天共 {summary['task_rows']} 条任务")
+
+
+def read_rows(filename):
+    with open(filename, 'r', encoding='utf-8-sig', newline='') as f:
+        return list(csv.DictReader(f))
+
+
+def load_context(workdir):
+    """
+    从生成的数据中整理各会话需要的信息（在压测开始前直接读文件，不计入接口耗时）
+    Returns:
+        dict: 护工账号、每个护工的患者和今天的任务、每个患者的药物、有任务记录的日期
+    """
+    data_dir = os.path.join(workdir, 'data')
+    today = date.today().strftime('%Y-%m-%d')
+    patients = read_rows(os.path.join(data_dir, 'patients.csv'))
+    auntie_of = {p['patientId']: p['auntieId'] for p in patients}
+    tasks_by_auntie = {}
+    for task in read_rows(os.path.join(data_dir, f'tasks_{today}.csv')):
+        auntie_id = auntie_of.get(task['patientId'])
+        if auntie_id:
+            tasks_by_auntie.setdefault(auntie_id, []).append([task['patientId'], task['timeSlotName']])
+    medicines = {}
+    for prescription in read_rows(os.path.join(data_dir, 'local_prescriptions_data.csv')):
+        medicines.setdefault(prescription['patientId'], []).append(prescription['medicine_name'])
+    task_dates = sorted(name[len('tasks_'):-len('.csv')] for name in os.listdir(data_dir)
+                        if name.startswith('tasks_') and name.endswith('.csv'))
+    return {
+        'today': today,
+        'aunties': [[a['auntieId'], a['username']] for a in read_rows(os.path.join(data_dir, 'aunties.csv'))
+                    if a['auntieId'] in tasks_by_auntie],
+        'tasks_by_auntie': tasks_by_auntie,
+        'medicines': medicines,
+        'patient_ids': list(medicines),
+        'past_dates': [d for d in task_dates if d < today] or [today],
+    }
+
+
+class TestClientTransport:
+    """进程内 Flask test client"""
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, body=None, headers=None):
+        response = self.client.open(path, method=method, json=body, headers=headers or {})
+        data = response.get_data()
+        return response.status_code, response.headers, data
+
+
+class HttpTransport:
+    """HTTP 长连接，连接出错时重新连接"""
+
+    def __init__(self, port):
+        self.port = port
+        self.conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+
+    def request(self, method, path, body=None, headers=None):
+        headers = dict(headers or {})
+        payload = None
+        if body is not None:
+            payload = json.dumps(body).encode('utf-8')
+            headers['Content-Type'] = 'application/json'
+        try:
+            self.conn.request(method, path, body=payload, headers=headers)
+            response = self.conn.getresponse()
+            data = response.read()
+        except (OSError, http.client.HTTPException):
+            self.conn.close()
+            self.conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=60)
+            raise
+        return response.status, response.headers, data
+
+
+class Recorder:
+    """按接口名称记录延迟（毫秒）和错误数"""
+
+    def __init__(self, transport):
+        self.transport = transport
+        self.latencies = {}
+        self.errors = {}
+
+    def call(self, name, method, path, body=None, headers=None, expected=(200,)):
+        t0 = time.perf_counter()
+        try:
+            status, response_headers, data = self.transport.request(method, path, body, headers)
+        except (OSError, http.client.HTTPException):
+            self.errors[name] = self.errors.get(name, 0) + 1
+            return None, {}, b''
+        self.latencies.setdefault(name, []).append((time.perf_counter() - t0) * 1000)
+        if status not in expected:
+            self.errors[name] = self.errors.get(name, 0) + 1
+        return status, response_headers, data
+
+
+def caregiver_session(api, rng, ctx, updates=3):
+    """护工App：登录、同步、逐个标记服药"""
+    auntie_id, username = rng.choice(ctx['aunties'])
+    today = ctx['today']
+    api.call('POST /login', 'POST', '/login', {'username': username, 'password': SYNTHETIC_PASSWORD})
+    api.call('GET /patients?auntieId', 'GET', f'/patients?auntieId={auntie_id}')
+    api.call('GET /schedules?auntieId', 'GET', f'/schedules?auntieId={auntie_id}')
+    _, headers, _ = api.call('GET /tasks', 'GET', f'/tasks?date={today}')
+    revision = headers.get('X-Revision')
+    etag = headers.get('ETag')
+    for patient_id, slot in rng.sample(ctx['tasks_by_auntie'][auntie_id],
+                                       min(updates, len(ctx['tasks_by_auntie'][auntie_id]))):
+        api.call('PUT /task', 'PUT', '/task', {
+            'date': today, 'patientId': patient_id, 'timeSlotName': slot, 'status': '已服药',
+            'completionTime': time.strftime('%H:%M'), 'remark': ''})
+        if revision is not None:
+            _, headers, _ = api.call('GET /tasks?since', 'GET', f'/tasks?date={today}&since={revision}')
+            revision = headers.get('X-Revision', revision)
+            etag = headers.get('ETag', etag)
+    if etag:
+        # 其它会话可能同时修改了任务，这时返回200也是正确的
+        api.call('GET /tasks If-None-Match', 'GET', f'/tasks?date={today}', headers={'If-None-Match': etag},
+                 expected=(200, 304))
+
+
+def admin_session(api, rng, ctx):
+    """管理后台：浏览各个管理页面和历史服药记录"""
+    api.call('GET /admin/patients', 'GET', '/admin/patients')
+    api.call('GET /admin/aunties', 'GET', '/admin/aunties')
+    api.call('GET /admin/schedules', 'GET', '/admin/schedules')
+    api.call('GET /admin/tasks?date', 'GET', f"/admin/tasks?date={rng.choice(ctx['past_dates'])}")
+    api.call('GET /admin/tasks', 'GET', f"/admin/tasks?date={ctx['today']}")
+
+
+def dispenser_session(api, rng, ctx):
+    """分药机：同步患者和处方，回写一个患者所有药物的发药有效期"""
+    api.call('GET /packer/patients', 'GET', '/packer/patients')
+    _, headers, _ = api.call('GET /packer/prescriptions', 'GET', '/packer/prescriptions')
+    revision = headers.get('X-Revision')
+    patient_id = rng.choice(ctx['patient_ids'])
+    expiry = (date.today() + timedelta(days=rng.randint(1, 7))).strftime('%Y-%m-%d')
+    body = {'upserts': [{'patientId': patient_id, 'medicine_name': name, 'last_dispensed_expiry_date': expiry}
+                        for name in ctx['medicines'][patient_id]]}
+    if revision is not None:
+        body['base_revision'] = int(revision)
+    # 409 表示与其它分药机的修改冲突，是正常的并发结果
+    api.call('PATCH /packer/prescriptions', 'PATCH', '/packer/prescriptions', body, expected=(200, 409))
+    if revision is not None:
+        api.call('GET /packer/prescriptions?since', 'GET', f'/packer/prescriptions?since={revision}')
+
+
+SESSIONS = {'caregiver': caregiver_session, 'admin': admin_session, 'dispenser': dispenser_session}
+
+
+def run_sessions(api, ctx, mix, duration, seed):
+    """按比例随机选择会话，运行到 duration 秒为止"""
+    rng = random.Random(seed)
+    roles = [role for role, weight in mix.items() if weight > 0]
+    weights = [mix[role] for role in roles]
+    deadline = time.perf_counter() + duration
+    sessions = 0
+    while time.perf_counter() < deadline:
+        SESSIONS[rng.choices(roles, weights)[0]](api, rng, ctx)
+        sessions += 1
+    return sessions
+
+
+def warm_up(api, ctx):
+    """每种会话先运行一次（填充缓存、创建表格版本），不计入结果"""
+    rng = random.Random(0)
+    for session in SESSIONS.values():
+        session(api, rng, ctx)
+
+
+def client_mode_main(workdir, ctx, mix, duration, seed, results):
+    """client 模式（在独立进程中运行，导入的是临时目录中的 main_packer）"""
+    os.chdir(workdir)
+    sys.path.insert(0, workdir)
+    os.environ.setdefault('EZDOSE_LOG_LEVEL', 'WARNING')
+    from main_packer import create_app
+    app = create_app(start_scheduler=False)
+    warm_up(Recorder(TestClientTransport(app)), ctx)
+    api = Recorder(TestClientTransport(app))
+    sessions = run_sessions(api, ctx, mix, duration, seed)
+    results.put((api.latencies, api.errors, sessions))
+
+
+def http_client_main(port, ctx, mix, duration, seed, results):
+    api = Recorder(HttpTransport(port))
+    sessions = run_sessions(api, ctx, mix, duration, seed)
+    results.put((api.latencies, api.errors, sessions))
+
+
+def run_client_mode(workdir, ctx, args, mix):
+    spawn = multiprocessing.get_context('spawn')
+    results = spawn.Queue()
+    process = spawn.Process(target=client_mode_main, args=(workdir, ctx, mix, args.duration, args.seed, results))
+    process.start()
+    latencies, errors, sessions = results.get()
+    process.join()
+    return latencies, errors, sessions
+
+
+def run_http_mode(workdir, ctx, args, mix):
+    os.environ.setdefault('EZDOSE_LOG_LEVEL', 'WARNING')
+    process = start_server(workdir, args.port, args.workers, args.threads)
+    try:
+        warm_up(Recorder(HttpTransport(args.port)), ctx)
+        results = multiprocessing.Queue()
+        clients = [multiprocessing.Process(target=http_client_main,
+                                           args=(args.port, ctx, mix, args.duration, args.seed + i, results))
+                   for i in range(args.clients)]
+        for client in clients:
+            client.start()
+        latencies, errors, sessions = {}, {}, 0
+        for _ in clients:
+            client_latencies, client_errors, client_sessions = results.get()
+            sessions += client_sessions
+            for name, samples in client_latencies.items():
+                latencies.setdefault(name, []).extend(samples)
+            for name, count in client_errors.items():
+                errors[name] = errors.get(name, 0) + count
+        for client in clients:
+            client.join()
+    finally:
+        stop_server(process)
+    return latencies, errors, sessions
+
+
+def summarize(latencies, errors, duration):
+    summary = {}
+    for name in sorted(set(latencies) | set(errors)):
+        samples = latencies.get(name, [])
+        summary[name] = {
+            'count': len(samples),
+            'rps': len(samples) / duration,
+            'p50': statistics.median(samples) if samples else float('nan'),
+            'p90': percentile(samples, 0.90),
+            'p99': percentile(samples, 0.99),
+            'max': max(samples) if samples else float('nan'),
+            'errors': errors.get(name, 0),
+        }
+    return summary
+
+
+def print_summary(mode, summary, baseline, threshold):
+    print(f"{'endpoint':<34} {'count':>7} {'req/s':>8} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} "
+          f"{'max ms':>8} {'errors':>6}" + ('   p99 vs baseline' if baseline else ''))
+    regressions = []
+    for name, row in summary.items():
+        line = (f"{name:<34} {row['count']:>7} {row['rps']:>8.1f} {row['p50']:>8.2f} {row['p90']:>8.2f} "
+                f"{row['p99']:>8.2f} {row['max']:>8.2f} {row['errors']:>6}")
+        old = (baseline or {}).get(mode, {}).get(name)
+        if old and old.get('p99'):
+            change = (row['p99'] - old['p99']) / old['p99'] * 100
+            line += f"   {change:+7.1f}%"
+            # 只有1毫秒以内的差异多半是噪声
+            if change > threshold and row['p99'] - old['p99'] > 1:
+                line += '  <-- 回退'
+                regressions.append(name)
+        print(line)
+    return regressions
+
+
+def parse_mix(items):
+    mix = {}
+    for item in items:
+        role, _, weight = item.partition('=')
+        if role not in ROLES:
+            raise argparse.ArgumentTypeError(f"未知角色 {role}，可选 {', '.join(ROLES)}")
+        mix[role] = float(weight or 1)
+    return mix
+
+
+def main():
+    parser = argparse.ArgumentParser(description='按角色模拟的整体压测')
+    parser.add_argument('--patients', type=int, default=2000, help='患者数量')
+    parser.add_argument('--medicines', type=int, default=10, help='每个患者的药物数量')
+    parser.add_argument('--days', type=int, default=365, help='历史任务天数')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--mode', nargs='+', choices=['client', 'http'], default=['client', 'http'])
+    parser.add_argument('--mix', nargs='+', default=['caregiver=8', 'admin=1', 'dispenser=1'],
+                        help='各角色会话的比例')
+    parser.add_argument('--duration', type=float, default=20, help='每种模式压测秒数')
+    parser.add_argument('--clients', type=int, default=8, help='http 模式的并发客户端进程数')
+    parser.add_argument('--workers', type=int, default=2, help='http 模式的 gunicorn worker 数')
+    parser.add_argument('--threads', type=int, default=4, help='http 模式每个 worker 的线程数')
+    parser.add_argument('--port', type=int, default=5081)
+    parser.add_argument('--keep', help='在这个目录中生成数据并保留，下次直接复用（省去生成时间）')
+    parser.add_argument('--json', help='把结果保存为JSON')
+    parser.add_argument('--baseline', help='与之前 --json 保存的结果对比')
+    parser.add_argument('--threshold', type=float, default=20, help='p99 变慢超过多少百分比算回退')
+    args = parser.parse_args()
+    mix = parse_mix(args.mix)
+
+    if 'http' in args.mode:
+        try:
+            import gunicorn  # noqa: F401
+        except ImportError:
+            print("http 模式需要先安装 gunicorn: pip install gunicorn")
+            sys.exit(1)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f).get('results', {})
+
+    tmp = None
+    if args.keep:
+        workdir = os.path.abspath(args.keep)
+    else:
+        tmp = tempfile.TemporaryDirectory()
+        workdir = os.path.join(tmp.name, 'server')
+    try:
+        prepare_server(workdir, args)
+        ctx = load_context(workdir)
+        output = {'scale': {'patients': args.patients, 'medicines': args.medicines, 'days': args.days},
+                  'mix': mix, 'duration': args.duration, 'cpu_count': multiprocessing.cpu_count(), 'results': {}}
+        regressions = []
+        for mode in args.mode:
+            if mode == 'client':
+                latencies, errors, sessions = run_client_mode(workdir, ctx, args, mix)
+                title = 'client（进程内 test client，单线程）'
+            else:
+                latencies, errors, sessions = run_http_mode(workdir, ctx, args, mix)
+                title = f'http（gunicorn {args.workers} worker x {args.threads} 线程，{args.clients} 个客户端）'
+            summary = summarize(latencies, errors, args.duration)
+            output['results'][mode] = summary
+            print(f"\n== {title}: {args.duration:g} 秒完成 {sessions} 个会话")
+            regressions += [f"{mode} {name}" for name in print_summary(mode, summary, baseline, args.threshold)]
+    finally:
+        if tmp is not None:
+            tmp.cleanup()
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(output, f, ensure_ascii=False, indent=2)
+    if regressions:
+        print(f"\n与基线相比 p99 变慢超过 {args.threshold:g}%: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
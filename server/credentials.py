@@ -0,0 +1,201 @@
+"""
+登录凭据索引
+
+login() 以前每次请求都按行扫描 aunties.csv 和 caregivers.csv，并且比较明文密码。这里：
+- 把两张表按用户名建成内存索引，表格变化（写入或外部修改）时自动重建
+- 密码以 werkzeug 的 pbkdf2 哈希保存；旧的明文密码仍然可以登录，第一次登录成功时自动改写为哈希，
+  运行 `python credentials.py migrate` 可以把现有明文密码一次性转换为哈希
+- 验证成功后缓存一个进程内的HMAC摘要，换班时同一账号反复登录不必每次都重新计算pbkdf2
+- 用户名不存在、账号还是明文密码时也对一个固定的哈希计算一次pbkdf2，
+  每次登录都付出相同的代价，不能通过响应时间判断用户名是否存在
+
+容量：pbkdf2（100000 次迭代）每次约 45ms 并占满一个CPU核，单核每秒约 20 次首次登录。
+换班时300台设备同时登录（缓存为空）在单核上约需16秒，p50 延迟约1.7秒；之后命中缓存约1000次/秒，
+与明文密码相当。首次登录的吞吐量随 worker 进程数（CPU核数）线性增长，见 benchmarks/login_benchmark.py。
+
+用法（在 server 目录下运行）:
+    python credentials.py migrate   # 把 aunties.csv / caregivers.csv 中的明文密码转换为哈希
+"""
+
+import hashlib
+import hmac
+import os
+import threading
+
+from werkzeug.security import generate_password_hash, check_password_hash
+
+from app_logging import get_logger
+
+log = get_logger(__name__)
+
+AUNTIES_FILE = 'data/aunties.csv'
+CAREGIVERS_FILE = 'data/caregivers.csv'
+AUNTIE_FIELDNAMES = ['auntieId', 'name', 'username', 'password', 'caregiverId']
+CAREGIVER_FIELDNAMES = ['caregiverId', 'name', 'username', 'password']
+
+# 哈希方法与迭代次数
+PASSWORD_HASH_METHOD = 'pbkdf2:sha256:100000'
+PASSWORD_HASH_PREFIXES = ('pbkdf2:', 'scrypt:')
+
+
+def hash_password(password):
+    """计算密码哈希，用于写入CSV"""
+    return generate_password_hash(password, method=PASSWORD_HASH_METHOD)
+
+
+def is_password_hash(value):
+    """判断CSV中保存的是哈希还是旧的明文密码"""
+    return bool(value) and value.startswith(PASSWORD_HASH_PREFIXES)
+
+
+def verify_password(stored, password):
+    """
+    校验密码
+    Args:
+        stored: CSV中保存的密码（哈希或旧的明文）
+        password: 用户输入的密码
+    Returns:
+        bool: 是否匹配
+    """
+    if not stored:
+        return False
+    if is_password_hash(stored):
+        return check_password_hash(stored, password)
+    # 兼容尚未迁移的明文密码
+    return hmac.compare_digest(stored.encode('utf-8'), password.encode('utf-8'))
+
+
+class CredentialIndex:
+    def __init__(self, read_rows, signature, write_rows=None, lock=None):
+        """
+        初始化凭据索引
+        Args:
+            read_rows: 读取表格的函数，返回只读行
+            signature: 计算表格版本签名的函数，用来判断是否需要重建索引
+            write_rows: 写入表格的函数，提供时明文密码登录成功后改写为哈希
+            lock: 两张账号表“读取-修改-写回”的锁（与管理页面修改账号共用）
+        """
+        self.read_rows = read_rows
+        self.signature = signature
+        self.write_rows = write_rows
+        self.lock = lock or threading.Lock()
+        self._lock = threading.Lock()
+        self._index = {}            # username -> (role, userId, name, stored_password)
+        self._signatures = None     # 建索引时两张表的签名
+        self._verified = {}         # username -> (stored_password, HMAC摘要)
+        self._process_key = os.urandom(32)
+        self._dummy_hash = hash_password(os.urandom(16).hex())  # 用户名不存在时用来校验的固定哈希
+
+    def _current_signatures(self):
+        return (self.signature(AUNTIES_FILE), self.signature(CAREGIVERS_FILE))
+
+    def _rebuild(self, signatures):
+        index = {}
+        # 先放护士再放护工，用户名重复时以护工为准（与原来的查找顺序一致）
+        for caregiver in self.read_rows(CAREGIVERS_FILE):
+            if caregiver.get('username'):
+                index[caregiver['username']] = ('caregiver', caregiver['caregiverId'],
+                                                caregiver['name'], caregiver.get('password', ''))
+        for auntie in self.read_rows(AUNTIES_FILE):
+            if auntie.get('username'):
+                index[auntie['username']] = ('auntie', auntie['auntieId'],
+                                             auntie['name'], auntie.get('password', ''))
+        self._index = index
+        self._signatures = signatures
+        self._verified = {}
+
+    def _digest(self, username, password):
+        message = f"{username}\0{password}".encode('utf-8')
+        return hmac.new(self._process_key, message, hashlib.sha256).digest()
+
+    def authenticate(self, username, password):
+        """
+        验证用户名和密码
+        Returns:
+            user: 验证成功时返回 {'role', 'userId', 'name'}，失败返回None
+        """
+        if not isinstance(username, str) or not isinstance(password, str):
+            return None
+
+        signatures = self._current_signatures()
+        with self._lock:
+            if signatures != self._signatures:
+                self._rebuild(signatures)
+            entry = self._index.get(username)
+            verified = self._verified.get(username)
+
+        if entry is None or not entry[3]:
+            # 与存在的账号付出相同的pbkdf2代价，响应时间不暴露用户名是否存在
+            check_password_hash(self._dummy_hash, password)
+            return None
+        role, user_id, name, stored = entry
+        digest = self._digest(username, password)
+
+        if verified is not None and verified[0] == stored and hmac.compare_digest(verified[1], digest):
+            return {'role': role, 'userId': int(user_id), 'name': name}
+
+        if not is_password_hash(stored):
+            # 明文密码的比较几乎不花时间，补上一次pbkdf2，与哈希账号、不存在的用户名耗时相同
+            check_password_hash(self._dummy_hash, password)
+        if not verify_password(stored, password):
+            return None
+
+        if not is_password_hash(stored):
+            self._upgrade_plaintext(role, username, stored, password)
+        with self._lock:
+            self._verified[username] = (stored, digest)
+        return {'role': role, 'userId': int(user_id), 'name': name}
+
+    def _upgrade_plaintext(self, role, username, stored, password):
+        """明文密码登录成功后把这个账号的密码改写为哈希（失败时只记录日志，不影响登录）"""
+        if self.write_rows is None:
+            return
+        filename, fieldnames = ((AUNTIES_FILE, AUNTIE_FIELDNAMES) if role == 'auntie'
+                                else (CAREGIVERS_FILE, CAREGIVER_FIELDNAMES))
+        try:
+            with self.lock:
+                # 锁内重新读取：期间管理员可能已经修改了这个账号
+                rows = [dict(row) for row in self.read_rows(filename)]
+                row = next((row for row in rows if row.get('username') == username), None)
+                if row is None or row.get('password') != stored:
+                    return
+                row['password'] = hash_password(password)
+                self.write_rows(filename, rows, fieldnames)
+            log.info("账号 %s 的明文密码已改写为哈希", username)
+        except Exception as e:
+            log.error("改写账号 %s 的明文密码失败: %s", username, e)
+
+
+def migrate_plaintext_passwords(read_rows, write_rows):
+    """
+    把两张表中的明文密码转换为哈希
+    Returns:
+        migrated: 转换的账号数量
+    """
+    migrated = 0
+    for filename, fieldnames in ((AUNTIES_FILE, AUNTIE_FIELDNAMES), (CAREGIVERS_FILE, CAREGIVER_FIELDNAMES)):
+        rows = [dict(row) for row in read_rows(filename)]
+        changed = 0
+        for row in rows:
+            password = row.get('password', '')
+            if password and not is_password_hash(password):
+                row['password'] = hash_password(password)
+                changed += 1
+        if changed:
+            write_rows(filename, rows, fieldnames)
+            print(f"{filename}: 已将 {changed} 个明文密码转换为哈希")
+        migrated += changed
+    return migrated
+
+
+if __name__ == '__main__':
+    import sys
+    from storage import load_storage_config, create_backend
+
+    if len(sys.argv) != 2 or sys.argv[1] != 'migrate':
+        print("用法: python credentials.py migrate")
+        sys.exit(1)
+
+    backend = create_backend(load_storage_config('config.json'))
+    count = migrate_plaintext_passwords(backend.read_rows, backend.write_rows)
+    print(f"迁移完成，共转换 {count} 个账号")
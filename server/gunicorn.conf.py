@@ -0,0 +1,62 @@
+"""
+gunicorn 配置（gunicorn -c gunicorn.conf.py wsgi:app）
+
+可以用环境变量覆盖:
+    EZDOSE_BIND     监听地址，默认 0.0.0.0:5050
+    EZDOSE_WORKERS  worker 进程数，默认 CPU核数*2+1
+    EZDOSE_THREADS  每个 worker 的线程数（gthread），默认 4
+    EZDOSE_WORKER_CLASS  gevent（默认，已安装 gevent 时）或 gthread：
+                    /tasks/watch 长轮询和 /tasks/events SSE 连接在 gevent 下每个连接只占用一个协程，
+                    可以同时挂着几千个空闲连接；gthread 下每个连接占用一个线程
+    EZDOSE_MAX_TASK_WATCHERS  每个 worker 最多同时等待任务变化的连接数，超过时返回503让客户端稍后重试。
+                    默认 gevent 为 worker_connections 的3/4；gthread 为线程数的一半，
+                    其余线程留给普通请求，空闲的手机不会占满所有线程
+"""
+
+import multiprocessing
+import os
+
+bind = os.environ.get('EZDOSE_BIND', '0.0.0.0:5050')
+workers = int(os.environ.get('EZDOSE_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+
+
+def _default_worker_class():
+    try:
+        import gevent  # noqa: F401
+    except ImportError:
+        return 'gthread'
+    return 'gevent'
+
+
+# 默认使用 gevent：长连接只占用协程。没有安装 gevent 时退回 gthread（每个 worker 多线程，
+# 长时间的请求如整表上传、生成排班不会占住整个进程），启动时会打印警告
+worker_class = os.environ.get('EZDOSE_WORKER_CLASS') or _default_worker_class()
+threads = int(os.environ.get('EZDOSE_THREADS', 4))
+# gevent 时每个 worker 最多同时保持的连接数
+worker_connections = int(os.environ.get('EZDOSE_WORKER_CONNECTIONS', 2000))
+
+# 等待任务变化的连接数上限，通过环境变量传给 worker（main_packer.MAX_TASK_WATCHERS）
+if worker_class == 'gevent':
+    os.environ.setdefault('EZDOSE_MAX_TASK_WATCHERS', str(worker_connections * 3 // 4))
+else:
+    os.environ.setdefault('EZDOSE_MAX_TASK_WATCHERS', str(max(threads // 2, 1)))
+
+# 整表上传和排班生成可能比较慢
+timeout = 120
+graceful_timeout = 30
+keepalive = 5
+
+# 不要预加载应用：预加载时应用在 gunicorn 的 master 进程中创建，调度器也会跑在 master 进程里。
+# 每个 worker 自己导入 main_packer，各自参与主进程竞选
+preload_app = False
+
+accesslog = '-'
+errorlog = '-'
+
+
+def when_ready(server):
+    if worker_class != 'gevent':
+        server.log.warning("worker_class=%s：每个 /tasks/watch、/tasks/events 连接占用一个线程，"
+                           "每个 worker 最多同时等待 %s 个连接（超过返回503）。"
+                           "大量手机在线时请安装 gevent（pip install gevent）",
+                           worker_class, os.environ['EZDOSE_MAX_TASK_WATCHERS'])
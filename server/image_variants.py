@@ -0,0 +1,172 @@
+"""
+患者照片的多尺寸版本
+
+以前上传的照片原样保存在 static/images_patients，手机App的患者列表每张卡片都下载原图。
+这里在上传时把照片缩放并重新编码成几个尺寸（缩略图、卡片、大图），每个尺寸保存 WebP 和 JPEG 两种格式。
+文件名取自原图内容的哈希，内容不变文件名就不变，可以让客户端永久缓存。
+
+文件命名（以 imageResourceId = "3f2a9c0d1e4b5a67.jpg" 为例）:
+    3f2a9c0d1e4b5a67.jpg             大图 JPEG（就是 imageResourceId 本身，兼容旧的 /static 地址）
+    3f2a9c0d1e4b5a67_full.webp       大图 WebP
+    3f2a9c0d1e4b5a67_card.jpg/.webp  卡片
+    3f2a9c0d1e4b5a67_thumb.jpg/.webp 缩略图
+
+依赖 Pillow；没有安装时 PILLOW_AVAILABLE 为 False，上传的照片按原来的方式原样保存。
+"""
+
+import hashlib
+import io
+import os
+import re
+import tempfile
+
+try:
+    from PIL import Image, ImageOps, features
+    PILLOW_AVAILABLE = True
+    WEBP_AVAILABLE = features.check('webp')
+except ImportError:
+    PILLOW_AVAILABLE = False
+    WEBP_AVAILABLE = False
+
+# 各尺寸的最长边（像素）
+VARIANT_SIZES = {'thumb': 160, 'card': 480, 'full': 1600}
+JPEG_QUALITY = 85
+WEBP_QUALITY = 80
+
+HASHED_IMAGE_ID = re.compile(r'^[0-9a-f]{16}\.jpg$')
+HASHED_VARIANT_FILE = re.compile(r'^[0-9a-f]{16}(_(thumb|card|full))?\.(jpg|webp)$')
+
+
+def is_hashed_image_id(image_id):
+    """是否是按内容哈希命名的图片（旧的上传文件不是）"""
+    return bool(image_id) and HASHED_IMAGE_ID.match(image_id) is not None
+
+
+def is_variant_file(filename):
+    """是否是按内容哈希命名的照片文件（任意尺寸和格式），这些文件的内容永远不变"""
+    return HASHED_VARIANT_FILE.match(filename) is not None
+
+
+def image_id_for(data):
+    """根据原图内容计算 imageResourceId"""
+    return hashlib.sha256(data).hexdigest()[:16] + '.jpg'
+
+
+def variant_filename(image_id, variant, fmt='jpeg'):
+    """
+    某个尺寸、某种格式对应的文件名
+    Args:
+        image_id: imageResourceId
+        variant: thumb / card / full
+        fmt: jpeg / webp
+    """
+    stem = image_id[:-len('.jpg')]
+    if fmt == 'webp':
+        return f"{stem}_{variant}.webp"
+    return image_id if variant == 'full' else f"{stem}_{variant}.jpg"
+
+
+def variant_filenames(image_id):
+    """一张照片的所有版本文件名"""
+    formats = ('jpeg', 'webp') if WEBP_AVAILABLE else ('jpeg',)
+    return [variant_filename(image_id, variant, fmt) for variant in VARIANT_SIZES for fmt in formats]
+
+
+def has_all_variants(folder, image_id):
+    return all(os.path.exists(os.path.join(folder, name)) for name in variant_filenames(image_id))
+
+
+def _save_atomic(image, path, **params):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            image.save(f, **params)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def _open_image(data):
+    try:
+        image = Image.open(io.BytesIO(data))
+        image.load()
+    except Exception as e:
+        raise ValueError(f"无法识别的图片: {e}")
+
+    # 按EXIF方向摆正（手机拍的照片），透明背景铺成白色
+    image = ImageOps.exif_transpose(image)
+    if image.mode in ('RGBA', 'LA', 'P'):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel('A'))
+        image = background
+    elif image.mode != 'RGB':
+        image = image.convert('RGB')
+    return image
+
+
+def _write_variants(image, folder, image_id, only_missing=False):
+    os.makedirs(folder, exist_ok=True)
+    formats = ('jpeg', 'webp') if WEBP_AVAILABLE else ('jpeg',)
+    for variant, size in VARIANT_SIZES.items():
+        resized = None
+        for fmt in formats:
+            path = os.path.join(folder, variant_filename(image_id, variant, fmt))
+            if only_missing and os.path.exists(path):
+                continue
+            if resized is None:
+                resized = image.copy()
+                resized.thumbnail((size, size), Image.LANCZOS)
+            if fmt == 'webp':
+                _save_atomic(resized, path, format='WEBP', quality=WEBP_QUALITY, method=4)
+            else:
+                _save_atomic(resized, path, format='JPEG', quality=JPEG_QUALITY, optimize=True, progressive=True)
+
+
+def save_variants(data, folder):
+    """
+    生成并保存所有版本
+    Args:
+        data: 原图的字节内容
+        folder: 保存目录
+    Returns:
+        image_id: 新的 imageResourceId（同样的照片再次上传时得到相同的id，已有的文件不会重新生成）
+    Raises:
+        ValueError: 不是有效的图片
+    """
+    image_id = image_id_for(data)
+    if not has_all_variants(folder, image_id):
+        _write_variants(_open_image(data), folder, image_id)
+    return image_id
+
+
+def regenerate_variants(folder, image_id):
+    """
+    为已有照片补齐缺少的版本
+    - 旧的上传文件（不是按内容哈希命名）：生成全部版本，返回新的 imageResourceId
+    - 已经按哈希命名的：从大图JPEG补齐缺少的版本（例如新增了尺寸或格式），id不变
+    Returns:
+        image_id: 处理后的 imageResourceId
+    Raises:
+        FileNotFoundError: 原图不存在
+        ValueError: 不是有效的图片
+    """
+    with open(os.path.join(folder, image_id), 'rb') as f:
+        data = f.read()
+    if not is_hashed_image_id(image_id):
+        return save_variants(data, folder)
+    if not has_all_variants(folder, image_id):
+        _write_variants(_open_image(data), folder, image_id, only_missing=True)
+    return image_id
+
+
+def remove_variants(folder, image_id):
+    """删除一张照片的所有版本（旧的上传文件只删除它本身）"""
+    names = variant_filenames(image_id) if is_hashed_image_id(image_id) else [image_id]
+    for name in names:
+        path = os.path.join(folder, name)
+        if os.path.exists(path):
+            os.remove(path)
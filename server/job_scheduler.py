@@ -0,0 +1,267 @@
+"""
+后台任务调度器
+
+以前的调度线程每60秒醒来一次调用 schedule.run_pending()，而修改排班时间的请求线程
+直接调用 schedule.clear()，两者之间没有任何同步。这里：
+- 调度线程在条件变量上一直睡到下一个任务到期，新增任务或修改时间时立即唤醒重新计算
+- 每个任务的最后运行时间、耗时和结果保存在状态文件中，服务器重启后如果错过了每日任务
+  （例如停机期间错过了凌晨04:00的排班），启动后会立即补跑一次
+- 支持每日定时任务和固定间隔任务，记录每次运行的耗时供管理页面查看
+"""
+
+import json
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta
+
+from app_logging import get_logger
+
+log = get_logger(__name__)
+
+# 最长睡眠时间：防止系统时间被调整后长时间不醒
+MAX_SLEEP_SECONDS = 300
+
+# 每个任务保留最近多少次运行耗时
+DURATION_HISTORY = 20
+
+
+class Job:
+    def __init__(self, name, func, at=None, interval=None, catch_up=False, description=''):
+        """
+        Args:
+            name: 任务名称
+            func: 要执行的函数（无参数）
+            at: 每日任务的执行时间 "HH:MM"
+            interval: 间隔任务的间隔秒数
+            catch_up: 每日任务错过执行时间后（例如停机）是否在启动时补跑
+            description: 说明文字
+        """
+        self.name = name
+        self.func = func
+        self.at = at
+        self.interval = interval
+        self.catch_up = catch_up
+        self.description = description
+        self.next_run = None
+        self.running = False
+        self.last_run = None
+        self.last_duration = None
+        self.last_status = None
+        self.last_error = None
+        self.run_count = 0
+        self.error_count = 0
+        self.total_duration = 0.0
+        self.durations = deque(maxlen=DURATION_HISTORY)
+
+    def latest_slot(self, now):
+        """每日任务最近一次应该执行的时间（不晚于 now）"""
+        hour, minute = map(int, self.at.split(':'))
+        slot = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+        return slot if slot <= now else slot - timedelta(days=1)
+
+    def compute_next_run(self, now):
+        if self.at is not None:
+            return self.latest_slot(now) + timedelta(days=1)
+        return now + timedelta(seconds=self.interval)
+
+    def status(self):
+        return {
+            'name': self.name,
+            'description': self.description,
+            'trigger': f"daily at {self.at}" if self.at is not None else f"every {self.interval}s",
+            'running': self.running,
+            'next_run': self.next_run.isoformat(timespec='seconds') if self.next_run else None,
+            'last_run': self.last_run.isoformat(timespec='seconds') if self.last_run else None,
+            'last_status': self.last_status,
+            'last_error': self.last_error,
+            'last_duration_ms': round(self.last_duration * 1000, 1) if self.last_duration is not None else None,
+            'avg_duration_ms': round(sum(self.durations) / len(self.durations) * 1000, 1) if self.durations else None,
+            'max_duration_ms': round(max(self.durations) * 1000, 1) if self.durations else None,
+            'run_count': self.run_count,
+            'error_count': self.error_count,
+            'total_duration_ms': round(self.total_duration * 1000, 1),
+        }
+
+
+class JobScheduler:
+    def __init__(self, state_file):
+        """
+        初始化调度器
+        Args:
+            state_file: 保存任务运行状态的JSON文件
+        """
+        self.state_file = state_file
+        self._jobs = {}
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stopped = False
+        self._state = self._load_state()
+
+    def _load_state(self):
+        try:
+            if os.path.exists(self.state_file):
+                with open(self.state_file, 'r', encoding='utf-8') as f:
+                    return json.load(f)
+        except Exception as e:
+            log.error("读取任务状态失败: %s", e)
+        return {}
+
+    def _save_state(self):
+        """保存任务状态（先写临时文件再替换，避免写到一半时断电）"""
+        state = {name: {
+            'last_run': job.last_run.isoformat() if job.last_run else None,
+            'last_duration': job.last_duration,
+            'last_status': job.last_status,
+        } for name, job in self._jobs.items()}
+        try:
+            state_dir = os.path.dirname(self.state_file)
+            if state_dir:
+                os.makedirs(state_dir, exist_ok=True)
+            tmp_file = self.state_file + '.tmp'
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                json.dump(state, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_file, self.state_file)
+        except Exception as e:
+            log.error("保存任务状态失败: %s", e)
+
+    def _add(self, job, run_now):
+        now = datetime.now()
+        saved = self._state.get(job.name, {})
+        if saved.get('last_run'):
+            job.last_run = datetime.fromisoformat(saved['last_run'])
+            job.last_duration = saved.get('last_duration')
+            job.last_status = saved.get('last_status')
+
+        if run_now:
+            job.next_run = now
+        elif job.at is not None and job.catch_up and \
+                (job.last_run is None or job.last_run < job.latest_slot(now)):
+            log.info("任务 %s 错过了 %s 的执行，立即补跑", job.name, job.latest_slot(now))
+            job.next_run = now
+        else:
+            job.next_run = job.compute_next_run(now)
+
+        with self._cond:
+            self._jobs[job.name] = job
+            self._cond.notify()
+        return job
+
+    def add_daily(self, name, func, at, catch_up=True, description=''):
+        """添加每日定时任务，at 为 "HH:MM" """
+        return self._add(Job(name, func, at=at, catch_up=catch_up, description=description), run_now=False)
+
+    def add_interval(self, name, func, seconds, run_at_start=False, description=''):
+        """添加固定间隔任务"""
+        return self._add(Job(name, func, interval=seconds, description=description), run_now=run_at_start)
+
+    def reschedule_daily(self, name, at):
+        """
+        修改每日任务的执行时间，调度线程会立即重新计算睡眠时间
+        Returns:
+            bool: 任务是否存在（调度器未启动时任务还没有注册）
+        """
+        with self._cond:
+            job = self._jobs.get(name)
+            if job is None:
+                return False
+            if job.at == at:
+                return True
+            job.at = at
+            job.next_run = job.compute_next_run(datetime.now())
+            self._cond.notify()
+            return True
+
+    def run_now(self, name):
+        """让任务尽快执行一次，返回任务是否存在"""
+        with self._cond:
+            job = self._jobs.get(name)
+            if job is None:
+                return False
+            job.next_run = datetime.now()
+            self._cond.notify()
+            return True
+
+    def status(self):
+        """所有任务的状态"""
+        with self._cond:
+            return [job.status() for job in sorted(self._jobs.values(), key=lambda j: j.name)]
+
+    def persisted_status(self):
+        """
+        状态文件中保存的最近运行结果
+        多进程部署时调度器只在主进程中运行，其它进程通过状态文件查看
+        """
+        state = self._load_state()
+        return [{
+            'name': name,
+            'last_run': saved.get('last_run'),
+            'last_status': saved.get('last_status'),
+            'last_duration_ms': round(saved['last_duration'] * 1000, 1) if saved.get('last_duration') is not None else None,
+        } for name, saved in sorted(state.items())]
+
+    def start(self):
+        """启动调度线程"""
+        with self._cond:
+            if self._thread is not None:
+                return
+            self._stopped = False
+            self._thread = threading.Thread(target=self._loop, name='job-scheduler', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """停止调度线程（正在运行的任务会执行完）"""
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+            thread = self._thread
+        if thread is not None:
+            thread.join()
+        self._thread = None
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                while True:
+                    if self._stopped:
+                        return
+                    now = datetime.now()
+                    due = [job for job in self._jobs.values() if not job.running and job.next_run <= now]
+                    if due:
+                        job = min(due, key=lambda j: j.next_run)
+                        job.running = True
+                        break
+                    pending = [job.next_run for job in self._jobs.values() if not job.running]
+                    timeout = MAX_SLEEP_SECONDS
+                    if pending:
+                        timeout = min(timeout, max(0.0, (min(pending) - now).total_seconds()))
+                    self._cond.wait(timeout)
+
+            self._run(job)
+
+    def _run(self, job):
+        started = datetime.now()
+        t0 = time.perf_counter()
+        try:
+            job.func()
+            status, error = 'ok', None
+        except Exception as e:
+            status, error = 'error', str(e)
+            log.exception("任务 %s 执行失败: %s", job.name, e)
+        duration = time.perf_counter() - t0
+
+        with self._cond:
+            job.running = False
+            job.last_run = started
+            job.last_duration = duration
+            job.last_status = status
+            job.last_error = error
+            job.run_count += 1
+            job.error_count += status == 'error'
+            job.total_duration += duration
+            job.durations.append(duration)
+            # 运行期间被 reschedule/run_now 修改过的 next_run 不覆盖
+            if job.next_run <= started:
+                job.next_run = job.compute_next_run(datetime.now())
+            self._save_state()
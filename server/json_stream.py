@@ -0,0 +1,86 @@
+"""
+流式JSON响应
+
+大列表接口（处方表、患者表、每日任务）以前用 jsonify 在内存中拼出整个响应再一次性发送，而且不压缩。
+这里按行逐块生成JSON，并根据请求头 Accept-Encoding 选择 gzip / deflate 边生成边压缩。
+"""
+
+import zlib
+
+from flask import Response
+
+# 每积累这么多字节的JSON就向客户端发送一块
+CHUNK_SIZE = 64 * 1024
+
+# Accept-Encoding 协商支持的编码 -> zlib 的 wbits 参数
+SUPPORTED_ENCODINGS = {'gzip': 31, 'deflate': 15}
+
+
+def iter_json(body, dumps, list_key='data'):
+    """
+    逐块生成JSON文本
+    Args:
+        body: 列表，或者在 list_key 下包含行列表的字典
+        dumps: 单个对象的序列化函数（使用Flask的JSON设置）
+        list_key: 字典中需要逐行输出的列表字段
+    Yields:
+        str: JSON片段
+    """
+    if isinstance(body, dict):
+        rows = body.get(list_key, [])
+        others = {key: value for key, value in body.items() if key != list_key}
+        head = dumps(others)[:-1].rstrip()
+        head += (',' if others else '') + dumps(list_key) + ':['
+        tail = ']}'
+    else:
+        rows = body
+        head = '['
+        tail = ']'
+
+    parts = [head]
+    size = len(head)
+    for index, row in enumerate(rows):
+        text = dumps(row)
+        if index:
+            text = ',' + text
+        parts.append(text)
+        size += len(text)
+        if size >= CHUNK_SIZE:
+            yield ''.join(parts)
+            parts = []
+            size = 0
+    parts.append(tail)
+    yield ''.join(parts)
+
+
+def iter_compressed(chunks, encoding):
+    """把文本块编码为UTF-8后按指定编码压缩"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, SUPPORTED_ENCODINGS[encoding])
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def stream_json_response(body, dumps, accept_encodings, list_key='data'):
+    """
+    生成流式（必要时压缩）的JSON响应
+    Args:
+        body: 响应内容，见 iter_json
+        dumps: 单个对象的序列化函数
+        accept_encodings: request.accept_encodings
+        list_key: 字典中需要逐行输出的列表字段
+    Returns:
+        Response
+    """
+    chunks = iter_json(body, dumps, list_key)
+    encoding = accept_encodings.best_match(list(SUPPORTED_ENCODINGS))
+
+    if encoding:
+        response = Response(iter_compressed(chunks, encoding), mimetype='application/json')
+        response.headers['Content-Encoding'] = encoding
+    else:
+        response = Response((chunk.encode('utf-8') for chunk in chunks), mimetype='application/json')
+    response.headers['Vary'] = 'Accept-Encoding'
+    return response
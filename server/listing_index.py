@@ -0,0 +1,157 @@
+"""
+管理后台列表的分页、排序和筛选
+
+患者、排班、服药记录页面以前把整张表渲染进一个页面，每次请求都要重新建立姓名映射并排序，
+机构规模大时页面要好几秒才能生成和传输完。这里为每个列表维护一份按数据签名缓存的索引：
+- 列表行（已经关联好护工姓名、患者姓名、时间段名称等）只在相关表格变化时重新生成
+- 每个可排序的列第一次用到时排序一次，之后直接按名次取分页
+- 按值筛选的列建立 值 -> 行号集合 的索引（值是列表时每个元素都建索引，例如排班的多个时间段）；
+  按前缀筛选的列（床号）保存排好序的 (值, 行号)，二分查找前缀范围
+页面只渲染第一页，后面的页由模板在滚动到底部时再请求。
+"""
+
+import bisect
+import threading
+from collections import OrderedDict, namedtuple
+
+# 一页的行数、最大行数
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+# rows: 这一页的行；total: 满足筛选条件的总行数；next_offset: 下一页的起始位置，没有下一页时为None
+ListingPage = namedtuple('ListingPage', ['rows', 'total', 'offset', 'next_offset'])
+
+
+def natural_key(value):
+    """排序键：纯数字按数值排序并排在前面，其它按字符串排序（患者ID、床号）"""
+    value = '' if value is None else str(value)
+    if value.isdigit():
+        return 0, int(value), ''
+    return 1, 0, value
+
+
+class _Entry:
+    def __init__(self, signature, rows):
+        self.signature = signature
+        self.rows = rows
+        self.orders = {}        # 排序列 -> (按顺序排列的行号, 行号 -> 名次)
+        self.value_indexes = {}  # 筛选列 -> {值: 行号集合}
+        self.prefix_indexes = {}  # 前缀筛选列 -> ([值], [行号])，按值排序
+
+
+class ListingIndex:
+    def __init__(self, build, signature, sort_keys, filter_fields=(), prefix_fields=(), max_entries=8):
+        """
+        初始化列表索引
+        Args:
+            build: 生成列表行的函数 (key) -> 字典列表，key 区分同一列表的不同数据（例如日期）
+            signature: 计算数据签名的函数 (key) -> 签名，签名变化时重新生成列表行和索引
+            sort_keys: {可排序的列: 排序键函数}，第一个是默认排序
+            filter_fields: 按值精确筛选的列
+            prefix_fields: 按前缀筛选的列
+            max_entries: 最多缓存多少个 key 的索引（例如最近查看的几个日期）
+        """
+        self.build = build
+        self.signature = signature
+        self.sort_keys = sort_keys
+        self.default_sort = next(iter(sort_keys))
+        self.filter_fields = tuple(filter_fields)
+        self.prefix_fields = tuple(prefix_fields)
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.builds = 0
+
+    def _entry(self, key):
+        """获取（必要时重新生成）某个 key 的索引（调用方必须持有 self._lock）"""
+        signature = self.signature(key)
+        entry = self._entries.get(key)
+        if entry is None or entry.signature != signature:
+            entry = _Entry(signature, self.build(key))
+            self.builds += 1
+            self._entries[key] = entry
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        self._entries.move_to_end(key)
+        return entry
+
+    def _order(self, entry, field):
+        order = entry.orders.get(field)
+        if order is None:
+            sort_key = self.sort_keys[field]
+            positions = sorted(range(len(entry.rows)), key=lambda i: sort_key(entry.rows[i]))
+            ranks = [0] * len(positions)
+            for rank, position in enumerate(positions):
+                ranks[position] = rank
+            order = entry.orders[field] = (positions, ranks)
+        return order
+
+    def _value_positions(self, entry, field, value):
+        index = entry.value_indexes.get(field)
+        if index is None:
+            index = entry.value_indexes[field] = {}
+            for position, row in enumerate(entry.rows):
+                values = row.get(field)
+                for item in values if isinstance(values, (list, tuple)) else (values,):
+                    index.setdefault(str(item), set()).add(position)
+        return index.get(value, set())
+
+    def _prefix_positions(self, entry, field, prefix):
+        index = entry.prefix_indexes.get(field)
+        if index is None:
+            pairs = sorted((str(row.get(field) or ''), position) for position, row in enumerate(entry.rows))
+            index = entry.prefix_indexes[field] = ([value for value, _ in pairs], [position for _, position in pairs])
+        values, positions = index
+        start = bisect.bisect_left(values, prefix)
+        end = start
+        while end < len(values) and values[end].startswith(prefix):
+            end += 1
+        return set(positions[start:end])
+
+    def query(self, key=None, filters=None, sort=None, descending=False, offset=0, limit=DEFAULT_PAGE_SIZE):
+        """
+        查询一页
+        Args:
+            key: 数据的 key（例如日期），没有时为None
+            filters: {列: 值}，空值和不支持筛选的列会被忽略
+            sort: 排序列，不支持的列按默认排序
+            descending: 是否倒序
+            offset: 起始位置
+            limit: 行数（最多 MAX_PAGE_SIZE）
+        Returns:
+            ListingPage
+        """
+        offset = max(0, offset)
+        limit = min(max(1, limit), MAX_PAGE_SIZE)
+        sort = sort if sort in self.sort_keys else self.default_sort
+        with self._lock:
+            entry = self._entry(key)
+            candidates = None
+            for field, value in (filters or {}).items():
+                if value in (None, ''):
+                    continue
+                if field in self.filter_fields:
+                    matched = self._value_positions(entry, field, str(value))
+                elif field in self.prefix_fields:
+                    matched = self._prefix_positions(entry, field, str(value))
+                else:
+                    continue
+                candidates = matched if candidates is None else candidates & matched
+
+            positions, ranks = self._order(entry, sort)
+            if candidates is None:
+                total = len(positions)
+                ordered = positions[::-1] if descending else positions
+                selected = ordered[offset:offset + limit]
+            else:
+                # 筛选后只对候选行按名次排序
+                total = len(candidates)
+                selected = sorted(candidates, key=ranks.__getitem__, reverse=descending)[offset:offset + limit]
+            rows = [dict(entry.rows[position]) for position in selected]
+
+        next_offset = offset + len(rows) if offset + len(rows) < total else None
+        return ListingPage(rows, total, offset, next_offset)
+
+    def stats(self):
+        with self._lock:
+            return {'cached': len(self._entries), 'builds': self.builds}
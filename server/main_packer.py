@@ -2,19 +2,36 @@
 # ！！！注意：现在和auntie相关的代码都是对应护工，和caregiver相关的代码都是对应着护士！！！！#
 #######################################################################################
 
-from flask import Flask, jsonify, request, render_template, redirect, url_for
+from flask import Flask, Response, g, jsonify, request, render_template, redirect, url_for, send_from_directory
 import time
-import csv # 导入 Python 内置的 CSV 处理模块
 import os
 from werkzeug.utils import secure_filename # 导入安全文件名工具
 from datetime import datetime, timedelta
-import schedule
 import threading
 import json
+import zlib
+from storage import load_storage_config, create_backend
+from task_store import TaskStore
+from credentials import CredentialIndex, hash_password
+from revision_tracker import RevisionTracker
+from json_stream import stream_json_response
+from schedule_engine import ScheduleEngine, SCHEDULE_FIELDNAMES
+from job_scheduler import JobScheduler
+from patient_index import PatientIndex
+import image_variants
+from process_lock import InterProcessLock, LeaderLock, lock_path
+from task_notifier import TaskNotifier
+from app_logging import get_logger, setup_logging
+from metrics import MetricsRegistry
+from listing_index import ListingIndex, DEFAULT_PAGE_SIZE, natural_key
+from task_archive import TaskArchive, GROUP_FIELDS, count_tasks, merge_counts, parse_date
+from adherence_rollup import AdherenceRollups, rollup_day, slot_deadlines, index_rows
 
 # --- 1. 创建 Flask 应用实例 ---
 app = Flask(__name__)
 
+log = get_logger('server')
+
 # --- URL前缀配置 ---
 # 本地开发时设置为空字符串，远程部署时设置为'/flask'
 URL_PREFIX = ''  # 本地开发
@@ -37,41 +54,34 @@ os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 # 允许的文件扩展名
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'bmp', 'webp'}
 
+# 存储后端（csv 或 sqlite），由 config.json 中的 storage_backend 选择
+STORAGE_CONFIG = load_storage_config('config.json')
+storage = create_backend(STORAGE_CONFIG)
+
+# 日志级别：环境变量 EZDOSE_LOG_LEVEL 优先，其次 config.json 的 log_level（生产环境建议 WARNING）
+setup_logging(STORAGE_CONFIG.get('log_level'), STORAGE_CONFIG.get('log_file'))
+
 # ============= 分药机系统需要的函数 ==============#
 
 def read_csv_safe(filename):
     """Safely read CSV file and return data or empty list if file doesn't exist"""
     try:
-        if os.path.exists(filename):
-            data = []
-            # ⭐ 修改：使用 utf-8-sig 自动处理BOM字符
-            with open(filename, 'r', encoding='utf-8-sig') as file:
-                csv_reader = csv.DictReader(file)
-                for row in csv_reader:
-                    # ⭐ 清理字段名，去除可能的特殊字符
-                    clean_row = {}
-                    for key, value in row.items():
-                        clean_key = key.strip().replace('\ufeff', '')  # 去除BOM字符
-                        clean_row[clean_key] = value
-                    data.append(clean_row)
-            return data
-        else:
-            return []
+        # ⭐ 修改：通过存储后端读取，已处理BOM字符和字段名（返回的行是只读的）
+        return list(storage.read_rows(filename))
+    except FileNotFoundError:
+        return []
     except Exception as e:
-        print(f"Error reading {filename}: {e}")
+        log.error("读取 %s 失败: %s", filename, e)
         return []
 
 def write_csv_safe(filename, data, fieldnames):
     """Safely write data to CSV file"""
     try:
-        # ⭐ 使用 utf-8-sig 确保兼容性，同时避免BOM问题
-        with open(filename, 'w', newline='', encoding='utf-8-sig') as file:
-            writer = csv.DictWriter(file, fieldnames=fieldnames)
-            writer.writeheader()
-            writer.writerows(data)
+        # ⭐ CSV后端使用 utf-8-sig 确保兼容性，同时避免BOM问题
+        storage.write_rows(filename, data, fieldnames)
         return True
     except Exception as e:
-        print(f"Error writing {filename}: {e}")
+        log.error("写入 %s 失败: %s", filename, e)
         return False
 
 def ensure_patient_fields(patient_data):
@@ -105,26 +115,167 @@ def allowed_file(filename):
 def write_csv_file(filename, data, fieldnames):
     """将字典列表写入指定的CSV文件，会覆盖旧文件。"""
     try:
-        with open(filename, mode='w', encoding='utf-8-sig', newline='') as csvfile:
-            writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-            writer.writeheader()
-            writer.writerows(data)
+        storage.write_rows(filename, data, fieldnames)
     except Exception as e:
-        print(f"!!! 严重错误: 写入 {filename} 时发生错误: {e}")
+        log.error("写入 %s 时发生错误: %s", filename, e)
 
-def read_csv_file(filename):
-    """从指定的CSV文件中读取所有数据，并返回一个字典列表。"""
-    data = []
+def read_csv_snapshot(filename):
+    """
+    从存储后端读取表格的只读快照（元组，每行不可修改）。
+    只读的路由优先使用这个函数，避免复制；需要修改数据时请使用 read_csv_file。
+    """
     try:
-        with open(filename, mode='r', encoding='utf-8-sig', newline='') as csvfile:
-            reader = csv.DictReader(csvfile)
-            for row in reader:
-                data.append(row)
+        return storage.read_rows(filename)
     except FileNotFoundError:
-        print(f"!!! 严重错误: 找不到文件 {filename}！")
+        log.error("找不到文件 %s", filename)
     except Exception as e:
-        print(f"!!! 严重错误: 读取 {filename} 时发生错误: {e}")
-    return data
+        log.error("读取 %s 时发生错误: %s", filename, e)
+    return ()
+
+def query_csv_snapshot(filename, **conditions):
+    """按列的值精确筛选表格（SQLite后端会使用索引），返回只读快照"""
+    try:
+        return storage.query_rows(filename, **conditions)
+    except FileNotFoundError:
+        log.error("找不到文件 %s", filename)
+    except Exception as e:
+        log.error("读取 %s 时发生错误: %s", filename, e)
+    return ()
+
+def read_csv_file(filename):
+    """从指定的CSV文件中读取所有数据，并返回一个字典列表（可以随意修改的副本）。"""
+    return [dict(row) for row in read_csv_snapshot(filename)]
+
+# 每日任务存储：按 (patientId, timeSlotName) 建索引，修改先写日志再定期合并回CSV
+# 直接使用 storage.write_rows：写入失败时抛出异常，合并时不会在CSV没写成功的情况下删掉日志
+task_store = TaskStore(read_csv_file, storage.write_rows, signature=storage.signature, data_dir='data',
+                       remove_csv=storage.remove)
+
+# 两张账号表的“读取-修改-写回”（管理页面增删改、登录时把明文密码改写为哈希）需要串行
+accounts_lock = InterProcessLock(lock_path('accounts'))
+
+# 登录凭据索引：按用户名查找，aunties.csv / caregivers.csv 变化时自动重建
+credential_index = CredentialIndex(storage.read_rows, storage.signature, storage.write_rows, accounts_lock)
+
+# 表格版本跟踪：为GET接口提供 ETag 和 since=<revision> 增量同步
+revision_tracker = RevisionTracker()
+
+# 排班引擎：处方表解析成数组后缓存，一次计算任意日期范围的排班
+schedule_engine = ScheduleEngine(storage.read_rows, storage.signature, PRESCRIPTIONS_FILE)
+
+# 所有带 patientId 的表：三张主表加上每天的排班/任务文件
+PATIENT_FIELDNAMES = ['patientId', 'auntieId', 'imageResourceId', 'patientName', 'patientBedNumber', 'patientBarcode']
+PATIENT_TABLES = (PATIENTS_FILE, PRESCRIPTIONS_FILE, 'data/schedules.csv')
+
+def patient_tables():
+    """需要建立患者索引的所有表格文件名"""
+    dated = [f"data/{f}" for f in storage.list_files('data') if PatientIndex.dated_file_date(f)]
+    return list(PATIENT_TABLES) + dated
+
+# 跨表患者索引：patientId -> 每张表中的行号，表格写入后按表增量重建
+patient_index = PatientIndex(storage.read_rows, storage.signature, patient_tables, PATIENTS_FILE)
+
+# 任务变化通知：长轮询 / SSE 连接等待某天的任务变化，修改任务后立即唤醒
+task_notifier = TaskNotifier(task_store.disk_signature)
+
+# 历史任务归档：ARCHIVE_AFTER_DAYS 天之前的每日任务按月存为压缩的列式文件，供日期范围统计使用
+task_archive = TaskArchive(os.path.join('data', 'archive'))
+ARCHIVE_AFTER_DAYS = 7
+
+# 服药依从性日汇总：每天的任务按患者、护工、时间段汇总后按月保存，周/月统计只读汇总
+adherence_rollups = AdherenceRollups(storage.read_rows, storage.write_rows, storage.signature,
+                                     storage.list_files, 'data')
+ADHERENCE_PERIODS = {'week': 7, 'month': 30}
+
+# 性能指标：/admin/metrics 以 Prometheus 文本格式输出，多进程部署时合并所有 worker 的指标
+metrics = MetricsRegistry(snapshot_dir=os.path.join('data', '.metrics'))
+http_requests = metrics.counter('ezdose_http_requests_total', '按路由、方法和状态码统计的请求数')
+rejected_watchers = metrics.counter('ezdose_task_watchers_rejected_total', '等待任务变化的连接超过上限被拒绝（503）的次数')
+http_duration = metrics.histogram('ezdose_http_request_duration_seconds', '按路由和方法统计的请求处理时间（秒）')
+
+# 长轮询最长等待秒数（要小于反向代理的超时时间）、SSE 心跳间隔
+LONG_POLL_MAX_SECONDS = 30
+SSE_HEARTBEAT_SECONDS = 20
+# SSE 连接的最长保持时间，到时结束事件流，客户端按 Last-Event-ID 自动重连（可能重连到其它 worker）
+SSE_MAX_LIFETIME_SECONDS = 300
+SSE_RETRY_MS = 2000
+# 每个进程最多同时等待任务变化的连接数（长轮询 + SSE），超过时返回503。
+# gthread 下每个等待的连接占用一个线程，上限保证总有线程处理普通请求（gunicorn.conf.py 按线程数设置）
+MAX_TASK_WATCHERS = int(os.environ.get('EZDOSE_MAX_TASK_WATCHERS', 1000))
+WATCHER_RETRY_AFTER_SECONDS = 5
+task_watcher_slots = threading.BoundedSemaphore(MAX_TASK_WATCHERS)
+
+# 后台预先生成未来多少天的排班和任务文件（包括今天）
+PREGENERATE_DAYS = 7
+
+# 各表的主键，用于计算增量
+PATIENT_KEY_FIELDS = ('patientId',)
+PRESCRIPTION_KEY_FIELDS = ('patientId', 'medicine_name')
+SCHEDULE_KEY_FIELDS = ('patientId', 'timeSlotName')
+TASK_KEY_FIELDS = ('patientId', 'timeSlotName')
+
+# 处方表的字段和新增处方时必须提供的字段
+PRESCRIPTION_FIELDNAMES = ['patient_name', 'patientId', 'rfid', 'medicine_name', 'morning_dosage',
+                           'noon_dosage', 'evening_dosage', 'meal_timing', 'start_date',
+                           'duration_days', 'last_dispensed_expiry_date', 'is_active', 'pill_size']
+PRESCRIPTION_REQUIRED_FIELDS = ['patient_name', 'patientId', 'medicine_name', 'morning_dosage',
+                                'noon_dosage', 'evening_dosage', 'meal_timing', 'start_date',
+                                'duration_days', 'pill_size']
+
+# 处方表的“读取-修改-写回”需要串行，避免整表上传和增量修改互相覆盖（多进程部署时跨进程）
+prescriptions_lock = InterProcessLock(lock_path('prescriptions'))
+
+def versioned_table(name, filename, key_fields):
+    """读取表格并登记到版本跟踪器，返回 TableVersion"""
+    signature = storage.signature(filename)
+    rows = read_csv_snapshot(filename) if signature is not None else ()
+    # 以表格的修改时间作为版本号，多个 worker 进程给出相同的 revision / ETag
+    return revision_tracker.observe(name, signature, rows, key_fields, revision=storage.modified_time_us(filename))
+
+def versioned_response(version, rows_filter=None, envelope=False, depends_on=()):
+    """
+    根据表格版本生成带 ETag 的响应
+    - If-None-Match 与当前 ETag 相同时返回 304
+    - URL参数 since=<revision> 在跟踪范围内时只返回变化的行和被删除的主键
+    - 响应体逐行流式生成，客户端支持时使用 gzip / deflate 压缩
+    Args:
+        version: TableVersion
+        rows_filter: 行过滤函数（例如按 auntieId 筛选），增量中不再满足条件的行作为删除返回
+        envelope: 是否使用 {"success", "data", "count"} 格式（分药机接口），否则全量时直接返回列表
+        depends_on: 过滤条件依赖的其它表的 TableVersion，它们变化时 ETag 也会变化并返回全量
+    """
+    since = request.args.get('since', type=int)
+    revisions = '-'.join(str(v.revision) for v in (version,) + tuple(depends_on))
+    # ETag 只取决于数据版本和筛选条件，与 since 无关：版本没变时客户端已有的数据就是最新的
+    query = '&'.join(f"{k}={v}" for k, v in sorted(request.args.items(multi=True)) if k != 'since')
+    etag = f"{revisions}-{zlib.crc32(query.encode('utf-8')):08x}"
+
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+        response.set_etag(etag, weak=True)
+        response.headers['X-Revision'] = str(version.revision)
+        return response
+
+    can_diff = version.can_diff(since) and all(dep.revision <= since for dep in depends_on)
+    if can_diff:
+        changed, deleted = version.changes_since(since)
+        if rows_filter:
+            deleted += [dict(zip(version.key_fields, version.key(row))) for row in changed if not rows_filter(row)]
+            changed = [row for row in changed if rows_filter(row)]
+        body = {"delta": True, "revision": version.revision, "data": changed, "deleted": deleted, "count": len(changed)}
+        if envelope:
+            body["success"] = True
+    else:
+        rows = [row for row in version.rows if rows_filter(row)] if rows_filter else list(version.rows)
+        if envelope or since is not None:
+            body = {"success": True, "delta": False, "revision": version.revision, "data": rows, "count": len(rows)}
+        else:
+            body = rows
+
+    response = stream_json_response(body, app.json.dumps, request.accept_encodings)
+    response.set_etag(etag, weak=True)
+    response.headers['X-Revision'] = str(version.revision)
+    return response
 
 # 新增：读取和保存配置的函数
 def read_schedule_config():
@@ -138,7 +289,7 @@ def read_schedule_config():
             # 默认配置
             return '04:00'
     except Exception as e:
-        print(f"读取排班配置失败: {e}")
+        log.error("读取排班配置失败: %s", e)
         return '04:00'
 
 def save_schedule_config(schedule_time):
@@ -150,7 +301,7 @@ def save_schedule_config(schedule_time):
             json.dump(config, f, ensure_ascii=False, indent=2)
         return True
     except Exception as e:
-        print(f"保存排班配置失败: {e}")
+        log.error("保存排班配置失败: %s", e)
         return False
 
 # 全局变量存储当前配置的时间
@@ -162,6 +313,33 @@ def inject_url_prefix():
     """将 URL_PREFIX 注入到所有模板中"""
     return {'URL_PREFIX': URL_PREFIX}
 
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    """记录每个请求的处理时间（按路由模板统计，/tasks/<id> 这类路由不会按参数分散）"""
+    started = g.pop('request_started', None)
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        http_duration.observe(time.perf_counter() - started, route=route, method=request.method)
+        http_requests.inc(route=route, method=request.method, status=response.status_code)
+    return response
+
+# 按内容哈希命名的患者照片内容永远不变，可以让客户端缓存一年
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+@app.after_request
+def add_image_cache_headers(response):
+    """为 /static/images_patients 下按内容哈希命名的照片加上长期缓存头"""
+    if request.endpoint == 'static' and response.status_code == 200:
+        filename = (request.view_args or {}).get('filename', '')
+        folder, _, name = filename.rpartition('/')
+        if folder == 'images_patients' and image_variants.is_variant_file(name):
+            response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+    return response
+
 #############
 # 根路径路由 #
 #############
@@ -182,23 +360,15 @@ def index():
 
 @app.route('/packer/patients', methods=['GET'])
 def get_patients_for_dispensing():
-    """Get all patients"""
-    patients = read_csv_safe(PATIENTS_FILE)
-    return jsonify({
-        "success": True,
-        "data": patients,
-        "count": len(patients)
-    })
+    """Get all patients (supports ETag / If-None-Match and ?since=<revision>)"""
+    version = versioned_table('patients', PATIENTS_FILE, PATIENT_KEY_FIELDS)
+    return versioned_response(version, envelope=True)
 
 @app.route('/packer/prescriptions', methods=['GET'])
 def get_prescriptions_for_dispensing():
-    """Get all prescriptions"""
-    prescriptions = read_csv_safe(PRESCRIPTIONS_FILE)
-    return jsonify({
-        "success": True,
-        "data": prescriptions,
-        "count": len(prescriptions)
-    })
+    """Get all prescriptions (supports ETag / If-None-Match and ?since=<revision>)"""
+    version = versioned_table('prescriptions', PRESCRIPTIONS_FILE, PRESCRIPTION_KEY_FIELDS)
+    return versioned_response(version, envelope=True)
 
 @app.route('/packer/patients/upload', methods=['POST'])
 def upload_patients_for_dispensing():
@@ -269,9 +439,7 @@ def upload_prescriptions_for_dispensing():
         prescriptions = data['prescriptions']
         
         # Validate each prescription
-        required_fields = ['patient_name', 'patientId', 'medicine_name', 'morning_dosage', 
-                          'noon_dosage', 'evening_dosage', 'meal_timing', 'start_date', 
-                          'duration_days', 'pill_size']
+        required_fields = PRESCRIPTION_REQUIRED_FIELDS
         
         for i, prescription in enumerate(prescriptions):
             if not isinstance(prescription, dict):
@@ -294,11 +462,10 @@ def upload_prescriptions_for_dispensing():
             prescription.setdefault('is_active', 1)
         
         # Write to CSV (replaces existing file)
-        fieldnames = ['patient_name', 'patientId', 'rfid', 'medicine_name', 'morning_dosage',
-                     'noon_dosage', 'evening_dosage', 'meal_timing', 'start_date',
-                     'duration_days', 'last_dispensed_expiry_date', 'is_active', 'pill_size']
+        with prescriptions_lock:
+            written = write_csv_safe(PRESCRIPTIONS_FILE, prescriptions, PRESCRIPTION_FIELDNAMES)
         
-        if write_csv_safe(PRESCRIPTIONS_FILE, prescriptions, fieldnames):
+        if written:
             return jsonify({
                 "success": True,
                 "message": f"Successfully uploaded {len(prescriptions)} prescriptions",
@@ -316,60 +483,154 @@ def upload_prescriptions_for_dispensing():
             "message": f"Error uploading prescriptions: {str(e)}"
         }), 500
 
+@app.route('/packer/prescriptions', methods=['PATCH'])
+def patch_prescriptions_for_dispensing():
+    """
+    Upsert / delete individual prescriptions keyed by (patientId, medicine_name)
+    请求体:
+        {"base_revision": 客户端上次同步的revision（可选）,
+         "upserts": [{"patientId", "medicine_name", 需要修改的字段...}],
+         "deletes": [{"patientId", "medicine_name"}]}
+    已有的处方只修改提供的字段，新的处方必须包含所有必填字段。
+    提供 base_revision 时做乐观并发检查：涉及的行在 base_revision 之后被别人修改或删除过，
+    则整个请求不生效并返回409，客户端需要重新同步后再提交。
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"success": False, "message": "Invalid data format. Expected: {'upserts': [...], 'deletes': [...]}"}), 400
+
+    upserts = data.get('upserts', [])
+    deletes = data.get('deletes', [])
+    base_revision = data.get('base_revision')
+    if not isinstance(upserts, list) or not isinstance(deletes, list) or \
+            (base_revision is not None and not isinstance(base_revision, int)):
+        return jsonify({"success": False, "message": "Invalid data format. Expected: {'upserts': [...], 'deletes': [...]}"}), 400
+
+    for i, item in enumerate(upserts + deletes):
+        if not isinstance(item, dict) or not all(item.get(field) not in (None, '') for field in PRESCRIPTION_KEY_FIELDS):
+            return jsonify({"success": False, "message": f"Item {i} must contain patientId and medicine_name"}), 400
+        unknown = [field for field in item if field not in PRESCRIPTION_FIELDNAMES]
+        if unknown:
+            return jsonify({"success": False, "message": f"Unknown fields in item {i}: {', '.join(unknown)}"}), 400
+
+    def key_of(row):
+        return tuple(str(row.get(field, '')) for field in PRESCRIPTION_KEY_FIELDS)
+
+    with prescriptions_lock:
+        version = versioned_table('prescriptions', PRESCRIPTIONS_FILE, PRESCRIPTION_KEY_FIELDS)
+
+        # 乐观并发检查
+        if base_revision is not None:
+            if version.can_diff(base_revision):
+                conflicts = [dict(zip(PRESCRIPTION_KEY_FIELDS, key)) for key in {key_of(item) for item in upserts + deletes}
+                             if version.row_revisions.get(key, 0) > base_revision
+                             or version.tombstones.get(key, 0) > base_revision]
+            else:
+                # base_revision 不是本 worker 登记过的版本（例如服务器重启过、由其它 worker 发出），无法判断，要求客户端重新同步
+                conflicts = [dict(zip(PRESCRIPTION_KEY_FIELDS, key_of(item))) for item in upserts + deletes]
+            if conflicts:
+                return jsonify({
+                    "success": False,
+                    "message": "Prescriptions were modified on server, please sync and retry",
+                    "revision": version.revision,
+                    "conflicts": conflicts
+                }), 409
+
+        prescriptions = [dict(row) for row in version.rows]
+        positions = {key_of(row): index for index, row in enumerate(prescriptions)}
+
+        upserted = 0
+        for i, item in enumerate(upserts):
+            values = {field: ('' if value is None else str(value)) for field, value in item.items()}
+            index = positions.get(key_of(item))
+            if index is not None:
+                prescriptions[index].update(values)
+            else:
+                missing_fields = [field for field in PRESCRIPTION_REQUIRED_FIELDS if field not in item]
+                if missing_fields:
+                    return jsonify({
+                        "success": False,
+                        "message": f"Missing fields in new prescription {i}: {', '.join(missing_fields)}"
+                    }), 400
+                values.setdefault('rfid', '')
+                values.setdefault('last_dispensed_expiry_date', '')
+                values.setdefault('is_active', '1')
+                positions[key_of(item)] = len(prescriptions)
+                prescriptions.append(values)
+            upserted += 1
+
+        delete_keys = {key_of(item) for item in deletes}
+        remaining = [row for row in prescriptions if key_of(row) not in delete_keys]
+        deleted = len(prescriptions) - len(remaining)
+
+        if not write_csv_safe(PRESCRIPTIONS_FILE, remaining, PRESCRIPTION_FIELDNAMES):
+            return jsonify({"success": False, "message": "Failed to update prescriptions"}), 500
+
+        new_version = versioned_table('prescriptions', PRESCRIPTIONS_FILE, PRESCRIPTION_KEY_FIELDS)
+
+    log.info("增量更新处方: 修改/新增 %d 条, 删除 %d 条", upserted, deleted)
+    return jsonify({
+        "success": True,
+        "upserted": upserted,
+        "deleted": deleted,
+        # previous_revision 等于客户端的 base_revision 时，说明期间没有其它修改，客户端可以直接把版本推进到 revision
+        "previous_revision": version.revision,
+        "revision": new_version.revision
+    })
+
 ##########################
 # 护工系统手机App使用的API #
 ###########################
 @app.route('/patients', methods=['GET'])
 def get_patients():
     """返回所有病人的列表，或者根据 auntieId 筛选。"""
-    print(f"[{time.ctime()}] App请求 /patients 数据")
-    all_patients = read_csv_file('data/patients.csv')
+    log.debug("App请求 /patients 数据")
+    version = versioned_table('patients', PATIENTS_FILE, PATIENT_KEY_FIELDS)
     
     auntie_id = request.args.get('auntieId', type=int)
     if (auntie_id):
         # CSV读出来的值是字符串，所以要和字符串比较
-        filtered_patients = [p for p in all_patients if p.get('auntieId') == str(auntie_id)]
-        return jsonify(filtered_patients)
+        return versioned_response(version, rows_filter=lambda p: p.get('auntieId') == str(auntie_id))
         
-    return jsonify(all_patients)
+    return versioned_response(version)
 
 @app.route('/timeslots', methods=['GET'])
 def get_timeslots():
     """返回所有时间段的列表。"""
-    print(f"[{time.ctime()}] App请求 /timeslots 数据")
-    timeslots = read_csv_file('data/timeslots.csv')
-    return jsonify(timeslots)
+    log.debug("App请求 /timeslots 数据")
+    timeslots = read_csv_snapshot('data/timeslots.csv')
+    return jsonify(list(timeslots))
     
 @app.route('/schedules', methods=['GET'])
 def get_schedules():
     """返回所有用药计划，或者根据 auntieId 筛选。"""
-    print(f"[{time.ctime()}] App请求 /schedules 数据")
-    all_schedules = read_csv_file('data/schedules.csv')    
+    log.debug("App请求 /schedules 数据")
+    version = versioned_table('schedules', 'data/schedules.csv', SCHEDULE_KEY_FIELDS)
     auntie_id = request.args.get('auntieId', type=int)
     if auntie_id:
-        all_patients = read_csv_file('data/patients.csv')
-        her_patient_ids = {p['patientId'] for p in all_patients if p.get('auntieId') == str(auntie_id)}
-        filtered_schedules = [s for s in all_schedules if s.get('patientId') in her_patient_ids]
-        return jsonify(filtered_schedules)
+        patients_version = versioned_table('patients', PATIENTS_FILE, PATIENT_KEY_FIELDS)
+        her_patient_ids = {p['patientId'] for p in patients_version.rows if p.get('auntieId') == str(auntie_id)}
+        return versioned_response(version, rows_filter=lambda s: s.get('patientId') in her_patient_ids,
+                                  depends_on=(patients_version,))
 
-    return jsonify(all_schedules)
+    return versioned_response(version)
 
 
 # 为护工数据提供API接口
 @app.route('/caregivers', methods=['GET'])
 def get_caregivers():
     """返回所有护工的列表。"""
-    print(f"[{time.ctime()}] App请求 /caregivers 数据")
-    caregivers = read_csv_file('data/caregivers.csv')
-    return jsonify(caregivers)
+    log.debug("App请求 /caregivers 数据")
+    caregivers = read_csv_snapshot('data/caregivers.csv')
+    return jsonify(list(caregivers))
 
 # 为阿姨数据提供API接口
 @app.route('/aunties', methods=['GET'])
 def get_aunties():
     """返回所有阿姨的列表。"""
-    print(f"[{time.ctime()}] App请求 /aunties 数据")
-    aunties = read_csv_file('data/aunties.csv')
-    return jsonify(aunties)
+    log.debug("App请求 /aunties 数据")
+    aunties = read_csv_snapshot('data/aunties.csv')
+    return jsonify(list(aunties))
 
 @app.route('/tasks', methods=['GET'])
 def get_tasks():
@@ -383,55 +644,160 @@ def get_tasks():
     if not date_str:
         date_str = time.strftime("%Y-%m-%d") # 格式 "2025-08-12"
 
-    print(f"[{time.ctime()}] App请求 {date_str} 的任务数据")
+    log.debug("App请求 %s 的任务数据", date_str)
     
-    # 2. 根据日期构建文件名
-    task_filename = f"data/tasks_{date_str}.csv"
-    
-    # 3. 检查当天的任务文件是否存在
-    if not os.path.exists(task_filename):
-        print(f"文件 {task_filename} 不存在，正在根据计划创建...")
+    # 2. 检查当天的任务文件是否存在
+    if not task_store.exists(date_str):
+        # 已经归档的日期只读，不能再根据计划重新创建
+        archived = task_archive.read_day(date_str)
+        if archived is not None:
+            return jsonify(archived)
+
+        log.info("文件 %s 不存在，正在根据计划创建...", task_store.task_filename(date_str))
         
         # ⭐ 修改：优先读取对应日期的排班文件⭐⭐⭐⭐⭐⭐⭐⭐⭐⭐⭐⭐⭐⭐
         schedule_filename = f"data/schedules_{date_str}.csv"
-        all_schedules = read_csv_file(schedule_filename)
+        all_schedules = read_csv_snapshot(schedule_filename)
         
         if not all_schedules:
             # 如果对应日期的排班文件不存在或为空，尝试自动生成
-            print(f"排班文件 {schedule_filename} 不存在或为空，尝试自动生成...")
+            log.info("排班文件 %s 不存在或为空，尝试自动生成...", schedule_filename)
             try:
                 # 调用排班生成函数
                 generated_schedules = generate_schedules_for_date(date_str)
                 if generated_schedules:
-                    print(f"成功自动生成 {len(generated_schedules)} 条排班记录")
+                    log.info("成功自动生成 %d 条排班记录", len(generated_schedules))
                     all_schedules = generated_schedules
                 else:
-                    print(f"日期 {date_str} 没有有效的处方数据，无法生成排班")
+                    log.info("日期 %s 没有有效的处方数据，无法生成排班", date_str)
                     return jsonify([])
             except Exception as e:
-                print(f"自动生成排班失败: {e}")
+                log.error("自动生成排班失败: %s", e)
                 return jsonify([])
         
         # ⭐⭐⭐ 这里是缺失的代码：根据排班创建任务文件 ⭐⭐⭐
-        tasks = []
-        for schedule in all_schedules:
-            task = {
-                'patientId': schedule['patientId'],
-                'timeSlotName': schedule['timeSlotName'],
-                'status': '待服药',
-                'completionTime': '',
-                'remark': ''
-            }
-            tasks.append(task)
+        tasks = build_tasks_from_schedules(all_schedules)
         
         # 保存任务文件
-        fieldnames = ['patientId', 'timeSlotName', 'status', 'completionTime', 'remark']
-        write_csv_file(task_filename, tasks, fieldnames)
-        print(f"已创建任务文件 {task_filename}，包含 {len(tasks)} 个任务")
+        task_store.create_day(date_str, tasks)
+        log.info("已创建任务文件 %s，包含 %d 个任务", task_store.task_filename(date_str), len(tasks))
+
+    # 3. 读取 (已存在的或刚创建的) 当天的任务并返回（支持 ETag 和 since 增量）
+    return versioned_response(versioned_tasks(date_str))
+
+def versioned_tasks(date_str):
+    """读取某天的任务并登记到版本跟踪器，返回 TableVersion"""
+    task_version, changed_at, todays_tasks = task_store.get_tasks_with_version(date_str)
+    return revision_tracker.observe(f"tasks:{date_str}", task_version, todays_tasks, TASK_KEY_FIELDS,
+                                    revision=changed_at)
 
-    # 4. 读取 (已存在的或刚创建的) 当天的任务文件并返回
-    todays_tasks = read_csv_file(task_filename)
-    return jsonify(todays_tasks)
+def auntie_patient_ids(auntie_id):
+    """某个阿姨负责的患者ID集合"""
+    patients_version = versioned_table('patients', PATIENTS_FILE, PATIENT_KEY_FIELDS)
+    return {p['patientId'] for p in patients_version.rows if p.get('auntieId') == str(auntie_id)}
+
+def wait_for_task_changes(date_str, since, auntie_id=None, timeout=LONG_POLL_MAX_SECONDS):
+    """
+    等待某天的任务在 since 之后发生（与该阿姨相关的）变化
+    Args:
+        date_str: 日期
+        since: 客户端已有数据的 revision，None 表示没有数据
+        auntie_id: 只关心这个阿姨负责的患者的任务，None 表示全部
+        timeout: 最长等待秒数
+    Returns:
+        body: 与 /tasks?since= 相同格式的响应体，超时时 data 和 deleted 为空
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        # 先记下代数再读取数据，读取之后发生的变化一定会唤醒下面的等待
+        generation = task_notifier.generation(date_str)
+        version = versioned_tasks(date_str)
+        patient_ids = auntie_patient_ids(auntie_id) if auntie_id else None
+        relevant = (lambda row: row.get('patientId') in patient_ids) if patient_ids is not None else (lambda row: True)
+
+        if not version.can_diff(since):
+            # 没有数据，或 since 不是本 worker 登记过的版本：返回全量
+            rows = [row for row in version.rows if relevant(row)]
+            return {"success": True, "delta": False, "revision": version.revision, "data": rows, "count": len(rows)}
+
+        changed, deleted = version.changes_since(since)
+        changed = [row for row in changed if relevant(row)]
+        deleted = [key for key in deleted if relevant(key)]
+        remaining = deadline - time.monotonic()
+        if changed or deleted or remaining <= 0:
+            return {"success": True, "delta": True, "revision": version.revision,
+                    "data": changed, "deleted": deleted, "count": len(changed)}
+        task_notifier.wait(date_str, generation, remaining)
+
+@app.route('/tasks/watch', methods=['GET'])
+def watch_tasks():
+    """
+    长轮询：等到某天的任务发生变化再返回增量（格式与 /tasks?since= 相同）
+    URL参数: ?date=YYYY-MM-DD&since=<revision>&auntieId=<id>&timeout=<秒>
+    - 没有 since（或 since 太旧）时立即返回全量和 revision
+    - 有变化时立即返回；timeout 秒内没有变化时返回空的增量，客户端用返回的 revision 继续请求
+    """
+    date_str = request.args.get('date') or time.strftime("%Y-%m-%d")
+    since = request.args.get('since', type=int)
+    auntie_id = request.args.get('auntieId', type=int)
+    timeout = min(max(request.args.get('timeout', LONG_POLL_MAX_SECONDS, type=float), 0), LONG_POLL_MAX_SECONDS)
+    if not task_watcher_slots.acquire(blocking=False):
+        return too_many_watchers()
+    try:
+        return jsonify(wait_for_task_changes(date_str, since, auntie_id, timeout))
+    finally:
+        task_watcher_slots.release()
+
+def too_many_watchers():
+    """等待任务变化的连接已达上限：返回503，客户端在 Retry-After 秒后重试"""
+    rejected_watchers.inc()
+    response = jsonify({"success": False, "error": "等待任务变化的连接过多，请稍后重试"})
+    response.status_code = 503
+    response.headers['Retry-After'] = str(WATCHER_RETRY_AFTER_SECONDS)
+    return response
+
+@app.route('/tasks/events', methods=['GET'])
+def task_events():
+    """
+    Server-Sent Events：持续推送某天任务的变化
+    URL参数: ?date=YYYY-MM-DD&auntieId=<id>&since=<revision>
+    断线重连时浏览器/客户端会带上 Last-Event-ID（即上次的 revision），只推送此后的变化
+    每个事件: id=revision，event=tasks，data=与 /tasks/watch 相同的JSON
+    连接最长保持 SSE_MAX_LIFETIME_SECONDS 秒，之后结束事件流，客户端按 Last-Event-ID 自动重连
+    """
+    date_str = request.args.get('date') or time.strftime("%Y-%m-%d")
+    auntie_id = request.args.get('auntieId', type=int)
+    since = request.args.get('since', type=int)
+    last_event_id = request.headers.get('Last-Event-ID', '')
+    if last_event_id.isdigit():
+        since = int(last_event_id)
+
+    if not task_watcher_slots.acquire(blocking=False):
+        return too_many_watchers()
+
+    def generate(since):
+        # 告诉客户端连接结束后多久重连
+        yield f"retry: {SSE_RETRY_MS}\n\n"
+        deadline = time.monotonic() + SSE_MAX_LIFETIME_SECONDS
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            body = wait_for_task_changes(date_str, since, auntie_id, min(SSE_HEARTBEAT_SECONDS, remaining))
+            if body['delta'] and not body['data'] and not body['deleted']:
+                # 没有变化：发送注释行作为心跳，也能及时发现客户端已经断开
+                yield ": keep-alive\n\n"
+                continue
+            since = body['revision']
+            yield f"id: {since}\nevent: tasks\ndata: {json.dumps(body, ensure_ascii=False)}\n\n"
+
+    response = Response(generate(since), mimetype='text/event-stream')
+    # 连接结束（包括客户端断开、事件流还没开始就被关闭）时释放名额
+    response.call_on_close(task_watcher_slots.release)
+    response.headers['Cache-Control'] = 'no-cache'
+    # 让 nginx 不要缓冲事件流
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
 
 @app.route('/task', methods=['PUT']) # 我们用 PUT 表示更新资源
 def update_task():
@@ -450,39 +816,55 @@ def update_task():
         return jsonify({"error": f"请求体缺少必需字段: {required_fields}"}), 400
 
     date_str = update_data['date']
-    task_filename = f"data/tasks_{date_str}.csv"
     
-    if not os.path.exists(task_filename):
-        return jsonify({"error": f"任务文件 {task_filename} 不存在，无法更新"}), 404
-
-    # 3. 读取整个CSV文件到内存
-    all_tasks = read_csv_file(task_filename)
-    task_found = False
-
-    # 4. 遍历内存中的任务列表，找到并修改目标任务
-    for task in all_tasks:
-        if (task.get('patientId') == str(update_data['patientId']) and 
-            task.get('timeSlotName') == update_data['timeSlotName']):
-            
-            print(f"找到了要更新的任务: patientId={task.get('patientId')}, timeSlot={task.get('timeSlotName')}")
-            # 更新字段
-            task['status'] = update_data['status']
-            task['completionTime'] = update_data.get('completionTime', '') # 使用.get()处理可选字段
-            task['remark'] = update_data.get('remark', '')
-            
-            task_found = True
-            break # 找到后就停止循环
+    if not task_store.exists(date_str):
+        return jsonify({"error": f"任务文件 {task_store.task_filename(date_str)} 不存在，无法更新"}), 404
+
+    # 3. 通过 (patientId, timeSlotName) 索引直接定位并修改任务，修改先写入日志
+    task_found = task_store.update_task(
+        date_str,
+        update_data['patientId'],
+        update_data['timeSlotName'],
+        update_data['status'],
+        completion_time=update_data.get('completionTime', ''), # 使用.get()处理可选字段
+        remark=update_data.get('remark', '')
+    )
 
-    # 5. 如果找到了任务，就将修改后的完整列表写回文件
     if task_found:
-        fieldnames = ['patientId', 'timeSlotName', 'status', 'completionTime', 'remark']
-        write_csv_file(task_filename, all_tasks, fieldnames)
-        print("任务更新成功，并已写回CSV文件。")
+        task_notifier.notify(date_str)
+        log.debug("任务更新成功: patientId=%s, timeSlot=%s", update_data['patientId'], update_data['timeSlotName'])
         return jsonify({"success": True, "message": "任务更新成功"})
     else:
-        print("!!! 错误: 尝试更新任务，但在CSV中未找到匹配项。")
+        log.warning("尝试更新任务，但未找到匹配项: patientId=%s, timeSlot=%s",
+                    update_data['patientId'], update_data['timeSlotName'])
         return jsonify({"success": False, "error": "未找到要更新的任务"}), 404
     
+@app.route('/tasks', methods=['PUT'])
+def update_tasks():
+    """
+    批量更新同一天多个任务的状态，一次请求、一次写入。
+    请求体: {"date": "YYYY-MM-DD", "updates": [{patientId, timeSlotName, status, completionTime, remark}, ...]}
+    返回每一项的更新结果。
+    """
+    update_data = request.get_json(force=True, silent=True)
+    if not update_data or 'date' not in update_data or not isinstance(update_data.get('updates'), list):
+        return jsonify({"error": "请求格式错误，需要 date 和 updates 列表"}), 400
+
+    date_str = update_data['date']
+    if not task_store.exists(date_str):
+        return jsonify({"error": f"任务文件 {task_store.task_filename(date_str)} 不存在，无法更新"}), 404
+
+    results = task_store.update_tasks(date_str, update_data['updates'])
+    updated = sum(1 for result in results if result['success'])
+    if updated:
+        task_notifier.notify(date_str)
+    log.debug("批量更新 %s 的任务: 成功 %d / %d", date_str, updated, len(results))
+    return jsonify({
+        "success": updated == len(results),
+        "updated": updated,
+        "results": results
+    })
+    
 ##########################
 # 护工给药系统后台登陆界面 #
 ##########################
@@ -495,39 +877,160 @@ def login():
 
     username = auth_data['username']
     password = auth_data['password']
-    
-    # ⭐ 1. 打印从App接收到的原始数据
-    print("="*30)
-    print(f"收到登录请求:")
-    print(f"  - App发来的Username: '{username}' (类型: {type(username)})")
-    print(f"  - App发来的Password: '{password}' (类型: {type(password)})")
-    print("="*30)
-
-        # a. 先在 aunties.csv 中查找
-    for auntie in read_csv_file('data/aunties.csv'):
-        if auntie.get('username') == username and auntie.get('password') == password:
-            print(f"阿姨 '{username}' 验证成功！")
-            return jsonify({
-                "success": True, "userId": int(auntie['auntieId']),
-                "role": "auntie", "name": auntie['name']
-            })
 
-    # b. 如果不是阿姨，再在 caregivers.csv 中查找
-    for caregiver in read_csv_file('data/caregivers.csv'):
-        if caregiver.get('username') == username and caregiver.get('password') == password:
-            print(f"护工 '{username}' 验证成功！")
-            return jsonify({
-                "success": True, "userId": int(caregiver['caregiverId']),
-                "role": "caregiver", "name": caregiver['name']
-            })
+    # 在用户名索引中查找（护工优先，其次护士），不再逐行扫描两张表
+    user = credential_index.authenticate(username, password)
+    if user:
+        log.info("%s '%s' 验证成功", '阿姨' if user['role'] == 'auntie' else '护工', username)
+        return jsonify({"success": True, **user})
 
-    print(f"用户 '{username}' 验证失败！")
+    log.warning("用户 '%s' 验证失败", username)
     return jsonify({"success": False, "error": "用户名或密码错误"}), 401
 
 ################################
 # 护工系统Web管理后台的页面路由  #
 ################################
 
+# --- 管理后台列表的分页、排序和筛选 ---
+# 列表行和排序、筛选索引按相关表格的签名缓存，表格没有变化时翻页、换排序不再重新读表和关联
+
+# 列表页面的URL参数 -> 列表行中的列
+LISTING_FILTER_ARGS = {'auntieId': 'auntieId', 'bed': 'patientBedNumber', 'timeSlot': 'timeSlotName', 'status': 'status'}
+TASK_STATUSES = ('待服药', '已服药')
+
+def patient_details_map():
+    """patientId -> 患者行，用于给排班和任务补充姓名、护工和床号"""
+    return {p['patientId']: p for p in read_csv_snapshot(PATIENTS_FILE)}
+
+def timeslot_order():
+    """时间段名称 -> (顺序, 显示名称)，按 timeslots.csv 中的顺序"""
+    return {ts['name']: (i, ts['displayName']) for i, ts in enumerate(read_csv_snapshot('data/timeslots.csv'))}
+
+def tasks_for_day(date_str):
+    """某天的任务：优先读每日文件，已归档的日期从归档读取，都没有时返回None"""
+    if task_store.exists(date_str):
+        return task_store.get_tasks(date_str)
+    return task_archive.read_day(date_str)
+
+def build_patient_listing(_key):
+    """患者列表行：补充负责护工的姓名"""
+    auntie_name_map = {auntie['auntieId']: auntie['name'] for auntie in read_csv_snapshot('data/aunties.csv')}
+    rows = []
+    for patient in read_csv_snapshot(PATIENTS_FILE):
+        row = dict(patient)
+        row['auntieName'] = auntie_name_map.get(patient.get('auntieId', ''), '')
+        rows.append(row)
+    return rows
+
+def build_schedule_listing(schedule_filename):
+    """排班列表行：同一患者的多个时间段合并为一行"""
+    patients = patient_details_map()
+    slots = timeslot_order()
+    patient_schedules = {}
+    for schedule in read_csv_snapshot(schedule_filename):
+        patient_id = schedule['patientId']
+        row = patient_schedules.get(patient_id)
+        if row is None:
+            patient = patients.get(patient_id, {})
+            row = patient_schedules[patient_id] = {
+                'patientId': patient_id,
+                'patientName': schedule['patientName'],
+                'auntieId': patient.get('auntieId', ''),
+                'patientBedNumber': patient.get('patientBedNumber', ''),
+                'timeSlotName': [],
+                'timeSlots': []
+            }
+        row['timeSlotName'].append(schedule['timeSlotName'])
+    for row in patient_schedules.values():
+        row['timeSlotName'].sort(key=lambda name: slots.get(name, (len(slots),))[0])
+        row['timeSlots'] = [slots.get(name, (0, name))[1] for name in row['timeSlotName']]
+    return list(patient_schedules.values())
+
+def build_task_listing(date_str):
+    """某天的服药记录行：补充患者姓名、护工、床号和时间段中文名（已归档的日期从归档读取）"""
+    tasks = tasks_for_day(date_str) or []
+    patients = patient_details_map()
+    slots = timeslot_order()
+    rows = []
+    for task in tasks:
+        patient = patients.get(task['patientId'], {})
+        order, display_name = slots.get(task['timeSlotName'], (len(slots), task['timeSlotName']))
+        task['patientName'] = patient.get('patientName', '未知患者')
+        task['auntieId'] = patient.get('auntieId', '')
+        task['patientBedNumber'] = patient.get('patientBedNumber', '')
+        task['timeSlotOrder'] = order
+        task['timeSlot_displayName'] = display_name
+        rows.append(task)
+    return rows
+
+def table_signatures(*filenames):
+    return tuple(storage.signature(filename) for filename in filenames)
+
+patient_listing = ListingIndex(
+    build_patient_listing,
+    lambda _key: table_signatures(PATIENTS_FILE, 'data/aunties.csv'),
+    {'patientId': lambda r: natural_key(r['patientId']),
+     'patientName': lambda r: r['patientName'],
+     'patientBedNumber': lambda r: natural_key(r['patientBedNumber']),
+     'auntieName': lambda r: r['auntieName']},
+    filter_fields=('auntieId',), prefix_fields=('patientBedNumber',))
+
+schedule_listing = ListingIndex(
+    build_schedule_listing,
+    lambda filename: table_signatures(filename, PATIENTS_FILE, 'data/timeslots.csv'),
+    {'patientId': lambda r: natural_key(r['patientId']),
+     'patientName': lambda r: r['patientName'],
+     'patientBedNumber': lambda r: natural_key(r['patientBedNumber'])},
+    filter_fields=('auntieId', 'timeSlotName'), prefix_fields=('patientBedNumber',))
+
+task_listing = ListingIndex(
+    build_task_listing,
+    lambda date_str: (task_store.disk_signature(date_str), task_archive.signature(date_str))
+                     + table_signatures(PATIENTS_FILE, 'data/timeslots.csv'),
+    {'patientId': lambda r: (natural_key(r['patientId']), r['timeSlotOrder']),
+     'patientName': lambda r: (r['patientName'], r['timeSlotOrder']),
+     'patientBedNumber': lambda r: (natural_key(r['patientBedNumber']), r['timeSlotOrder']),
+     'timeSlot': lambda r: r['timeSlotOrder'],
+     'status': lambda r: r['status'],
+     'completionTime': lambda r: r['completionTime']},
+    filter_fields=('auntieId', 'timeSlotName', 'status'), prefix_fields=('patientBedNumber',))
+
+@app.template_global()
+def listing_url(**overrides):
+    """当前列表页面的链接：保留筛选和排序参数，替换 overrides 中的参数（值为None或空时去掉）"""
+    args = {k: v for k, v in request.args.items() if k not in ('offset', 'partial')}
+    args.update(overrides)
+    args = {k: v for k, v in args.items() if v not in (None, '')}
+    return URL_PREFIX + url_for(request.endpoint, **(request.view_args or {}), **args)
+
+def render_listing(template, rows_template, listing, key=None, **context):
+    """
+    按URL参数查询一页并渲染
+    - 带 partial=1 时只渲染表格行（页面滚动到底部时请求下一页），
+      总行数和下一页的起始位置放在 X-Total-Count / X-Next-Offset 响应头中
+    - 否则渲染整个页面（只包含第一页）
+    URL参数: offset, limit, sort, order=asc|desc, 以及 LISTING_FILTER_ARGS 中的筛选条件
+    """
+    sort = request.args.get('sort')
+    sort = sort if sort in listing.sort_keys else listing.default_sort
+    order = 'desc' if request.args.get('order') == 'desc' else 'asc'
+    filters = {field: request.args.get(arg, '').strip() for arg, field in LISTING_FILTER_ARGS.items()}
+    page = listing.query(key, filters, sort, order == 'desc',
+                         offset=request.args.get('offset', 0, type=int),
+                         limit=request.args.get('limit', DEFAULT_PAGE_SIZE, type=int))
+
+    if request.args.get('partial'):
+        response = Response(render_template(rows_template, rows=page.rows))
+        response.headers['X-Total-Count'] = str(page.total)
+        response.headers['X-Next-Offset'] = '' if page.next_offset is None else str(page.next_offset)
+        return response
+
+    return render_template(template, rows=page.rows, page=page, sort=sort, order=order,
+                           filters={arg: request.args.get(arg, '') for arg in LISTING_FILTER_ARGS},
+                           aunties_for_filter=read_csv_snapshot('data/aunties.csv'),
+                           timeslots_for_filter=read_csv_snapshot('data/timeslots.csv'),
+                           **context)
+
 # --- 首页页面路由  ---
 @app.route('/admin')
 def admin_dashboard():
@@ -538,118 +1041,114 @@ def admin_dashboard():
 @app.route('/admin/aunties')
 def manage_aunties():
     """显示所有阿姨的列表页面"""
-    aunties_list = read_csv_file('data/aunties.csv')
+    aunties_list = read_csv_snapshot('data/aunties.csv')
     return render_template('aunties.html', aunties=aunties_list)
 
 @app.route('/admin/aunties/add', methods=['GET', 'POST'])
 def add_auntie():
     """处理新增阿姨的逻辑"""
     if request.method == 'POST':
-        all_aunties = read_csv_file('data/aunties.csv')
-        new_auntie = {
-            'auntieId': str(int(time.time())), # 用时间戳生成唯一ID
-            'name': request.form['name'],
-            'username': request.form['username'],
-            'password': request.form['password'],
-            'caregiverId': request.form['caregiverId']
-        }
-        all_aunties.append(new_auntie)
-        # 写入时需要提供表头
-        write_csv_file('data/aunties.csv', all_aunties, fieldnames=['auntieId', 'name', 'username', 'password', 'caregiverId'])
-        return redirect(URL_PREFIX + url_for('manage_aunties'))
+        with accounts_lock:
+            all_aunties = read_csv_file('data/aunties.csv')
+            new_auntie = {
+                'auntieId': str(int(time.time())), # 用时间戳生成唯一ID
+                'name': request.form['name'],
+                'username': request.form['username'],
+                'password': hash_password(request.form['password']),
+                'caregiverId': request.form['caregiverId']
+            }
+            all_aunties.append(new_auntie)
+            # 写入时需要提供表头
+            write_csv_file('data/aunties.csv', all_aunties, fieldnames=['auntieId', 'name', 'username', 'password', 'caregiverId'])
+            return redirect(URL_PREFIX + url_for('manage_aunties'))
     return render_template('auntie_form.html', auntie=None)
 
 @app.route('/admin/aunties/edit/<auntie_id>', methods=['GET', 'POST'])
 def edit_auntie(auntie_id):
     """处理编辑阿姨的逻辑"""
-    all_aunties = read_csv_file('data/aunties.csv')
-    auntie_to_edit = next((a for a in all_aunties if a['auntieId'] == auntie_id), None)
-    if not auntie_to_edit:
-        return "阿姨未找到!", 404
-
-    if request.method == 'POST':
-        auntie_to_edit['name'] = request.form['name']
-        auntie_to_edit['username'] = request.form['username']
-        auntie_to_edit['caregiverId'] = request.form['caregiverId']
-        if request.form['password']:
-            auntie_to_edit['password'] = request.form['password']
-        write_csv_file('data/aunties.csv', all_aunties, fieldnames=['auntieId', 'name', 'username', 'password', 'caregiverId'])
-        return redirect(URL_PREFIX + url_for('manage_aunties'))
+    with accounts_lock:
+        all_aunties = read_csv_file('data/aunties.csv')
+        auntie_to_edit = next((a for a in all_aunties if a['auntieId'] == auntie_id), None)
+        if not auntie_to_edit:
+            return "阿姨未找到!", 404
+
+        if request.method == 'POST':
+            auntie_to_edit['name'] = request.form['name']
+            auntie_to_edit['username'] = request.form['username']
+            auntie_to_edit['caregiverId'] = request.form['caregiverId']
+            if request.form['password']:
+                auntie_to_edit['password'] = hash_password(request.form['password'])
+            write_csv_file('data/aunties.csv', all_aunties, fieldnames=['auntieId', 'name', 'username', 'password', 'caregiverId'])
+            return redirect(URL_PREFIX + url_for('manage_aunties'))
     
-    return render_template('auntie_form.html', auntie=auntie_to_edit)
+        return render_template('auntie_form.html', auntie=auntie_to_edit)
 
 @app.route('/admin/aunties/delete/<auntie_id>')
 def delete_auntie(auntie_id):
     """处理删除阿姨的逻辑"""
-    all_aunties = read_csv_file('data/aunties.csv')
-    aunties_after_delete = [a for a in all_aunties if a['auntieId'] != auntie_id]
-    write_csv_file('data/aunties.csv', aunties_after_delete, fieldnames=['auntieId', 'name', 'username', 'password', 'caregiverId'])
-    return redirect(URL_PREFIX + url_for('manage_aunties'))
+    with accounts_lock:
+        all_aunties = read_csv_file('data/aunties.csv')
+        aunties_after_delete = [a for a in all_aunties if a['auntieId'] != auntie_id]
+        write_csv_file('data/aunties.csv', aunties_after_delete, fieldnames=['auntieId', 'name', 'username', 'password', 'caregiverId'])
+        return redirect(URL_PREFIX + url_for('manage_aunties'))
 
 # --- 护工管理页面路由  ---
 @app.route('/admin/caregivers')
 def manage_caregivers():
     """显示所有护工的列表页面"""
-    caregivers_list = read_csv_file('data/caregivers.csv')
+    caregivers_list = read_csv_snapshot('data/caregivers.csv')
     return render_template('caregivers.html', caregivers=caregivers_list)
 
 @app.route('/admin/caregivers/add', methods=['GET', 'POST'])
 def add_caregiver():
     """处理新增护工的逻辑"""
     if request.method == 'POST':
-        all_caregivers = read_csv_file('data/caregivers.csv')
-        new_caregiver = {
-            'caregiverId': str(int(time.time())),
-            'name': request.form['name'],
-            'username': request.form['username'],
-            'password': request.form['password']
-        }
-        all_caregivers.append(new_caregiver)
-        write_csv_file('data/caregivers.csv', all_caregivers, fieldnames=['caregiverId', 'name', 'username', 'password'])
-        return redirect(URL_PREFIX + url_for('manage_caregivers'))
+        with accounts_lock:
+            all_caregivers = read_csv_file('data/caregivers.csv')
+            new_caregiver = {
+                'caregiverId': str(int(time.time())),
+                'name': request.form['name'],
+                'username': request.form['username'],
+                'password': hash_password(request.form['password'])
+            }
+            all_caregivers.append(new_caregiver)
+            write_csv_file('data/caregivers.csv', all_caregivers, fieldnames=['caregiverId', 'name', 'username', 'password'])
+            return redirect(URL_PREFIX + url_for('manage_caregivers'))
     return render_template('caregiver_form.html', caregiver=None)
 
 @app.route('/admin/caregivers/edit/<caregiver_id>', methods=['GET', 'POST'])
 def edit_caregiver(caregiver_id):
     """处理编辑护工的逻辑"""
-    all_caregivers = read_csv_file('data/caregivers.csv')
-    caregiver_to_edit = next((c for c in all_caregivers if c['caregiverId'] == caregiver_id), None)
-    if not caregiver_to_edit:
-        return "护工未找到!", 404
-
-    if request.method == 'POST':
-        caregiver_to_edit['name'] = request.form['name']
-        caregiver_to_edit['username'] = request.form['username']
-        if request.form['password']:
-            caregiver_to_edit['password'] = request.form['password']
-        write_csv_file('data/caregivers.csv', all_caregivers, fieldnames=['caregiverId', 'name', 'username', 'password'])
-        return redirect(URL_PREFIX + url_for('manage_caregivers'))
-    return render_template('caregiver_form.html', caregiver=caregiver_to_edit)
+    with accounts_lock:
+        all_caregivers = read_csv_file('data/caregivers.csv')
+        caregiver_to_edit = next((c for c in all_caregivers if c['caregiverId'] == caregiver_id), None)
+        if not caregiver_to_edit:
+            return "护工未找到!", 404
+
+        if request.method == 'POST':
+            caregiver_to_edit['name'] = request.form['name']
+            caregiver_to_edit['username'] = request.form['username']
+            if request.form['password']:
+                caregiver_to_edit['password'] = hash_password(request.form['password'])
+            write_csv_file('data/caregivers.csv', all_caregivers, fieldnames=['caregiverId', 'name', 'username', 'password'])
+            return redirect(URL_PREFIX + url_for('manage_caregivers'))
+        return render_template('caregiver_form.html', caregiver=caregiver_to_edit)
 
 @app.route('/admin/caregivers/delete/<caregiver_id>')
 def delete_caregiver(caregiver_id):
     """处理删除护工的逻辑"""
-    all_caregivers = read_csv_file('data/caregivers.csv')
-    caregivers_after_delete = [c for c in all_caregivers if c['caregiverId'] != caregiver_id]
-    write_csv_file('data/caregivers.csv', caregivers_after_delete, fieldnames=['caregiverId', 'name', 'username', 'password'])
-    return redirect(URL_PREFIX + url_for('manage_caregivers'))
+    with accounts_lock:
+        all_caregivers = read_csv_file('data/caregivers.csv')
+        caregivers_after_delete = [c for c in all_caregivers if c['caregiverId'] != caregiver_id]
+        write_csv_file('data/caregivers.csv', caregivers_after_delete, fieldnames=['caregiverId', 'name', 'username', 'password'])
+        return redirect(URL_PREFIX + url_for('manage_caregivers'))
 
 
 # --- 患者管理页面路由  ---
 @app.route('/admin/patients')
 def manage_patients():
-    """显示所有患者的列表页面"""
-    patients_list = read_csv_file('data/patients.csv')
-    aunties_list = read_csv_file('data/aunties.csv')
-    
-    # 创建护工ID到姓名的映射
-    auntie_name_map = {auntie['auntieId']: auntie['name'] for auntie in aunties_list}
-    
-    # 为每个患者添加护工姓名
-    for patient in patients_list:
-        patient['auntieName'] = auntie_name_map.get(patient.get('auntieId', ''), '')
-    
-    return render_template('patients.html', patients=patients_list)
+    """显示患者列表页面（分页，可按护工、床号筛选和排序）"""
+    return render_listing('patients.html', '_patient_rows.html', patient_listing)
 
 @app.route('/admin/patients/add', methods=['GET', 'POST'])
 def add_patient():
@@ -660,12 +1159,10 @@ def add_patient():
         if 'patientImage' in request.files:
             file = request.files['patientImage']
             if file and file.filename != '':
-                # 使用 secure_filename 防止恶意文件名
-                filename = secure_filename(file.filename) 
-                # 你可以用 patientId 或时间戳来生成一个新文件名，避免重复
-                new_filename = f"{str(int(time.time()))}_{filename}"
-                file.save(os.path.join(app.config['UPLOAD_FOLDER'], new_filename))
-                image_filename = new_filename
+                try:
+                    image_filename = save_patient_image(file, f"{str(int(time.time()))}_")
+                except ValueError:
+                    return "无法识别的图片文件!", 400
 
         all_patients = read_csv_file('data/patients.csv')
         patient_id = str(int(time.time()))
@@ -682,7 +1179,7 @@ def add_patient():
         return redirect(URL_PREFIX + url_for('manage_patients'))
     
     # GET请求：获取护工列表用于下拉选择
-    aunties_list = read_csv_file('data/aunties.csv')
+    aunties_list = read_csv_snapshot('data/aunties.csv')
     return render_template('patient_form.html', patient=None, aunties=aunties_list)
 
 @app.route('/admin/patients/edit/<patient_id>', methods=['GET', 'POST'])
@@ -706,18 +1203,16 @@ def edit_patient(patient_id):
             
             # a. 检查用户是否真的选择了一个新文件来上传
             if file and file.filename != '':
-                # i. 保存新文件
-                filename = secure_filename(file.filename)
-                new_filename = f"{patient_id}_{filename}" # 使用 patient_id 命名，方便管理
-                file_path = os.path.join(app.config['UPLOAD_FOLDER'], new_filename)
-                file.save(file_path)
+                # i. 保存新文件（生成各个尺寸的版本）
+                try:
+                    new_filename = save_patient_image(file, f"{patient_id}_")
+                except ValueError:
+                    return "无法识别的图片文件!", 400
                 
                 # ii. (可选但推荐) 删除旧的图片文件，避免占用服务器空间
                 old_image_filename = patient_to_edit.get('imageResourceId')
-                if old_image_filename:
-                    old_file_path = os.path.join(app.config['UPLOAD_FOLDER'], old_image_filename)
-                    if os.path.exists(old_file_path):
-                        os.remove(old_file_path)
+                if old_image_filename and old_image_filename != new_filename:
+                    release_patient_image(old_image_filename, patient_id)
                 
                 # iii. 更新CSV中的文件名记录
                 patient_to_edit['imageResourceId'] = new_filename
@@ -726,95 +1221,141 @@ def edit_patient(patient_id):
         return redirect(URL_PREFIX + url_for('manage_patients'))
     
     # GET请求：获取护工列表用于下拉选择
-    aunties_list = read_csv_file('data/aunties.csv')
+    aunties_list = read_csv_snapshot('data/aunties.csv')
     return render_template('patient_form.html', patient=patient_to_edit, aunties=aunties_list)
 
+def save_patient_image(file, legacy_prefix):
+    """
+    保存上传的患者照片
+    Args:
+        file: 上传的文件
+        legacy_prefix: 没有安装 Pillow 时原样保存所用的文件名前缀
+    Returns:
+        imageResourceId
+    Raises:
+        ValueError: 不是有效的图片
+    """
+    if not image_variants.PILLOW_AVAILABLE:
+        # 使用 secure_filename 防止恶意文件名
+        new_filename = legacy_prefix + secure_filename(file.filename)
+        file.save(os.path.join(app.config['UPLOAD_FOLDER'], new_filename))
+        return new_filename
+    return image_variants.save_variants(file.read(), app.config['UPLOAD_FOLDER'])
+
+def release_patient_image(image_id, patient_id):
+    """某个患者不再使用这张照片时删除它的所有版本（同一张照片可能被其它患者共用）"""
+    if any(p.get('imageResourceId') == image_id and p['patientId'] != patient_id
+           for p in read_csv_snapshot(PATIENTS_FILE)):
+        return
+    try:
+        image_variants.remove_variants(app.config['UPLOAD_FOLDER'], image_id)
+        log.info("已删除患者图片文件: %s", image_id)
+    except Exception as e:
+        log.error("删除患者图片文件失败: %s", e)
+
+@app.route('/patient-images/<variant>/<image_id>', methods=['GET'])
+def get_patient_image(variant, image_id):
+    """
+    获取患者照片的某个尺寸（thumb / card / full）
+    客户端 Accept 头包含 image/webp 时返回 WebP，否则返回 JPEG；内容不变文件名就不变，可长期缓存
+    """
+    if variant not in image_variants.VARIANT_SIZES or not image_variants.is_hashed_image_id(image_id):
+        return jsonify({"error": "图片不存在"}), 404
+    use_webp = image_variants.WEBP_AVAILABLE and request.accept_mimetypes.quality('image/webp') > 0
+    filename = image_variants.variant_filename(image_id, variant, 'webp' if use_webp else 'jpeg')
+    if not os.path.exists(os.path.join(app.config['UPLOAD_FOLDER'], filename)):
+        return jsonify({"error": "图片不存在"}), 404
+    response = send_from_directory(app.config['UPLOAD_FOLDER'], filename, max_age=31536000)
+    response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+    response.headers['Vary'] = 'Accept'
+    return response
+
+def _remove_patient_rows(filename, patient_id, positions):
+    """
+    从一张表中删除某个患者的行
+    Args:
+        positions: 索引中记录的行号，与当前内容不一致时（例如刚被其它请求改写）按 patientId 重新筛选
+    Returns:
+        removed: 删除的行数
+    """
+    dated = PatientIndex.dated_file_date(filename)
+    if dated and dated[0] == 'tasks':
+        # 任务文件由 task_store 管理（内存中可能有尚未合并的修改）
+        return task_store.remove_patient(dated[1], patient_id)
+
+    rows = read_csv_file(filename)
+    drop = set(positions)
+    if not all(p < len(rows) and rows[p].get('patientId') == patient_id for p in drop):
+        drop = {i for i, row in enumerate(rows) if row.get('patientId') == patient_id}
+    if not drop:
+        return 0
+
+    remaining = [row for i, row in enumerate(rows) if i not in drop]
+    if filename == PATIENTS_FILE:
+        fieldnames = PATIENT_FIELDNAMES
+    elif filename == PRESCRIPTIONS_FILE:
+        fieldnames = PRESCRIPTION_FIELDNAMES
+    else:
+        fieldnames = SCHEDULE_FIELDNAMES
+    storage.write_rows(filename, remaining, fieldnames)
+    return len(drop)
+
 @app.route('/admin/patients/delete/<patient_id>')
 def delete_patient(patient_id):
-    """处理删除患者的逻辑"""
-    # 1. 删除患者记录
-    all_patients = read_csv_file('data/patients.csv')
-    patients_after_delete = [p for p in all_patients if p['patientId'] != patient_id]
-    write_csv_file('data/patients.csv', patients_after_delete, fieldnames=['patientId', 'auntieId', 'imageResourceId', 'patientName', 'patientBedNumber', 'patientBarcode'])
-    
-    # 2. 删除对应患者的所有处方记录
-    all_prescriptions = read_csv_file('data/local_prescriptions_data.csv')
-    prescriptions_after_delete = [p for p in all_prescriptions if p.get('patientId') != patient_id]
-    
-    if len(all_prescriptions) != len(prescriptions_after_delete):
-        # 如果有处方被删除，更新处方文件
-        fieldnames = ['patient_name', 'patientId', 'rfid', 'medicine_name', 'morning_dosage',
-                     'noon_dosage', 'evening_dosage', 'meal_timing', 'start_date',
-                     'duration_days', 'last_dispensed_expiry_date', 'is_active', 'pill_size']
-        write_csv_file('data/local_prescriptions_data.csv', prescriptions_after_delete, fieldnames)
-        print(f"[{time.ctime()}] 已删除患者 {patient_id} 的 {len(all_prescriptions) - len(prescriptions_after_delete)} 条处方记录")
-    
-    # 3. 删除对应患者的所有排班记录
-    all_schedules = read_csv_file('data/schedules.csv')
-    schedules_after_delete = [s for s in all_schedules if s.get('patientId') != patient_id]
-    
-    if len(all_schedules) != len(schedules_after_delete):
-        # 如果有排班被删除，更新排班文件
-        write_csv_file('data/schedules.csv', schedules_after_delete, fieldnames=['patientId', 'patientName', 'timeSlotName'])
-        print(f"[{time.ctime()}] 已删除患者 {patient_id} 的 {len(all_schedules) - len(schedules_after_delete)} 条排班记录")
+    """处理删除患者的逻辑：通过患者索引只改写包含该患者的表（包括每天的排班和任务文件）"""
+    patient_to_delete = next((p for p in read_csv_snapshot(PATIENTS_FILE) if p['patientId'] == patient_id), None)
+
+    # 先删除其它表中的记录，最后删除患者本身：中途失败时一致性检查不会把残留记录报告为孤立数据
+    locations = patient_index.locate(patient_id)
+    for filename in sorted(locations, key=lambda f: f == PATIENTS_FILE):
+        try:
+            if filename == PRESCRIPTIONS_FILE:
+                with prescriptions_lock:
+                    removed = _remove_patient_rows(filename, patient_id, locations[filename])
+            else:
+                removed = _remove_patient_rows(filename, patient_id, locations[filename])
+            if removed:
+                log.info("已从 %s 删除患者 %s 的 %d 条记录", filename, patient_id, removed)
+        except Exception as e:
+            log.error("从 %s 删除患者 %s 时发生错误: %s", filename, patient_id, e)
     
-    # 4. 删除患者图片文件（如果存在）
-    patient_to_delete = next((p for p in all_patients if p['patientId'] == patient_id), None)
+    # 已归档的历史任务
+    try:
+        removed = task_archive.remove_patient(patient_id)
+        if removed:
+            log.info("已从任务归档删除患者 %s 的 %d 条记录", patient_id, removed)
+    except Exception as e:
+        log.error("从任务归档删除患者 %s 时发生错误: %s", patient_id, e)
+
+    # 删除患者图片文件（如果存在）
     if patient_to_delete and patient_to_delete.get('imageResourceId'):
-        image_path = os.path.join(app.config['UPLOAD_FOLDER'], patient_to_delete['imageResourceId'])
-        if os.path.exists(image_path):
-            try:
-                os.remove(image_path)
-                print(f"[{time.ctime()}] 已删除患者图片文件: {patient_to_delete['imageResourceId']}")
-            except Exception as e:
-                print(f"[{time.ctime()}] 删除患者图片文件失败: {e}")
+        release_patient_image(patient_to_delete['imageResourceId'], patient_id)
     
-    print(f"[{time.ctime()}] 已完全删除患者 {patient_id} 的所有相关数据")
+    log.info("已完全删除患者 %s 的所有相关数据", patient_id)
     return redirect(URL_PREFIX + url_for('manage_patients'))
 
 # --- 排班管理页面路由 ---
 @app.route('/admin/schedules')
 def manage_schedules():
-    """显示所有排班的列表页面"""
+    """显示排班列表页面（分页，可按护工、床号、时间段筛选和排序）"""
     
     # 获取日期参数
     selected_date_str = request.args.get('date')
+    schedule_filename = 'data/schedules.csv'
     
     if selected_date_str:
-        # 如果指定了日期，读取对应日期的排班文件
-        schedule_filename = f"data/schedules_{selected_date_str}.csv"
-        schedules_list = read_csv_file(schedule_filename)
-        
-        # 如果指定日期的文件不存在或为空，回退到默认排班文件
-        if not schedules_list:
-            print(f"[{time.ctime()}] 未找到 {schedule_filename}，回退到默认排班文件")
-            schedules_list = read_csv_file('data/schedules.csv')
-    else:
-        # 如果没有指定日期，直接读取默认排班文件
-        schedules_list = read_csv_file('data/schedules.csv')
-    
-    # 将同一患者的不同时间段合并到一起
-    patient_schedules = {}
-    for schedule in schedules_list:
-        patient_id = schedule['patientId']
-        if patient_id not in patient_schedules:
-            patient_schedules[patient_id] = {
-                'patientId': patient_id,
-                'patientName': schedule['patientName'],
-                'timeSlots': []
-            }
-        patient_schedules[patient_id]['timeSlots'].append(schedule['timeSlotName'])
-    
-    # 转换为列表格式
-    merged_schedules = list(patient_schedules.values())
-    sorted_schedules = sorted(merged_schedules, key=lambda item: int(item['patientId']))
+        # 如果指定了日期，读取对应日期的排班文件；不存在或为空时回退到默认排班文件
+        dated_filename = f"data/schedules_{selected_date_str}.csv"
+        if storage.exists(dated_filename) and read_csv_snapshot(dated_filename):
+            schedule_filename = dated_filename
+        else:
+            log.info("未找到 %s，回退到默认排班文件", dated_filename)
 
     # 获取当前的自动排班时间配置
     current_schedule_time = read_schedule_config()
 
-    return render_template('schedules.html', 
-                         schedules=sorted_schedules, 
-                         current_schedule_time=current_schedule_time)
+    return render_listing('schedules.html', '_schedule_rows.html', schedule_listing, schedule_filename,
+                          current_schedule_time=current_schedule_time)
 
 @app.route('/admin/schedules/add', methods=['GET', 'POST'])
 def add_schedule():
@@ -845,7 +1386,7 @@ def add_schedule():
         return redirect(URL_PREFIX + url_for('manage_schedules'))
     
     # 获取患者列表供下拉选择使用
-    patients_list = read_csv_file('data/patients.csv')
+    patients_list = read_csv_snapshot('data/patients.csv')
     return render_template('schedule_form.html', schedule=None, patients=patients_list)
 
 @app.route('/admin/schedules/edit/<patient_id>', methods=['GET', 'POST'])
@@ -892,7 +1433,7 @@ def edit_schedule_by_patient(patient_id):
     
     # GET请求：显示编辑表单
     # 获取患者列表和当前选中的时间段
-    patients_list = read_csv_file('data/patients.csv')
+    patients_list = read_csv_snapshot('data/patients.csv')
     current_time_slots = [s['timeSlotName'] for s in patient_schedules]
     
     # 构建schedule对象用于表单显示
@@ -935,9 +1476,8 @@ def update_schedule_time():
             global current_schedule_time
             current_schedule_time = new_time
             
-            # 重新设置定时任务
-            schedule.clear()  # 清除所有现有任务
-            schedule.every().day.at(new_time).do(daily_schedule_generation)
+            # 重新设置定时任务（调度线程会被立即唤醒重新计算下次运行时间）
+            job_scheduler.reschedule_daily('daily_schedule', new_time)
             
             return jsonify({
                 'success': True, 
@@ -953,7 +1493,7 @@ def update_schedule_time():
 @app.route('/admin/timeslots')
 def manage_timeslots():
     """显示所有时间段的列表页面"""
-    timeslots_list = read_csv_file('data/timeslots.csv')
+    timeslots_list = read_csv_snapshot('data/timeslots.csv')
     return render_template('timeslots.html', timeslots=timeslots_list)
 
 @app.route('/admin/timeslots/edit/<name>', methods=['GET', 'POST'])
@@ -988,88 +1528,231 @@ def manage_tasks():
     
     # 1. 从URL参数中获取要查询的日期，如果未提供，则默认为今天
     selected_date_str = request.args.get('date', time.strftime("%Y-%m-%d"))
-    
-    # 2. 根据日期构建任务文件名
-    task_filename = f"data/tasks_{selected_date_str}.csv"
-    
-    tasks_with_details = []
-    
-    # 3. 检查文件是否存在，如果存在则读取
-    if os.path.exists(task_filename):
-        tasks_list = read_csv_file(task_filename)
-        
-        # 4. 为了显示病人姓名和时间段中文名，我们需要关联查询其他CSV文件
-        patients_list = read_csv_file('data/patients.csv')
-        timeslots_list = read_csv_file('data/timeslots.csv')
-        
-        # a. 创建快速查找的“字典” (映射表)，提高效率
-        patient_name_map = {p['patientId']: p['patientName'] for p in patients_list}
-        timeslot_display_map = {ts['name']: ts['displayName'] for ts in timeslots_list}
-        
-        # b. 遍历当天的任务，并为每一条记录补充额外的信息
-        for task in tasks_list:
-            task_details = task.copy() # 复制一份，避免修改原始数据
-            
-            # 补充病人姓名
-            task_details['patientName'] = patient_name_map.get(task['patientId'], '未知患者')
-            
-            # 补充时间段的中文显示名称
-            task_details['timeSlot_displayName'] = timeslot_display_map.get(task['timeSlotName'], task['timeSlotName'])
-            
-            tasks_with_details.append(task_details)
 
-    # 5. 将处理好的数据和选定的日期，一起传递给HTML模板
-    return render_template(
-        'tasks.html', 
-        tasks=tasks_with_details, 
-        selected_date=selected_date_str
-    )
+    # 2. 关联了患者姓名、护工和时间段中文名的记录按日期缓存，只取当前这一页（可按护工、床号、时间段、状态筛选）
+    return render_listing('tasks.html', '_task_rows.html', task_listing, selected_date_str,
+                          selected_date=selected_date_str, task_statuses=TASK_STATUSES)
+
+@app.route('/admin/tasks/range', methods=['GET'])
+def task_range_api():
+    """
+    【API接口】统计一段日期内的服药完成率（已归档的月份和尚未归档的每日文件合并统计）
+    URL参数: ?from=YYYY-MM-DD&to=YYYY-MM-DD&patientId=<可选>&groupBy=patient|slot|patient_slot|none
+    groupBy 默认按患者分组，指定 patientId 时默认按时间段分组
+    """
+    date_from = parse_date(request.args.get('from'))
+    date_to = parse_date(request.args.get('to'))
+    if date_from is None or date_to is None or date_from > date_to:
+        return jsonify({"success": False, "error": "需要 from 和 to 参数（YYYY-MM-DD，from 不能晚于 to）"}), 400
+    patient_id = request.args.get('patientId') or None
+    group_options = {'patient': ('patientId',), 'slot': ('timeSlotName',),
+                     'patient_slot': GROUP_FIELDS, 'none': ()}
+    group_name = request.args.get('groupBy') or ('slot' if patient_id else 'patient')
+    if group_name not in group_options:
+        return jsonify({"success": False, "error": f"groupBy 只能是 {', '.join(group_options)}"}), 400
+    group_by = group_options[group_name]
+
+    # 1. 归档部分：只加载涉及的月份
+    counts, archived_dates = task_archive.count(date_from, date_to, patient_id, group_by)
+
+    # 2. 还没有归档的日期：范围内存在的每日任务文件
+    from_str, to_str = date_from.isoformat(), date_to.isoformat()
+    live_dates = [dated[1] for dated in map(PatientIndex.dated_file_date, storage.list_files('data'))
+                  if dated and dated[0] == 'tasks' and from_str <= dated[1] <= to_str
+                  and dated[1] not in archived_dates]
+    if live_dates:
+        merge_counts(counts, count_tasks({d: task_store.get_tasks(d) for d in live_dates}, patient_id, group_by))
+
+    patient_names = {p['patientId']: p['patientName'] for p in read_csv_snapshot(PATIENTS_FILE)}
+    groups = []
+    for key in sorted(counts, key=lambda k: tuple(natural_key(v) for v in k)):
+        total, completed = counts[key]
+        group = dict(zip(group_by, key))
+        if 'patientId' in group:
+            group['patientName'] = patient_names.get(group['patientId'], '未知患者')
+        group.update(total=total, completed=completed, completion_rate=round(completed / total, 4) if total else None)
+        groups.append(group)
+    total = sum(count[0] for count in counts.values())
+    completed = sum(count[1] for count in counts.values())
+    return jsonify({
+        "success": True,
+        "from": from_str,
+        "to": to_str,
+        "patientId": patient_id,
+        "groupBy": group_name,
+        "total": total,
+        "completed": completed,
+        "completion_rate": round(completed / total, 4) if total else None,
+        "groups": groups,
+        "archived_days": len(archived_dates),
+        "live_days": len(live_dates)
+    })
+
+# --- 服药依从性统计 ---
+_live_rollups = {}  # 日期 -> (签名, {级别: [汇总行]})
+_live_rollups_lock = threading.Lock()
+
+def compute_rollup(date_str):
+    """按当前的患者表和时间段表汇总某一天，没有任务时返回None"""
+    tasks = tasks_for_day(date_str)
+    if tasks is None:
+        return None
+    patient_aunties = {p['patientId']: p.get('auntieId', '') for p in read_csv_snapshot(PATIENTS_FILE)}
+    return rollup_day(date_str, tasks, patient_aunties, slot_deadlines(read_csv_snapshot('data/timeslots.csv')))
+
+def live_rollup(date_str):
+    """还没有保存汇总的日期（今天）直接从任务汇总，按任务和相关表格的签名缓存"""
+    signature = (task_store.disk_signature(date_str),) + table_signatures(PATIENTS_FILE, 'data/timeslots.csv')
+    with _live_rollups_lock:
+        cached = _live_rollups.get(date_str)
+    if cached is not None and cached[0] == signature:
+        return cached[1]
+    rows = compute_rollup(date_str)
+    day = index_rows(rows) if rows is not None else None
+    with _live_rollups_lock:
+        _live_rollups.clear()  # 只需要保留最近的一天
+        _live_rollups[date_str] = (signature, day)
+    return day
+
+def adherence_summary(date_from, date_to, level, auntie_id=None):
+    """
+    统计一段日期内的服药完成情况
+    Args:
+        date_from, date_to: date
+        level: patient / auntie / slot
+        auntie_id: 只统计这个护工负责的患者
+    Returns:
+        (分组列表（完成率从低到高）, 有数据的日期列表)
+    """
+    dates = [(date_from + timedelta(days=i)).isoformat() for i in range((date_to - date_from).days + 1)]
+    today_str = datetime.now().strftime("%Y-%m-%d")
+    extra_days = {}
+    if dates[0] <= today_str <= dates[-1]:
+        today = live_rollup(today_str)
+        if today is not None:
+            extra_days[today_str] = today
+    groups, covered = adherence_rollups.summarize(dates, level, auntie_id, extra_days)
+
+    patients = patient_details_map()
+    auntie_names = {a['auntieId']: a['name'] for a in read_csv_snapshot('data/aunties.csv')}
+    slots = timeslot_order()
+    result = []
+    for key, entry in groups.items():
+        if level == 'patient':
+            patient = patients.get(key, {})
+            group = {'patientId': key, 'patientName': patient.get('patientName', '未知患者'),
+                     'patientBedNumber': patient.get('patientBedNumber', ''), 'auntieId': entry['auntieId'],
+                     'auntieName': auntie_names.get(entry['auntieId'], '')}
+        elif level == 'auntie':
+            group = {'auntieId': key, 'auntieName': auntie_names.get(key, '未分配')}
+        else:
+            group = {'timeSlotName': key, 'displayName': slots.get(key, (0, key))[1]}
+        total, completed = entry['total'], entry['completed']
+        group.update(total=total, completed=completed, missed=total - completed, late=entry['late'],
+                     completion_rate=round(completed / total, 4) if total else None)
+        if level == 'patient':
+            group['missed_doses'] = [{'date': date_str, 'timeSlots': [slots.get(n, (0, n))[1] for n in names]}
+                                     for date_str, names in entry['missed']]
+        result.append(group)
+    result.sort(key=lambda g: (g['completion_rate'] if g['completion_rate'] is not None else 1.0, -g['late']))
+    return result, covered
+
+def adherence_period():
+    """
+    从URL参数解析统计的日期范围
+    ?from=&to= 指定范围，否则 ?period=week|month&date=结束日期（默认今天），向前数 7 / 30 天
+    Returns:
+        (date_from, date_to, period, error)
+    """
+    period = request.args.get('period', 'week')
+    if request.args.get('from') or request.args.get('to'):
+        date_from = parse_date(request.args.get('from'))
+        date_to = parse_date(request.args.get('to'))
+        if date_from is None or date_to is None or date_from > date_to:
+            return None, None, period, "from 和 to 必须是 YYYY-MM-DD，且 from 不能晚于 to"
+        return date_from, date_to, 'custom', None
+    if period not in ADHERENCE_PERIODS:
+        return None, None, period, f"period 只能是 {', '.join(ADHERENCE_PERIODS)}"
+    date_to = parse_date(request.args.get('date') or time.strftime("%Y-%m-%d"))
+    if date_to is None:
+        return None, None, period, "date 必须是 YYYY-MM-DD"
+    return date_to - timedelta(days=ADHERENCE_PERIODS[period] - 1), date_to, period, None
+
+@app.route('/admin/adherence/summary', methods=['GET'])
+def adherence_summary_api():
+    """
+    【API接口】一周/一个月的服药依从性（只读每日汇总，今天的数据实时汇总）
+    URL参数: ?period=week|month&date=YYYY-MM-DD 或 ?from=&to=，
+             level=patient|auntie|slot（默认 patient），auntieId=<可选>，
+             issuesOnly=1 只返回有漏服或延迟服药的分组
+    """
+    date_from, date_to, period, error = adherence_period()
+    if error:
+        return jsonify({"success": False, "error": error}), 400
+    level = request.args.get('level', 'patient')
+    if level not in ('patient', 'auntie', 'slot'):
+        return jsonify({"success": False, "error": "level 只能是 patient, auntie, slot"}), 400
+    auntie_id = request.args.get('auntieId') or None
+    if auntie_id is not None and level == 'slot':
+        return jsonify({"success": False, "error": "按时间段统计时不支持 auntieId 筛选"}), 400
+
+    groups, covered = adherence_summary(date_from, date_to, level, auntie_id)
+    total = sum(g['total'] for g in groups)
+    completed = sum(g['completed'] for g in groups)
+    late = sum(g['late'] for g in groups)
+    if request.args.get('issuesOnly'):
+        groups = [g for g in groups if g['missed'] or g['late']]
+    return jsonify({
+        "success": True,
+        "from": date_from.isoformat(),
+        "to": date_to.isoformat(),
+        "period": period,
+        "level": level,
+        "auntieId": auntie_id,
+        "total": total,
+        "completed": completed,
+        "missed": total - completed,
+        "late": late,
+        "completion_rate": round(completed / total, 4) if total else None,
+        "days_with_data": len(covered),
+        "groups": groups
+    })
+
+@app.route('/admin/adherence')
+def manage_adherence():
+    """服药依从性统计页面：按时间段、按护工的完成率，以及有漏服/延迟服药的患者"""
+    date_from, date_to, period, error = adherence_period()
+    if error:
+        period = 'week'
+        date_to = datetime.now().date()
+        date_from = date_to - timedelta(days=ADHERENCE_PERIODS['week'] - 1)
+    auntie_id = request.args.get('auntieId') or None
+    slot_groups, covered = adherence_summary(date_from, date_to, 'slot')
+    auntie_groups, _ = adherence_summary(date_from, date_to, 'auntie')
+    patient_groups, _ = adherence_summary(date_from, date_to, 'patient', auntie_id)
+    total = sum(g['total'] for g in slot_groups)
+    completed = sum(g['completed'] for g in slot_groups)
+    slots = timeslot_order()
+    slot_groups.sort(key=lambda g: slots.get(g['timeSlotName'], (len(slots),))[0])
+    return render_template('adherence.html', period=period, date_from=date_from.isoformat(),
+                           date_to=date_to.isoformat(), auntie_id=auntie_id or '', error=error,
+                           total=total, completed=completed, late=sum(g['late'] for g in slot_groups),
+                           days_with_data=len(covered), slot_groups=slot_groups, auntie_groups=auntie_groups,
+                           patient_groups=[g for g in patient_groups if g['missed'] or g['late']],
+                           aunties_for_filter=read_csv_snapshot('data/aunties.csv'))
 
 ###################
 # 自动生成排班功能 #
 ###################
-def _is_prescription_active(prescription, target_date=None):
-    """判断处方在指定日期是否有效"""
-    if target_date is None:
-        target_date = datetime.now().date()
-    elif isinstance(target_date, str):
-        target_date = datetime.strptime(target_date, "%Y-%m-%d").date()
-    
-    try:
-        start_date = datetime.strptime(prescription['start_date'], "%Y-%m-%d").date()
-        duration_days = int(prescription['duration_days'])
-        end_date = start_date + timedelta(days=duration_days - 1)
-        
-        is_in_date_range = start_date <= target_date <= end_date
-        is_active = prescription.get('is_active', '1') == '1'
-        
-        return is_in_date_range and is_active
-        
-    except (ValueError, KeyError) as e:
-        print(f"处理处方数据时出错: {e}")
-        return False
-
-def _get_time_slots_from_dosage(prescription):
-    """根据用药剂量和用餐时机生成时间段"""
-    time_slots = []
-    
-    try:
-        morning_dosage = int(prescription.get('morning_dosage', 0))
-        noon_dosage = int(prescription.get('noon_dosage', 0))
-        evening_dosage = int(prescription.get('evening_dosage', 0))
-        meal_timing = prescription.get('meal_timing', 'after')
-        
-        if morning_dosage > 0:
-            time_slots.append('BEFORE_BREAKFAST' if meal_timing == 'before' else 'AFTER_BREAKFAST')
-        if noon_dosage > 0:
-            time_slots.append('BEFORE_LUNCH' if meal_timing == 'before' else 'AFTER_LUNCH')
-        if evening_dosage > 0:
-            time_slots.append('BEFORE_DINNER' if meal_timing == 'before' else 'AFTER_DINNER')
-                
-    except (ValueError, KeyError) as e:
-        print(f"解析用药剂量时出错: {e}")
-    
-    return time_slots
+def build_tasks_from_schedules(schedules):
+    """根据排班生成当天的初始任务列表（全部为待服药）"""
+    return [{
+        'patientId': schedule['patientId'],
+        'timeSlotName': schedule['timeSlotName'],
+        'status': '待服药',
+        'completionTime': '',
+        'remark': ''
+    } for schedule in schedules]
 
 def generate_schedules_for_date(target_date=None):
     """为指定日期生成排班数据"""
@@ -1079,86 +1762,381 @@ def generate_schedules_for_date(target_date=None):
         target_date = datetime.strptime(target_date, "%Y-%m-%d").date()
     
     date_str = target_date.strftime("%Y-%m-%d")
-    print(f"[{time.ctime()}] 开始为日期 {date_str} 生成排班...")
+    log.info("开始为日期 %s 生成排班...", date_str)
     
-    # 读取处方数据
-    prescriptions = read_csv_file('data/local_prescriptions_data.csv')
-    if not prescriptions:
-        print(f"[{time.ctime()}] 未找到处方数据文件或文件为空")
+    # 处方表不存在或为空
+    if not read_csv_snapshot(PRESCRIPTIONS_FILE):
+        log.warning("未找到处方数据文件或文件为空")
         return []
     
-    schedules = []
-    processed_combinations = set()
-    
-    for prescription in prescriptions:
-        if not _is_prescription_active(prescription, target_date):
-            continue
-        
-        patient_id = prescription.get('patientId', '')
-        patient_name = prescription.get('patient_name', '')
-        
-        if not patient_id or not patient_name:
-            continue
-        
-        time_slots = _get_time_slots_from_dosage(prescription)
-        
-        for time_slot in time_slots:
-            combination_key = f"{patient_id}_{time_slot}"
-            
-            if combination_key not in processed_combinations:
-                schedule = {
-                    'patientId': patient_id,
-                    'patientName': patient_name,
-                    'timeSlotName': time_slot
-                }
-                schedules.append(schedule)
-                processed_combinations.add(combination_key)
+    schedules = schedule_engine.schedules_for_date(target_date)
 
     # 写入文件
     if schedules:
         schedule_filename = f"data/schedules_{date_str}.csv"
-        write_csv_file(schedule_filename, schedules, fieldnames=['patientId', 'patientName', 'timeSlotName'])
+        write_csv_file(schedule_filename, schedules, fieldnames=SCHEDULE_FIELDNAMES)
         # 同时更新主schedules.csv文件以保持兼容性
-        write_csv_file('data/schedules.csv', schedules, fieldnames=['patientId', 'patientName', 'timeSlotName'])
-        print(f"[{time.ctime()}] 成功生成 {len(schedules)} 条排班记录")
+        write_csv_file('data/schedules.csv', schedules, fieldnames=SCHEDULE_FIELDNAMES)
+        log.info("成功生成 %d 条排班记录", len(schedules))
     else:
-        print(f"[{time.ctime()}] 日期 {date_str} 没有有效的排班记录")
+        log.info("日期 %s 没有有效的排班记录", date_str)
     
     return schedules
 
+# 上次预生成时的处方表签名，处方变化后需要刷新已经预生成的文件
+_pregenerated_signature = None
+
+def pregenerate_schedules(days=PREGENERATE_DAYS):
+    """
+    预先生成从今天开始 days 天的排班文件和任务文件，避免 /tasks 在请求中现场生成
+    - 任务文件在不存在时创建，处方变化后只重建还没有任何记录的（全部为待服药）。
+      今天也一样：今天的任务文件往往在前一天就已经预生成，午夜前后的处方修改也要能更新到今天
+    - 以后的排班文件在不存在或处方表变化后重新生成；
+      今天的排班文件在不存在或今天的任务重建时重新生成，与任务保持一致（任务已经在记录时保留原来的排班）
+    """
+    global _pregenerated_signature
+    try:
+        if not storage.exists(PRESCRIPTIONS_FILE):
+            return 0
+        signature = schedule_engine.prescriptions_signature()
+        prescriptions_changed = signature != _pregenerated_signature
+        today = datetime.now().date()
+        schedules_by_date = schedule_engine.schedules_for_range(today, days)
+
+        generated = 0
+        for date_str, schedules in schedules_by_date.items():
+            is_today = date_str == today.strftime("%Y-%m-%d")
+            rebuilt = False
+            if not task_store.exists(date_str):
+                task_store.create_day(date_str, build_tasks_from_schedules(schedules))
+                rebuilt = True
+            elif prescriptions_changed:
+                # 检查和重建在任务文件的锁内进行，不会覆盖刚刚写入的服药记录
+                rebuilt = task_store.rebuild_if_pending(date_str, build_tasks_from_schedules(schedules))
+            generated += rebuilt
+
+            schedule_filename = f"data/schedules_{date_str}.csv"
+            if not storage.exists(schedule_filename) or rebuilt or (prescriptions_changed and not is_today):
+                write_csv_file(schedule_filename, schedules, fieldnames=SCHEDULE_FIELDNAMES)
+
+        _pregenerated_signature = signature
+        if generated:
+            log.info("已预生成 %d 天的任务文件", generated)
+        return generated
+    except Exception as e:
+        log.error("预生成排班时发生错误: %s", e)
+        raise
+
+def archive_closed_days():
+    """
+    把 ARCHIVE_AFTER_DAYS 天之前的每日任务文件按月归档，然后删除这些天的任务文件和排班文件
+    （最近几天的记录护工可能还会补录，继续保留为每日文件）
+    """
+    cutoff = (datetime.now().date() - timedelta(days=ARCHIVE_AFTER_DAYS)).strftime("%Y-%m-%d")
+    by_month = {}
+    for dated in map(PatientIndex.dated_file_date, storage.list_files('data')):
+        if dated and dated[0] == 'tasks' and dated[1] < cutoff:
+            by_month.setdefault(dated[1][:7], []).append(dated[1])
+
+    archived = 0
+    for month, dates in sorted(by_month.items()):
+        # 每个月一次写入，写入期间持有这些天的锁，归档后才删除每日文件
+        archived += task_store.archive_days(dates, task_archive.add_days)
+        for date_str in dates:
+            storage.remove(f"data/schedules_{date_str}.csv")
+    if archived:
+        log.info("已归档 %d 天的任务记录（%s 之前）", archived, cutoff)
+    return archived
+
+def rollup_adherence():
+    """
+    把已经结束的日期汇总到依从性日汇总表
+    最近 ARCHIVE_AFTER_DAYS 天每次都重新汇总（护工可能补录），更早的日期只汇总还没有汇总过的
+    """
+    today = datetime.now().date()
+    today_str = today.isoformat()
+    recent_from = (today - timedelta(days=ARCHIVE_AFTER_DAYS)).isoformat()
+    task_dates = {dated[1] for dated in map(PatientIndex.dated_file_date, storage.list_files('data'))
+                  if dated and dated[0] == 'tasks'}
+    task_dates.update(task_archive.archived_dates())
+    rolled_up = adherence_rollups.rolled_up_dates()
+    pending = sorted(d for d in task_dates if d < today_str and (d >= recent_from or d not in rolled_up))
+
+    by_month = {}
+    for date_str in pending:
+        by_month.setdefault(date_str[:7], []).append(date_str)
+    saved = 0
+    for month, dates in sorted(by_month.items()):
+        days = {date_str: rows for date_str, rows in ((d, compute_rollup(d)) for d in dates) if rows is not None}
+        if days:
+            adherence_rollups.save_days(days)
+            saved += len(days)
+    if saved:
+        log.info("已汇总 %d 天的服药依从性", saved)
+    return saved
+
 def daily_schedule_generation():
     """每日排班生成任务"""
     try:
-        print(f"[{time.ctime()}] ===== 开始每日自动排班生成 =====")
+        log.info("===== 开始每日自动排班生成 =====")
         
         # 检查处方数据文件是否存在
-        if not os.path.exists('data/local_prescriptions_data.csv'):
-            print(f"[{time.ctime()}] 错误: 找不到 local_prescriptions_data.csv 文件")
+        if not storage.exists('data/local_prescriptions_data.csv'):
+            log.error("找不到 local_prescriptions_data.csv 文件")
             return
         
         # 生成今天的排班
         schedules = generate_schedules_for_date()
         
         if schedules:
-            print(f"[{time.ctime()}] 每日排班生成完成！生成了 {len(schedules)} 条记录")
+            log.info("每日排班生成完成！生成了 %d 条记录", len(schedules))
+            # 今天的任务还没有任何记录时按新排班重建，保持任务和排班一致
+            today_str = datetime.now().date().strftime("%Y-%m-%d")
+            if task_store.rebuild_if_pending(today_str, build_tasks_from_schedules(schedules)):
+                log.info("已按新排班重建 %s 的任务文件", today_str)
         else:
-            print(f"[{time.ctime()}] 今天没有需要生成的排班")
+            log.info("今天没有需要生成的排班")
             
     except Exception as e:
-        print(f"[{time.ctime()}] 每日排班生成过程中发生错误: {e}")
-        
-# 修改 run_scheduler_in_background 函数
-def run_scheduler_in_background():
-    """运行定时任务调度器"""
-    # 从配置文件读取时间设置
+        log.error("每日排班生成过程中发生错误: %s", e)
+        raise
+
+# 刚上传的图片在写入 patients.csv 之前不能被当作孤立文件删除
+IMAGE_CLEANUP_GRACE_SECONDS = 3600
+
+def cleanup_orphan_images():
+    """删除 images_patients 目录中没有任何患者引用的图片（包括各尺寸的版本）"""
+    referenced = set()
+    for patient in read_csv_snapshot(PATIENTS_FILE):
+        image_id = patient.get('imageResourceId')
+        if image_id:
+            referenced.add(image_id)
+            if image_variants.is_hashed_image_id(image_id):
+                referenced.update(image_variants.variant_filenames(image_id))
+    removed = 0
+    now = time.time()
+    for filename in os.listdir(UPLOAD_FOLDER):
+        path = os.path.join(UPLOAD_FOLDER, filename)
+        if filename in referenced or not os.path.isfile(path):
+            continue
+        if now - os.path.getmtime(path) < IMAGE_CLEANUP_GRACE_SECONDS:
+            continue
+        os.remove(path)
+        removed += 1
+    if removed:
+        log.info("已清理 %d 张没有患者引用的图片", removed)
+    return removed
+
+def regenerate_image_variants():
+    """
+    为已有的患者照片补齐各尺寸的版本
+    旧的上传文件转换后 imageResourceId 会变成按内容哈希命名的新文件，同时更新 patients.csv
+    （旧文件不再被引用，由 image_cleanup 任务清理）
+    """
+    if not image_variants.PILLOW_AVAILABLE:
+        return 0
+    renamed = {}
+    regenerated = 0
+    for patient in read_csv_snapshot(PATIENTS_FILE):
+        image_id = patient.get('imageResourceId')
+        if not image_id or image_id in renamed:
+            continue
+        if image_variants.is_hashed_image_id(image_id) and \
+                image_variants.has_all_variants(UPLOAD_FOLDER, image_id):
+            continue
+        try:
+            new_id = image_variants.regenerate_variants(UPLOAD_FOLDER, image_id)
+        except (FileNotFoundError, ValueError) as e:
+            log.warning("无法为图片 %s 生成缩略图: %s", image_id, e)
+            continue
+        regenerated += 1
+        if new_id != image_id:
+            renamed[image_id] = new_id
+
+    if renamed:
+        all_patients = read_csv_file(PATIENTS_FILE)
+        for patient in all_patients:
+            patient['imageResourceId'] = renamed.get(patient.get('imageResourceId'), patient.get('imageResourceId'))
+        storage.write_rows(PATIENTS_FILE, all_patients, PATIENT_FIELDNAMES)
+    if regenerated:
+        log.info("已为 %d 张患者照片生成缩略图", regenerated)
+    return regenerated
+
+# 最近一次一致性检查的结果
+orphan_report = {'checked_at': None, 'orphans': {}, 'total': 0}
+
+def check_orphan_rows():
+    """检查 data/ 下所有表中引用了不存在患者的行（只报告，不删除）"""
+    global orphan_report
+    orphans = patient_index.find_orphans()
+    total = sum(sum(counts.values()) for counts in orphans.values())
+    orphan_report = {'checked_at': datetime.now().isoformat(timespec='seconds'), 'orphans': orphans, 'total': total}
+    if total:
+        log.warning("一致性检查: %d 个文件中共有 %d 条记录引用了不存在的患者", len(orphans), total)
+    return orphan_report
+
+@app.route('/admin/orphans', methods=['GET'])
+def orphan_report_api():
+    """【API接口】查看最近一次一致性检查的结果，?refresh=1 立即重新检查"""
+    if request.args.get('refresh') == '1' or orphan_report['checked_at'] is None:
+        return jsonify({'success': True, **check_orphan_rows()})
+    return jsonify({'success': True, **orphan_report})
+
+# 后台任务调度器，任务的运行状态保存在 data/job_state.json
+job_scheduler = JobScheduler('data/job_state.json')
+
+# 多进程部署时只有持有这把锁的 worker（主进程）运行调度器
+scheduler_leader = LeaderLock(lock_path('scheduler'))
+
+# 其它 worker 每隔多少秒尝试接替主进程（主进程退出后锁会自动释放）
+LEADER_RETRY_SECONDS = 30
+
+def sync_schedule_time():
+    """
+    从配置文件同步每日排班时间
+    修改时间的请求可能落在其它 worker 上，主进程定期读取配置文件使修改生效
+    """
+    job_scheduler.reschedule_daily('daily_schedule', read_schedule_config())
+
+def start_job_scheduler():
+    """注册所有后台任务并启动调度线程"""
+    # 从配置文件读取时间设置，重启时如果错过了当天的排班会立即补跑
     schedule_time = read_schedule_config()
-    schedule.every().day.at(schedule_time).do(daily_schedule_generation)
-    
-    print(f"[{time.ctime()}] 定时任务已启动: 每天 {schedule_time} 自动生成排班")
-    
-    while True:
-        schedule.run_pending()
-        time.sleep(60)  # 每分钟检查一次
+    job_scheduler.add_daily('daily_schedule', daily_schedule_generation, schedule_time,
+                            description='每日生成排班')
+    # 预生成未来一周的排班和任务文件（处方变化后也会刷新）
+    job_scheduler.add_interval('task_pregeneration', pregenerate_schedules, 10 * 60, run_at_start=True,
+                               description='预生成未来一周的排班和任务文件')
+    # 把任务修改日志合并回CSV
+    job_scheduler.add_interval('task_compaction', task_store.compact_all, 5 * 60,
+                               description='合并任务修改日志')
+    job_scheduler.add_interval('image_cleanup', cleanup_orphan_images, 24 * 3600, run_at_start=True,
+                               description='清理没有患者引用的图片')
+    job_scheduler.add_interval('image_variants', regenerate_image_variants, 24 * 3600, run_at_start=True,
+                               description='为已有的患者照片生成缩略图')
+    job_scheduler.add_interval('task_archive', archive_closed_days, 24 * 3600, run_at_start=True,
+                               description='把一周前的任务记录按月归档')
+    # 归档前最近几天也已经汇总过，归档不影响统计
+    job_scheduler.add_interval('adherence_rollup', rollup_adherence, 3600, run_at_start=True,
+                               description='汇总已结束日期的服药依从性')
+    job_scheduler.add_interval('orphan_check', check_orphan_rows, 3600, run_at_start=True,
+                               description='检查引用了不存在患者的记录')
+    job_scheduler.add_interval('schedule_config_sync', sync_schedule_time, 60,
+                               description='同步其它进程修改的排班时间')
+    job_scheduler.start()
+
+    log.info("定时任务已启动: 每天 %s 自动生成排班", schedule_time)
+
+def elect_scheduler_leader():
+    """
+    竞选主进程：成功后启动调度器，否则每隔 LEADER_RETRY_SECONDS 秒重试
+    （主进程退出后由其它 worker 接替）
+    """
+    while not scheduler_leader.try_acquire():
+        time.sleep(LEADER_RETRY_SECONDS)
+    log.info("进程 %d 成为主进程，负责运行后台任务", os.getpid())
+    start_job_scheduler()
+
+def create_app(start_scheduler=True):
+    """
+    应用工厂，供 wsgi.py（gunicorn / waitress）和开发服务器使用
+    Args:
+        start_scheduler: 是否参与主进程竞选并运行后台任务（压测或只读副本可以关闭）
+    Returns:
+        Flask 应用
+    """
+    if start_scheduler:
+        threading.Thread(target=elect_scheduler_leader, name='scheduler-election', daemon=True).start()
+    # 定期把本进程的指标写到 data/.metrics，任何 worker 的 /admin/metrics 都能合并输出
+    metrics.start_snapshots()
+    return app
+
+@app.route('/admin/jobs', methods=['GET'])
+def job_status_api():
+    """【API接口】查看后台任务的下次运行时间、最近运行结果和耗时"""
+    if scheduler_leader.held:
+        jobs = job_scheduler.status()
+    else:
+        # 调度器在主进程中运行，这里只能看到它保存的最近运行结果
+        jobs = job_scheduler.persisted_status()
+    return jsonify({
+        'success': True,
+        'leader': scheduler_leader.held,
+        'leader_pid': scheduler_leader.holder_pid(),
+        'worker_pid': os.getpid(),
+        'jobs': jobs
+    })
+
+def storage_metrics():
+    """存储后端的读写次数、字节数和表格缓存命中情况"""
+    stats = storage.stats()
+    backend = {'backend': storage.name}
+    samples = [
+        ('ezdose_table_cache_hits_total', 'counter', '表格缓存命中次数', backend, stats['hits']),
+        ('ezdose_table_cache_misses_total', 'counter', '表格第一次读取的次数', backend, stats['misses']),
+        ('ezdose_table_cache_reloads_total', 'counter', '表格变化后重新加载的次数', backend, stats['reloads']),
+        ('ezdose_table_cache_files', 'gauge', '缓存中的表格数', backend, stats['cached_files']),
+        ('ezdose_storage_reads_total', 'counter', '从磁盘/数据库读取整张表的次数', backend, stats.get('reads', 0)),
+        ('ezdose_storage_writes_total', 'counter', '整表写入的次数', backend, stats.get('writes', 0)),
+    ]
+    if 'read_bytes' in stats:
+        samples.append(('ezdose_csv_read_bytes_total', 'counter', '读取CSV文件的字节数', {}, stats['read_bytes']))
+        samples.append(('ezdose_csv_write_bytes_total', 'counter', '写入CSV文件的字节数', {}, stats['write_bytes']))
+    return samples
+
+def job_metrics():
+    """后台任务的运行次数和耗时（只有主进程有数据）"""
+    samples = []
+    for job in job_scheduler.status():
+        labels = {'job': job['name']}
+        samples += [
+            ('ezdose_job_runs_total', 'counter', '后台任务运行次数', labels, job['run_count']),
+            ('ezdose_job_errors_total', 'counter', '后台任务失败次数', labels, job['error_count']),
+            ('ezdose_job_duration_seconds_total', 'counter', '后台任务累计耗时（秒）', labels,
+             job['total_duration_ms'] / 1000),
+            ('ezdose_job_last_duration_seconds', 'gauge', '后台任务最近一次耗时（秒）', labels,
+             (job['last_duration_ms'] or 0) / 1000),
+            ('ezdose_job_running', 'gauge', '后台任务是否正在运行', labels, int(job['running'])),
+        ]
+    return samples
+
+def notifier_metrics():
+    """等待任务变化的长轮询 / SSE 连接"""
+    stats = task_notifier.stats()
+    return [
+        ('ezdose_task_watchers', 'gauge', '正在等待任务变化的连接数', {}, stats['waiters']),
+        ('ezdose_task_notifications_total', 'counter', '任务变化通知次数', {}, stats['notifications']),
+        ('ezdose_task_watchers_limit', 'gauge', '每个进程最多同时等待任务变化的连接数', {}, MAX_TASK_WATCHERS),
+    ]
+
+metrics.add_collector(storage_metrics)
+metrics.add_collector(job_metrics)
+metrics.add_collector(notifier_metrics)
+
+@app.route('/admin/metrics', methods=['GET'])
+def metrics_api():
+    """【API接口】Prometheus 文本格式的性能指标（合并所有 worker）"""
+    families, workers = metrics.collect_all()
+    families['ezdose_workers'] = {'type': 'gauge', 'help': '参与统计的 worker 进程数',
+                                  'samples': [['ezdose_workers', [], workers]]}
+
+    # 缓存命中率：合并各 worker 的计数后再计算
+    def total(name):
+        return sum(sample[2] for sample in families.get(name, {}).get('samples', []))
+    lookups = sum(total(f'ezdose_table_cache_{kind}_total') for kind in ('hits', 'misses', 'reloads'))
+    families['ezdose_table_cache_hit_ratio'] = {
+        'type': 'gauge', 'help': '表格缓存命中率',
+        'samples': [['ezdose_table_cache_hit_ratio', [],
+                     total('ezdose_table_cache_hits_total') / lookups if lookups else 0.0]]
+    }
+    return Response(MetricsRegistry.render(families), mimetype='text/plain; version=0.0.4')
+
+@app.route('/admin/cache-stats', methods=['GET'])
+def cache_stats_api():
+    """【API接口】查看表格缓存的命中/未命中/重新加载次数"""
+    stats = storage.stats()
+    stats['backend'] = storage.name
+    return jsonify(stats)
 
 # 修改现有的API路由路径
 @app.route('/admin/generate-schedules', methods=['POST'])
@@ -1178,10 +2156,8 @@ def generate_schedules_api():
         }), 500
 
 # --- 6. 脚本主入口 ---
+# 生产环境使用 wsgi.py 多进程部署（见 README），这里只用于本地开发
 if __name__ == '__main__':
-    # 启动后台定时任务线程
-    scheduler_thread = threading.Thread(target=run_scheduler_in_background, daemon=True)
-    scheduler_thread.start()
-
-    # 运行Flask服务器
-    app.run(host='0.0.0.0', port=5050, debug=True)
\ No newline at end of file
+    # 运行Flask服务器（单进程，直接成为主进程并启动后台任务调度器）
+    # debug 模式的自动重载会另外启动一个监视进程，只在真正处理请求的子进程中运行调度器
+    create_app(start_scheduler=os.environ.get('WERKZEUG_RUN_MAIN') == 'true').run(host='0.0.0.0', port=5050, debug=True)
\ No newline at end of file
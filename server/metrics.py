@@ -0,0 +1,237 @@
+"""
+请求级性能指标
+
+收集各路由的请求数和延迟分布、CSV读写次数和字节数、表格缓存命中率、后台任务耗时等，
+由 /admin/metrics 以 Prometheus 文本格式输出。不依赖 prometheus_client：
+- Counter / Histogram 在进程内累加，记录一次只是加锁改几个数字
+- 也可以注册“收集函数”，在输出时从已有的 stats() 读取（缓存、存储、调度器）
+- 多进程部署时每个 worker 定期把自己的指标写到 data/.metrics/<pid>.json，
+  /admin/metrics 无论落在哪个 worker 上都会合并所有存活 worker 的指标（同名同标签的值相加）
+"""
+
+import json
+import os
+import tempfile
+import threading
+import time
+
+# 请求延迟直方图的桶（秒）
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _label_key(labels):
+    return tuple(sorted((str(k), str(v)) for k, v in labels.items()))
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+class Counter:
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def collect(self):
+        with self._lock:
+            return [(self.name, key, value) for key, value in self._values.items()]
+
+
+class Histogram:
+    def __init__(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}   # 标签 -> [各桶计数..., 总和, 次数]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[i] += 1
+                    break
+            entry[-2] += value
+            entry[-1] += 1
+
+    def collect(self):
+        samples = []
+        with self._lock:
+            for key, entry in self._values.items():
+                cumulative = 0
+                for bound, count in zip(self.buckets, entry):
+                    cumulative += count
+                    samples.append((f"{self.name}_bucket", key + (('le', _format_value(float(bound))),), cumulative))
+                samples.append((f"{self.name}_bucket", key + (('le', '+Inf'),), entry[-1]))
+                samples.append((f"{self.name}_sum", key, entry[-2]))
+                samples.append((f"{self.name}_count", key, entry[-1]))
+        return samples
+
+
+class MetricsRegistry:
+    def __init__(self, snapshot_dir=None):
+        """
+        初始化指标注册表
+        Args:
+            snapshot_dir: 多进程部署时各 worker 写指标快照的目录，为None时只输出本进程的指标
+        """
+        self.snapshot_dir = snapshot_dir
+        self._metrics = []
+        self._collectors = []
+        self._snapshot_thread = None
+
+    def counter(self, name, help_text):
+        metric = Counter(name, help_text)
+        self._metrics.append(('counter', metric))
+        return metric
+
+    def histogram(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        metric = Histogram(name, help_text, buckets)
+        self._metrics.append(('histogram', metric))
+        return metric
+
+    def add_collector(self, func):
+        """
+        注册收集函数，输出指标时调用
+        Args:
+            func: 无参数函数，返回 [(名称, 类型 counter/gauge, 说明, {标签}, 值), ...]
+        """
+        self._collectors.append(func)
+
+    def collect(self):
+        """
+        本进程的所有指标
+        Returns:
+            {名称: {'type', 'help', 'samples': [[样本名, [[标签, 值], ...], 值], ...]}}
+        """
+        families = {}
+        for metric_type, metric in self._metrics:
+            family = families.setdefault(metric.name, {'type': metric_type, 'help': metric.help, 'samples': []})
+            family['samples'].extend([name, [list(pair) for pair in key], value] for name, key, value in metric.collect())
+        for func in self._collectors:
+            try:
+                samples = func()
+            except Exception:
+                # 某个收集函数出错不影响其它指标
+                continue
+            for name, metric_type, help_text, labels, value in samples:
+                family = families.setdefault(name, {'type': metric_type, 'help': help_text, 'samples': []})
+                family['samples'].append([name, [list(pair) for pair in _label_key(labels)], value])
+        return families
+
+    def _snapshot_filename(self, pid):
+        return os.path.join(self.snapshot_dir, f"{pid}.json")
+
+    def write_snapshot(self):
+        """把本进程的指标写到快照目录（先写临时文件再替换）"""
+        os.makedirs(self.snapshot_dir, exist_ok=True)
+        fd, tmp_filename = tempfile.mkstemp(dir=self.snapshot_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(self.collect(), f, ensure_ascii=False)
+            os.replace(tmp_filename, self._snapshot_filename(os.getpid()))
+        except BaseException:
+            if os.path.exists(tmp_filename):
+                os.remove(tmp_filename)
+            raise
+
+    def start_snapshots(self, interval=10):
+        """启动定期写快照的后台线程（多进程部署时调用）"""
+        if self.snapshot_dir is None or self._snapshot_thread is not None:
+            return
+
+        def loop():
+            while True:
+                try:
+                    self.write_snapshot()
+                except Exception:
+                    pass
+                time.sleep(interval)
+
+        self._snapshot_thread = threading.Thread(target=loop, name='metrics-snapshot', daemon=True)
+        self._snapshot_thread.start()
+
+    def _other_snapshots(self):
+        """其它存活 worker 的指标快照，已退出进程的快照文件顺便删除"""
+        # Windows 上 os.kill(pid, 0) 会结束目标进程；那里也只能单进程部署，不需要合并
+        if self.snapshot_dir is None or os.name != 'posix' or not os.path.isdir(self.snapshot_dir):
+            return []
+        snapshots = []
+        for filename in os.listdir(self.snapshot_dir):
+            stem, ext = os.path.splitext(filename)
+            if ext != '.json' or not stem.isdigit() or int(stem) == os.getpid():
+                continue
+            path = os.path.join(self.snapshot_dir, filename)
+            try:
+                os.kill(int(stem), 0)
+            except ProcessLookupError:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                continue
+            except (PermissionError, OSError):
+                pass
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        return snapshots
+
+    def collect_all(self):
+        """
+        合并所有 worker 的指标（同名同标签的值相加）
+        Returns:
+            families: 与 collect() 格式相同
+            workers: 参与合并的进程数
+        """
+        snapshots = [self.collect()] + self._other_snapshots()
+        merged = {}
+        for snapshot in snapshots:
+            for name, family in snapshot.items():
+                target = merged.setdefault(name, {'type': family['type'], 'help': family['help'], 'values': {}})
+                for sample_name, labels, value in family['samples']:
+                    key = (sample_name, tuple(tuple(pair) for pair in labels))
+                    target['values'][key] = target['values'].get(key, 0) + value
+        families = {name: {'type': family['type'], 'help': family['help'],
+                           'samples': [[sample_name, [list(pair) for pair in labels], value]
+                                       for (sample_name, labels), value in family['values'].items()]}
+                    for name, family in merged.items()}
+        return families, len(snapshots)
+
+    @staticmethod
+    def render(families):
+        """按 Prometheus 文本格式输出"""
+        lines = []
+        for name in sorted(families):
+            family = families[name]
+            lines.append(f"# HELP {name} {family['help']}")
+            lines.append(f"# TYPE {name} {family['type']}")
+            # 样本保持收集时的顺序（直方图的桶必须从小到大）
+            for sample_name, labels, value in family['samples']:
+                if labels:
+                    label_text = ','.join(f'{k}="{_escape(str(v))}"' for k, v in labels)
+                    lines.append(f"{sample_name}{{{label_text}}} {_format_value(value)}")
+                else:
+                    lines.append(f"{sample_name} {_format_value(value)}")
+        return '\n'.join(lines) + '\n'
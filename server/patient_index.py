@@ -0,0 +1,94 @@
+"""
+跨表患者索引
+
+删除患者以前要整表读写 patients.csv、处方表和 schedules.csv 三张表，
+而且从不处理每天的 schedules_<date>.csv / tasks_<date>.csv，留下大量孤立记录。
+这里为所有带 patientId 的表（包括每个日期文件）维护 patientId -> 行号 的索引：
+- 每张表单独记录签名，某张表被写入（签名变化）后只重建这一张表的索引
+- 级联删除时只需要处理真正包含该患者的表
+- find_orphans() 找出所有引用了不存在患者的行，供后台一致性检查使用
+"""
+
+import re
+import threading
+
+# 每日文件名
+DATED_FILE_PATTERN = re.compile(r'^(tasks|schedules)_(\d{4}-\d{2}-\d{2})\.csv$')
+
+
+class PatientIndex:
+    def __init__(self, read_rows, signature, list_tables, patients_file):
+        """
+        初始化患者索引
+        Args:
+            read_rows: 读取表格的函数，返回只读行
+            signature: 计算表格签名的函数，表不存在时返回None
+            list_tables: 返回所有需要索引的表格文件名的函数（每日文件会不断增加）
+            patients_file: 患者表文件名（find_orphans 以它为准）
+        """
+        self.read_rows = read_rows
+        self.signature = signature
+        self.list_tables = list_tables
+        self.patients_file = patients_file
+        self._lock = threading.Lock()
+        self._tables = {}  # 文件名 -> (签名, {patientId: [行号]})
+
+    def _refresh(self):
+        """重建签名变化了的表的索引（调用方必须持有 self._lock）"""
+        tables = set(self.list_tables())
+        for filename in list(self._tables):
+            if filename not in tables:
+                del self._tables[filename]
+
+        for filename in tables:
+            signature = self.signature(filename)
+            entry = self._tables.get(filename)
+            if entry is not None and entry[0] == signature:
+                continue
+            positions = {}
+            if signature is not None:
+                try:
+                    rows = self.read_rows(filename)
+                except FileNotFoundError:
+                    rows = ()
+                for position, row in enumerate(rows):
+                    patient_id = row.get('patientId')
+                    if patient_id:
+                        positions.setdefault(patient_id, []).append(position)
+            self._tables[filename] = (signature, positions)
+
+    def locate(self, patient_id):
+        """
+        查找某个患者在哪些表中出现
+        Returns:
+            {文件名: [行号]}
+        """
+        with self._lock:
+            self._refresh()
+            return {filename: list(positions[patient_id])
+                    for filename, (_, positions) in self._tables.items() if patient_id in positions}
+
+    def find_orphans(self):
+        """
+        查找引用了不存在患者的行
+        Returns:
+            {文件名: {patientId: 行数}}
+        """
+        with self._lock:
+            self._refresh()
+            patients = self._tables.get(self.patients_file)
+            known = set(patients[1]) if patients is not None else set()
+            orphans = {}
+            for filename, (_, positions) in sorted(self._tables.items()):
+                if filename == self.patients_file:
+                    continue
+                missing = {patient_id: len(rows) for patient_id, rows in positions.items() if patient_id not in known}
+                if missing:
+                    orphans[filename] = missing
+            return orphans
+
+    @staticmethod
+    def dated_file_date(filename):
+        """tasks_2025-09-03.csv -> ('tasks', '2025-09-03')，不是每日文件时返回None"""
+        match = DATED_FILE_PATTERN.match(filename.replace('\\', '/').rsplit('/', 1)[-1])
+        return match.groups() if match else None
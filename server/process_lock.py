@@ -0,0 +1,165 @@
+"""
+跨进程锁
+
+用 gunicorn 等多进程方式部署时，每个 worker 进程都有自己的 threading.Lock，
+处方表的“读取-修改-写回”、每天任务日志的追加与合并在不同进程之间就不再互斥。
+这里用锁文件上的 fcntl.flock 实现跨进程互斥，同时保留线程锁保证同一进程内的线程互斥：
+- InterProcessLock: 阻塞的互斥锁，用法与 threading.Lock 相同（with lock: ...）
+- LeaderLock: 非阻塞地尝试成为“主进程”，只有主进程运行后台任务调度器，
+  主进程退出后锁自动释放，其它 worker 下一次尝试时接替
+
+没有 fcntl 的平台（Windows）只能单进程多线程部署（例如 waitress），此时退化为普通的线程锁。
+gevent worker 下阻塞的 flock 会卡住整个进程（包括所有挂着的长连接），这时改为非阻塞地尝试并让出协程。
+"""
+
+import os
+import sys
+import threading
+import time
+
+try:
+    import fcntl
+    FCNTL_AVAILABLE = True
+except ImportError:
+    FCNTL_AVAILABLE = False
+
+# 锁文件所在的目录
+LOCK_DIR = os.path.join('data', '.locks')
+
+# gevent 下等待其它进程释放锁时，每次重试之间让出协程的秒数（逐渐增加到上限）
+GEVENT_RETRY_MIN = 0.001
+GEVENT_RETRY_MAX = 0.05
+
+
+def _gevent_patched():
+    """当前进程是否运行在 gevent 的 monkey patch 下（gunicorn 的 gevent worker）"""
+    if 'gevent.monkey' not in sys.modules:
+        return False
+    return sys.modules['gevent.monkey'].is_module_patched('time')
+
+
+def _flock_cooperative(fd):
+    """gevent 下获取 flock：非阻塞地尝试，失败时 sleep（被 patch 为让出协程）后重试"""
+    delay = GEVENT_RETRY_MIN
+    while True:
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return
+        except BlockingIOError:
+            time.sleep(delay)
+            delay = min(delay * 2, GEVENT_RETRY_MAX)
+
+
+def lock_path(name, lock_dir=None):
+    """
+    某个名称对应的锁文件路径
+    Args:
+        name: 锁的名称，可以是文件路径（只取文件名）
+        lock_dir: 锁文件目录，默认 data/.locks
+    """
+    return os.path.join(lock_dir or LOCK_DIR, os.path.basename(name) + '.lock')
+
+
+class _LockFile:
+    """锁文件的文件描述符，fork 之后在子进程中重新打开（继承来的描述符和父进程共用同一把 flock）"""
+
+    def __init__(self, path):
+        self.path = path
+        self._fd = None
+        self._pid = None
+
+    def fileno(self):
+        if self._fd is None or self._pid != os.getpid():
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            self._pid = os.getpid()
+        return self._fd
+
+
+class InterProcessLock:
+    def __init__(self, path):
+        """
+        跨进程互斥锁
+        Args:
+            path: 锁文件路径
+        """
+        self.path = path
+        self._thread_lock = threading.Lock()
+        self._file = _LockFile(path)
+
+    def acquire(self):
+        self._thread_lock.acquire()
+        if FCNTL_AVAILABLE:
+            try:
+                if _gevent_patched():
+                    _flock_cooperative(self._file.fileno())
+                else:
+                    fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+            except BaseException:
+                self._thread_lock.release()
+                raise
+        return True
+
+    def release(self):
+        if FCNTL_AVAILABLE:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+        self._thread_lock.release()
+
+    def locked(self):
+        """本进程内是否有线程持有这把锁"""
+        return self._thread_lock.locked()
+
+    def __enter__(self):
+        return self.acquire()
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class LeaderLock:
+    def __init__(self, path):
+        """
+        主进程选举锁：成功获取后一直持有到进程退出
+        Args:
+            path: 锁文件路径，持有者会把自己的进程号写进去
+        """
+        self.path = path
+        self._file = _LockFile(path)
+        self._lock = threading.Lock()
+        self._held = False
+
+    def try_acquire(self):
+        """
+        尝试成为主进程（不阻塞）
+        Returns:
+            bool: 当前进程是否是主进程
+        """
+        with self._lock:
+            if self._held:
+                return True
+            if FCNTL_AVAILABLE:
+                fd = self._file.fileno()
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    return False
+                os.ftruncate(fd, 0)
+                os.pwrite(fd, str(os.getpid()).encode('ascii'), 0)
+            self._held = True
+            return True
+
+    @property
+    def held(self):
+        return self._held
+
+    def holder_pid(self):
+        """当前主进程的进程号（读取锁文件），未知时返回None"""
+        if self._held:
+            return os.getpid()
+        try:
+            with open(self.path, 'r', encoding='ascii') as f:
+                return int(f.read().strip() or 0) or None
+        except (OSError, ValueError):
+            return None
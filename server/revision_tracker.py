@@ -0,0 +1,137 @@
+"""
+表格版本与增量同步
+
+分药机和手机App每次刷新都会拉取整张处方表/患者表，即使什么都没变。这里为每张表维护：
+- 单调递增的版本号 revision（以微秒时间戳为基准，服务器重启后也不会倒退）
+- 每一行最后一次变化时的 revision，以及被删除行的墓碑记录
+GET 接口据此返回 ETag（配合 If-None-Match 返回304），
+并支持 since=<revision> 只返回此后变化或删除的行。
+版本的计算是惰性的：只有表格签名变化后第一次读取时才和上一个快照做一次差异比较。
+多进程部署时每个 worker 各自跟踪版本，调用方可以传入数据的修改时间作为版本号，
+这样不同 worker 对同一份数据给出相同的 revision 和 ETag。
+各个 worker 看到的中间状态不一定相同（某个 worker 可能从没读到过另一个 worker 看到的修改），
+所以只有本 worker 自己登记过的 revision 才能计算增量，其它 since 一律返回全量。
+"""
+
+import threading
+import time
+
+
+def _now_revision():
+    return time.time_ns() // 1000
+
+
+class TableVersion:
+    def __init__(self, signature, revision, base_revision, rows, key_fields, row_revisions, tombstones,
+                 known_revisions):
+        """
+        某张表在某一时刻的版本
+        Args:
+            signature: 底层表格签名
+            revision: 表的版本号（任何一行变化都会增大）
+            base_revision: 开始跟踪时的版本号，更早的 since 无法计算增量
+            rows: 行快照
+            key_fields: 主键字段
+            row_revisions: {主键: 该行最后变化的版本号}
+            tombstones: {主键: 删除时的版本号}
+            known_revisions: 本跟踪器为这张表登记过的所有版本号（同一张表的各个版本共用）
+        """
+        self.signature = signature
+        self.revision = revision
+        self.base_revision = base_revision
+        self.rows = rows
+        self.key_fields = key_fields
+        self.row_revisions = row_revisions
+        self.tombstones = tombstones
+        self.known_revisions = known_revisions
+
+    def key(self, row):
+        return tuple(str(row.get(field, '')) for field in self.key_fields)
+
+    def can_diff(self, since):
+        """
+        since 是否可以计算增量（否则客户端需要全量同步）：必须是本跟踪器登记过、不晚于当前版本的版本号。
+        其它 worker 发出的 revision 对应的数据本 worker 可能从没见过，按它计算增量会漏掉变化
+        """
+        return since is not None and since <= self.revision and since in self.known_revisions
+
+    def changes_since(self, since):
+        """
+        计算 since 之后的变化
+        Returns:
+            changed: 变化或新增的行
+            deleted: 被删除行的主键字典列表
+        """
+        changed = [row for row in self.rows if self.row_revisions[self.key(row)] > since]
+        deleted = [dict(zip(self.key_fields, key)) for key, revision in self.tombstones.items() if revision > since]
+        return changed, deleted
+
+
+class RevisionTracker:
+    def __init__(self):
+        """初始化版本跟踪器，按名称（例如 'patients'、'tasks:2025-09-03'）分别跟踪"""
+        self._versions = {}
+        self._lock = threading.Lock()
+        self._last_revision = _now_revision()
+
+    def _next_revision(self):
+        self._last_revision = max(self._last_revision + 1, _now_revision())
+        return self._last_revision
+
+    def observe(self, name, signature, rows, key_fields, revision=None):
+        """
+        登记表格的当前快照并返回它的版本
+        Args:
+            name: 跟踪名称
+            signature: 底层表格签名，与上次相同时直接返回上次的版本
+            rows: 当前的行快照
+            key_fields: 主键字段元组
+            revision: 数据的修改时间（微秒），提供时用作新的版本号（保证大于上一个版本）。
+                      即使内容与上次相同也推进到这个版本号，与其它 worker 保持一致
+        Returns:
+            TableVersion
+        """
+        with self._lock:
+            previous = self._versions.get(name)
+            if previous is not None and previous.signature == signature:
+                return previous
+
+            explicit = bool(revision)
+            if explicit:
+                if previous is not None and revision <= previous.revision:
+                    revision = previous.revision + 1
+            else:
+                revision = self._next_revision()
+            key_of = lambda row: tuple(str(row.get(field, '')) for field in key_fields)  # noqa: E731
+
+            if previous is None:
+                row_revisions = {key_of(row): revision for row in rows}
+                version = TableVersion(signature, revision, revision, rows, key_fields, row_revisions, {},
+                                       {revision})
+            else:
+                previous_rows = {previous.key(row): row for row in previous.rows}
+                row_revisions = {}
+                tombstones = dict(previous.tombstones)
+                changed = False
+                for row in rows:
+                    key = key_of(row)
+                    old_row = previous_rows.pop(key, None)
+                    if old_row is not None and dict(old_row) == dict(row):
+                        row_revisions[key] = previous.row_revisions[key]
+                    else:
+                        row_revisions[key] = revision
+                        changed = True
+                    tombstones.pop(key, None)
+                for key in previous_rows:
+                    tombstones[key] = revision
+                    changed = True
+
+                # 内容没有变化时，自己生成的版本号不推进；使用数据的修改时间时必须推进，
+                # 否则这里的 revision 停在旧值，而其它 worker 已经按新的修改时间发出了更大的 revision
+                table_revision = revision if changed or explicit else previous.revision
+                previous.known_revisions.add(table_revision)
+                version = TableVersion(signature, table_revision, previous.base_revision, rows,
+                                       key_fields, row_revisions, tombstones, previous.known_revisions)
+
+            self._versions[name] = version
+            return version
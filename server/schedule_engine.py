@@ -0,0 +1,226 @@
+"""
+向量化排班引擎
+
+generate_schedules_for_date 以前每次调用都逐行遍历处方表，对每一行重新 strptime 解析 start_date，
+而且一次只能处理一天。这里把处方表解析一次成 numpy 数组（日期为序数，剂量为整数），
+表格签名不变时重复使用；对任意日期范围一次性计算每个处方每天是否有效以及对应的时间段，
+结果与逐行算法完全一致（同样的顺序、同样按 (patientId, timeSlotName) 去重）。
+"""
+
+import threading
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from app_logging import get_logger
+
+log = get_logger(__name__)
+
+SCHEDULE_FIELDNAMES = ['patientId', 'patientName', 'timeSlotName']
+
+# 时间段编码: 剂量列序号 + 3 * 是否饭前
+DOSAGE_FIELDS = ('morning_dosage', 'noon_dosage', 'evening_dosage')
+TIME_SLOT_NAMES = ('AFTER_BREAKFAST', 'AFTER_LUNCH', 'AFTER_DINNER',
+                   'BEFORE_BREAKFAST', 'BEFORE_LUNCH', 'BEFORE_DINNER')
+
+
+def _to_date(target_date):
+    if target_date is None:
+        return datetime.now().date()
+    if isinstance(target_date, str):
+        return datetime.strptime(target_date, "%Y-%m-%d").date()
+    if isinstance(target_date, datetime):
+        return target_date.date()
+    return target_date
+
+
+class PrescriptionArrays:
+    def __init__(self, prescriptions):
+        """
+        把处方表解析成按列存放的数组
+        Args:
+            prescriptions: 处方行（字典）序列
+        """
+        n = len(prescriptions)
+        self.patient_ids = [p.get('patientId', '') for p in prescriptions]
+        self.patient_names = [p.get('patient_name', '') for p in prescriptions]
+        self.start = np.zeros(n, dtype=np.int64)       # 开始日期序数
+        self.end = np.full(n, -1, dtype=np.int64)      # 结束日期序数（包含当天）
+        self.enabled = np.zeros(n, dtype=bool)         # is_active 且日期、病人信息有效
+        self.doses = np.zeros((n, 3), dtype=np.int64)  # 早/中/晚剂量
+        self.before_meal = np.zeros(n, dtype=bool)
+
+        ordinals = {}  # 很多处方的开始日期相同，每个日期字符串只解析一次
+        for i, prescription in enumerate(prescriptions):
+            try:
+                start_date = prescription['start_date']
+                start = ordinals.get(start_date)
+                if start is None:
+                    start = ordinals[start_date] = datetime.strptime(start_date, "%Y-%m-%d").date().toordinal()
+                duration_days = int(prescription['duration_days'])
+            except (ValueError, KeyError, TypeError) as e:
+                log.warning("处理处方数据时出错: %s", e)
+                continue
+            self.start[i] = start
+            self.end[i] = start + duration_days - 1
+            self.enabled[i] = (prescription.get('is_active', '1') == '1'
+                               and bool(self.patient_ids[i]) and bool(self.patient_names[i]))
+
+            try:
+                self.doses[i] = [int(prescription.get(field, 0)) for field in DOSAGE_FIELDS]
+            except (ValueError, TypeError) as e:
+                log.warning("解析用药剂量时出错: %s", e)
+            self.before_meal[i] = prescription.get('meal_timing', 'after') == 'before'
+
+        # 病人编号 -> 整数编码，用于 (病人, 时间段) 去重
+        _, self.patient_codes = np.unique(np.array(self.patient_ids, dtype=object).astype(str),
+                                          return_inverse=True)
+        self.patient_codes = self.patient_codes.reshape(-1).astype(np.int64)
+        self.slot_codes = np.arange(3, dtype=np.int64)[None, :] + 3 * self.before_meal[:, None].astype(np.int64)
+
+    def __len__(self):
+        return len(self.patient_ids)
+
+    def schedules_for_range(self, start_date, days):
+        """
+        计算一段日期内每天的排班
+        Args:
+            start_date: 开始日期
+            days: 天数
+        Returns:
+            {日期字符串: 排班字典列表}
+        """
+        start_date = _to_date(start_date)
+        dates = [start_date + timedelta(days=offset) for offset in range(days)]
+        result = {d.strftime("%Y-%m-%d"): [] for d in dates}
+        n = len(self)
+        if n == 0 or days <= 0:
+            return result
+
+        ordinals = start_date.toordinal() + np.arange(days, dtype=np.int64)
+        # (天, 处方) 是否有效，再展开到 (天, 处方, 早/中/晚)
+        active = (self.enabled[None, :]
+                  & (self.start[None, :] <= ordinals[:, None])
+                  & (ordinals[:, None] <= self.end[None, :]))
+        selected = active[:, :, None] & (self.doses > 0)[None, :, :]
+
+        # nonzero 按 (天, 处方, 剂量列) 的顺序返回，与逐行算法的生成顺序相同
+        day_idx, rx_idx, dose_idx = np.nonzero(selected)
+        slots = self.slot_codes[rx_idx, dose_idx]
+        n_patients = int(self.patient_codes.max()) + 1
+        keys = (day_idx * n_patients + self.patient_codes[rx_idx]) * len(TIME_SLOT_NAMES) + slots
+        _, first = np.unique(keys, return_index=True)
+        first.sort()
+
+        # 逐个取 numpy 标量很慢，先转成Python列表再组装字典
+        date_lists = list(result.values())
+        patient_ids = self.patient_ids
+        patient_names = self.patient_names
+        for day, i, slot in zip(day_idx[first].tolist(), rx_idx[first].tolist(), slots[first].tolist()):
+            date_lists[day].append({
+                'patientId': patient_ids[i],
+                'patientName': patient_names[i],
+                'timeSlotName': TIME_SLOT_NAMES[slot],
+            })
+        return result
+
+
+class ScheduleEngine:
+    def __init__(self, read_rows, signature, prescriptions_file):
+        """
+        初始化排班引擎
+        Args:
+            read_rows: 读取表格的函数
+            signature: 计算表格签名的函数，签名变化时重新解析处方表
+            prescriptions_file: 处方表文件名
+        """
+        self.read_rows = read_rows
+        self.signature = signature
+        self.prescriptions_file = prescriptions_file
+        self._lock = threading.Lock()
+        self._arrays = None
+        self._signature = None
+
+    def arrays(self):
+        """返回解析好的处方数组（处方表变化时重新解析），处方表不存在时返回None"""
+        signature = self.signature(self.prescriptions_file)
+        if signature is None:
+            return None
+        with self._lock:
+            if self._arrays is None or signature != self._signature:
+                self._arrays = PrescriptionArrays(self.read_rows(self.prescriptions_file))
+                self._signature = signature
+            return self._arrays
+
+    def prescriptions_signature(self):
+        """当前解析数组对应的处方表签名"""
+        self.arrays()
+        return self._signature
+
+    def schedules_for_range(self, start_date, days):
+        """计算一段日期内每天的排班，见 PrescriptionArrays.schedules_for_range"""
+        arrays = self.arrays()
+        if arrays is None:
+            start_date = _to_date(start_date)
+            return {(start_date + timedelta(days=offset)).strftime("%Y-%m-%d"): [] for offset in range(days)}
+        return arrays.schedules_for_range(start_date, days)
+
+    def schedules_for_date(self, target_date=None):
+        """计算某一天的排班"""
+        return next(iter(self.schedules_for_range(_to_date(target_date), 1).values()))
+
+
+# ---- 逐行算法（原 generate_schedules_for_date 的实现），用于基准测试和核对结果 ----
+
+def is_prescription_active(prescription, target_date=None):
+    """判断处方在指定日期是否有效"""
+    target_date = _to_date(target_date)
+    try:
+        start_date = datetime.strptime(prescription['start_date'], "%Y-%m-%d").date()
+        duration_days = int(prescription['duration_days'])
+        end_date = start_date + timedelta(days=duration_days - 1)
+        return start_date <= target_date <= end_date and prescription.get('is_active', '1') == '1'
+    except (ValueError, KeyError) as e:
+        log.warning("处理处方数据时出错: %s", e)
+        return False
+
+
+def time_slots_from_dosage(prescription):
+    """根据用药剂量和用餐时机生成时间段"""
+    time_slots = []
+    try:
+        morning_dosage = int(prescription.get('morning_dosage', 0))
+        noon_dosage = int(prescription.get('noon_dosage', 0))
+        evening_dosage = int(prescription.get('evening_dosage', 0))
+        meal_timing = prescription.get('meal_timing', 'after')
+
+        if morning_dosage > 0:
+            time_slots.append('BEFORE_BREAKFAST' if meal_timing == 'before' else 'AFTER_BREAKFAST')
+        if noon_dosage > 0:
+            time_slots.append('BEFORE_LUNCH' if meal_timing == 'before' else 'AFTER_LUNCH')
+        if evening_dosage > 0:
+            time_slots.append('BEFORE_DINNER' if meal_timing == 'before' else 'AFTER_DINNER')
+    except (ValueError, KeyError) as e:
+        log.warning("解析用药剂量时出错: %s", e)
+    return time_slots
+
+
+def schedules_for_date_loop(prescriptions, target_date=None):
+    """逐行计算某一天的排班"""
+    target_date = _to_date(target_date)
+    schedules = []
+    processed_combinations = set()
+    for prescription in prescriptions:
+        if not is_prescription_active(prescription, target_date):
+            continue
+        patient_id = prescription.get('patientId', '')
+        patient_name = prescription.get('patient_name', '')
+        if not patient_id or not patient_name:
+            continue
+        for time_slot in time_slots_from_dosage(prescription):
+            combination_key = f"{patient_id}_{time_slot}"
+            if combination_key not in processed_combinations:
+                schedules.append({'patientId': patient_id, 'patientName': patient_name, 'timeSlotName': time_slot})
+                processed_combinations.add(combination_key)
+    return schedules
+
@@ -0,0 +1,56 @@
+// 管理后台列表的滚动加载：页面只包含第一页，滚动到表格底部时请求下一页的表格行并追加
+// 服务器在 X-Next-Offset 响应头中返回下一页的起始位置，没有更多数据时为空
+(function () {
+    document.querySelectorAll('.lazy-sentinel').forEach(function (sentinel) {
+        if (sentinel.dataset.bound) {
+            return;
+        }
+        sentinel.dataset.bound = '1';
+        var tbody = document.querySelector('#' + sentinel.dataset.table + ' tbody');
+        var count = sentinel.querySelector('.lazy-count');
+        var status = sentinel.querySelector('.lazy-status');
+        var loading = false;
+
+        function loadNextPage() {
+            var offset = sentinel.dataset.nextOffset;
+            if (loading || !offset) {
+                return;
+            }
+            loading = true;
+            status.textContent = '，加载中...';
+            fetch(sentinel.dataset.url + '&offset=' + encodeURIComponent(offset))
+                .then(function (response) {
+                    if (!response.ok) {
+                        throw new Error(response.status);
+                    }
+                    sentinel.dataset.nextOffset = response.headers.get('X-Next-Offset') || '';
+                    return response.text();
+                })
+                .then(function (html) {
+                    tbody.insertAdjacentHTML('beforeend', html);
+                    count.textContent = tbody.querySelectorAll('tr').length;
+                    status.textContent = sentinel.dataset.nextOffset ? '，向下滚动加载更多' : '';
+                    loading = false;
+                    // 一页没有填满屏幕时继续加载
+                    if (sentinel.dataset.nextOffset && sentinel.getBoundingClientRect().top < window.innerHeight) {
+                        loadNextPage();
+                    }
+                })
+                .catch(function (error) {
+                    console.error('加载下一页失败:', error);
+                    status.textContent = '，加载失败，滚动重试';
+                    loading = false;
+                });
+        }
+
+        if ('IntersectionObserver' in window) {
+            new IntersectionObserver(function (entries) {
+                if (entries[0].isIntersecting) {
+                    loadNextPage();
+                }
+            }, { rootMargin: '300px' }).observe(sentinel);
+        } else {
+            sentinel.addEventListener('click', loadNextPage);
+        }
+    });
+})();
@@ -0,0 +1,419 @@
+"""
+数据存储后端
+
+main_packer.py 中所有的表格读写（read_csv_file / write_csv_file 等）都通过这里的后端完成，
+由 config.json 中的 storage_backend 选择：
+- csv:    默认，直接读写 data/ 目录下的CSV文件（带表格缓存）
+- sqlite: 所有表存放在一个SQLite数据库中，在 patientId、auntieId、date、timeSlotName 上建立索引。
+          每日文件 tasks_<date>.csv / schedules_<date>.csv 合并成 tasks / schedules_daily 两张表，
+          用 date 列区分，不再在 data/ 目录下每天生成新文件。
+两个后端对外使用相同的“文件名”，路由代码不需要关心具体存储方式。
+"""
+
+import csv
+import json
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+
+from app_logging import get_logger
+from process_lock import InterProcessLock, lock_path
+from table_cache import FrozenRow, TableCache
+
+# 需要建立索引的列
+INDEXED_COLUMNS = ('patientId', 'auntieId', 'date', 'timeSlotName')
+
+# 每日文件 -> (表名, 日期)
+DATED_FILE_PATTERN = re.compile(r'^(tasks|schedules)_(\d{4}-\d{2}-\d{2})$')
+DATED_TABLES = {'tasks': 'tasks', 'schedules': 'schedules_daily'}
+
+log = get_logger(__name__)
+
+
+def _fsync_dir(dirname):
+    """把目录项（重命名）刷到磁盘，Windows上不支持打开目录，忽略"""
+    try:
+        fd = os.open(dirname or '.', os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+class CsvBackend:
+    name = 'csv'
+
+    def __init__(self):
+        """CSV文件后端，读取走表格缓存"""
+        self.cache = TableCache(loader=self._load)
+        self._file_locks = {}
+        self._file_locks_lock = threading.Lock()
+
+        # 读写统计（读取只统计缓存未命中、真正解析文件的次数）
+        self._io_lock = threading.Lock()
+        self.reads = 0
+        self.read_bytes = 0
+        self.writes = 0
+        self.write_bytes = 0
+
+    def _load(self, filename):
+        rows = TableCache._parse(filename)
+        try:
+            size = os.path.getsize(filename)
+        except OSError:
+            size = 0
+        with self._io_lock:
+            self.reads += 1
+            self.read_bytes += size
+        return rows
+
+    def _file_lock(self, filename):
+        """每个文件一把写锁，同一文件的写入串行（多进程部署时跨进程）"""
+        key = os.path.abspath(filename)
+        with self._file_locks_lock:
+            lock = self._file_locks.get(key)
+            if lock is None:
+                lock_dir = os.path.join(os.path.dirname(key), '.locks')
+                lock = self._file_locks[key] = InterProcessLock(lock_path(key, lock_dir))
+            return lock
+
+    def read_rows(self, filename):
+        """
+        读取表格
+        Args:
+            filename: CSV文件路径
+        Returns:
+            rows: FrozenRow 组成的元组（只读）
+        Raises:
+            FileNotFoundError: 文件不存在
+        """
+        return self.cache.get(filename)
+
+    def query_rows(self, filename, **conditions):
+        """按列的值精确筛选（CSV后端在缓存的快照上过滤）"""
+        return tuple(row for row in self.read_rows(filename)
+                     if all(row.get(column) == value for column, value in conditions.items()))
+
+    def write_rows(self, filename, data, fieldnames):
+        """
+        将字典列表写入CSV文件，会覆盖旧文件
+        先写同目录下的临时文件并 fsync，再原子地重命名为目标文件：
+        写到一半时崩溃或断电，目标文件仍是完整的旧版本，其它线程也不会读到写了一半的文件
+        """
+        dirname = os.path.dirname(filename)
+        with self._file_lock(filename):
+            fd, tmp_filename = tempfile.mkstemp(dir=dirname or '.', prefix='.' + os.path.basename(filename) + '.',
+                                                suffix='.tmp')
+            try:
+                with os.fdopen(fd, mode='w', encoding='utf-8-sig', newline='') as csvfile:
+                    writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
+                    writer.writeheader()
+                    writer.writerows(data)
+                    csvfile.flush()
+                    os.fsync(csvfile.fileno())
+                # mkstemp 创建的文件权限是600，沿用旧文件的权限
+                try:
+                    mode = os.stat(filename).st_mode & 0o777
+                except FileNotFoundError:
+                    mode = 0o644
+                os.chmod(tmp_filename, mode)
+                size = os.path.getsize(tmp_filename)
+                os.replace(tmp_filename, filename)
+                _fsync_dir(dirname)
+                with self._io_lock:
+                    self.writes += 1
+                    self.write_bytes += size
+            except BaseException:
+                if os.path.exists(tmp_filename):
+                    os.remove(tmp_filename)
+                raise
+            finally:
+                self.cache.invalidate(filename)
+
+    def remove(self, filename):
+        """删除表格（不存在时忽略）"""
+        with self._file_lock(filename):
+            try:
+                os.remove(filename)
+            except FileNotFoundError:
+                return
+            finally:
+                self.cache.invalidate(filename)
+            _fsync_dir(os.path.dirname(filename))
+
+    def exists(self, filename):
+        return os.path.exists(filename)
+
+    def list_files(self, data_dir='data'):
+        """数据目录下所有CSV文件名（不含目录）"""
+        if not os.path.isdir(data_dir):
+            return []
+        return sorted(f for f in os.listdir(data_dir) if f.endswith('.csv'))
+
+    def signature(self, filename):
+        """表格的版本签名，表格不存在时返回None（每次写入都会换成新文件，所以包含 inode）"""
+        try:
+            stat = os.stat(filename)
+            return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+        except FileNotFoundError:
+            return None
+
+    def modified_time_us(self, filename):
+        """表格最后一次写入的时间（微秒），多个进程看到的值相同；表格不存在时返回None"""
+        signature = self.signature(filename)
+        return None if signature is None else signature[0] // 1000
+
+    def stats(self):
+        stats = self.cache.stats()
+        with self._io_lock:
+            stats.update(reads=self.reads, read_bytes=self.read_bytes, writes=self.writes, write_bytes=self.write_bytes)
+        return stats
+
+
+class SqliteBackend:
+    name = 'sqlite'
+
+    def __init__(self, db_path, data_dir='data'):
+        """
+        SQLite后端
+        Args:
+            db_path: 数据库文件路径
+            data_dir: 数据根目录，表格按相对这个目录的路径区分（不同子目录下的同名文件是不同的表）
+        """
+        self.db_path = db_path
+        self.data_dir = data_dir
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        self.cache = TableCache(signature=self._cache_signature, loader=self._load)
+        self.reads = 0
+        self.writes = 0
+
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS _meta ("
+                "file_key TEXT PRIMARY KEY, fieldnames TEXT NOT NULL, version INTEGER NOT NULL)"
+            )
+
+    def _conn(self):
+        """每个线程使用自己的连接"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _quote(name):
+        return '"' + name.replace('"', '""') + '"'
+
+    def file_key(self, filename):
+        """
+        文件名 -> 表格的键（相对数据根目录的路径，去掉 .csv）
+        data/patients.csv -> patients，data/archive/patients.csv -> archive/patients
+        数据根目录下的文件与以前只取文件名时的键相同，已有的数据库不需要迁移
+        """
+        key = os.path.relpath(filename, self.data_dir).replace(os.sep, '/')
+        return key[:-4] if key.endswith('.csv') else key
+
+    def _locate(self, filename):
+        """
+        文件名 -> (file_key, 表名, 日期)
+        普通文件的日期为None
+        """
+        key = self.file_key(filename)
+        match = DATED_FILE_PATTERN.match(key)
+        if match:
+            return key, DATED_TABLES[match.group(1)], match.group(2)
+        # 子目录中的表用 __ 连接目录名，避免和根目录下的同名表冲突
+        return key, '__'.join(re.sub(r'\W', '_', part) for part in key.split('/')), None
+
+    def _meta(self, file_key):
+        row = self._conn().execute(
+            "SELECT fieldnames, version FROM _meta WHERE file_key = ?", (file_key,)
+        ).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0]), row[1]
+
+    def _table_columns(self, table):
+        return [r[1] for r in self._conn().execute(f"PRAGMA table_info({self._quote(table)})")]
+
+    def _ensure_table(self, conn, table, fieldnames, dated):
+        """建表或补齐缺少的列，并为索引列建立索引"""
+        columns = (['date'] if dated else []) + [f for f in fieldnames if not (dated and f == 'date')]
+        existing = self._table_columns(table)
+        if not existing:
+            column_sql = ', '.join(f"{self._quote(c)} TEXT" for c in columns)
+            conn.execute(f"CREATE TABLE {self._quote(table)} (_seq INTEGER, {column_sql})")
+            existing = ['_seq'] + columns
+        else:
+            for column in columns:
+                if column not in existing:
+                    conn.execute(f"ALTER TABLE {self._quote(table)} ADD COLUMN {self._quote(column)} TEXT")
+                    existing.append(column)
+
+        for column in INDEXED_COLUMNS:
+            if column in existing:
+                conn.execute(
+                    f"CREATE INDEX IF NOT EXISTS {self._quote(f'idx_{table}_{column}')} "
+                    f"ON {self._quote(table)} ({self._quote(column)})"
+                )
+
+    def _cache_signature(self, filename):
+        version = self.signature(filename)
+        if version is None:
+            raise FileNotFoundError(filename)
+        return version
+
+    def _load(self, filename):
+        self.reads += 1
+        return self._select(filename, {})
+
+    def _select(self, filename, conditions):
+        file_key, table, date = self._locate(filename)
+        meta = self._meta(file_key)
+        if meta is None:
+            raise FileNotFoundError(filename)
+        fieldnames = meta[0]
+        where = []
+        params = []
+        if date is not None:
+            where.append('"date" = ?')
+            params.append(date)
+        for column, value in conditions.items():
+            if column not in fieldnames:
+                return ()
+            where.append(f"{self._quote(column)} = ?")
+            params.append(value)
+        column_sql = ', '.join(self._quote(f) for f in fieldnames)
+        sql = f"SELECT {column_sql} FROM {self._quote(table)}"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY _seq"
+        cursor = self._conn().execute(sql, params)
+        return tuple(FrozenRow(zip(fieldnames, (v if v is not None else '' for v in r))) for r in cursor)
+
+    def read_rows(self, filename):
+        """读取表格，返回 FrozenRow 组成的元组（只读）"""
+        return self.cache.get(filename)
+
+    def query_rows(self, filename, **conditions):
+        """按列的值精确筛选，直接走索引查询"""
+        return self._select(filename, conditions)
+
+    def write_rows(self, filename, data, fieldnames):
+        """整表替换（每日表只替换对应日期的行）"""
+        file_key, table, date = self._locate(filename)
+        fieldnames = list(fieldnames)
+        with self._write_lock:
+            conn = self._conn()
+            try:
+                with conn:
+                    self._ensure_table(conn, table, fieldnames, date is not None)
+                    if date is not None:
+                        conn.execute(f"DELETE FROM {self._quote(table)} WHERE \"date\" = ?", (date,))
+                    else:
+                        conn.execute(f"DELETE FROM {self._quote(table)}")
+
+                    columns = [f for f in fieldnames if not (date is not None and f == 'date')]
+                    insert_columns = ['_seq'] + (['date'] if date is not None else []) + columns
+                    placeholders = ', '.join('?' for _ in insert_columns)
+                    sql = (f"INSERT INTO {self._quote(table)} "
+                           f"({', '.join(self._quote(c) for c in insert_columns)}) VALUES ({placeholders})")
+                    prefix = [date] if date is not None else []
+                    conn.executemany(sql, (
+                        [seq] + prefix + ['' if row.get(c) is None else str(row.get(c)) for c in columns]
+                        for seq, row in enumerate(data)
+                    ))
+                    conn.execute(
+                        "INSERT INTO _meta (file_key, fieldnames, version) VALUES (?, ?, 1) "
+                        "ON CONFLICT(file_key) DO UPDATE SET fieldnames = excluded.fieldnames, "
+                        "version = version + 1",
+                        (file_key, json.dumps(fieldnames, ensure_ascii=False))
+                    )
+                self.writes += 1
+            finally:
+                self.cache.invalidate(filename)
+
+    def remove(self, filename):
+        """删除表格（每日表只删除对应日期的行，不存在时忽略）"""
+        file_key, table, date = self._locate(filename)
+        with self._write_lock:
+            conn = self._conn()
+            try:
+                with conn:
+                    if self._table_columns(table):
+                        if date is not None:
+                            conn.execute(f"DELETE FROM {self._quote(table)} WHERE \"date\" = ?", (date,))
+                        else:
+                            conn.execute(f"DELETE FROM {self._quote(table)}")
+                    conn.execute("DELETE FROM _meta WHERE file_key = ?", (file_key,))
+                self.writes += 1
+            finally:
+                self.cache.invalidate(filename)
+
+    def exists(self, filename):
+        return self._meta(self.file_key(filename)) is not None
+
+    def signature(self, filename):
+        """表格的版本号（每次写入加1），表格不存在时返回None"""
+        meta = self._meta(self.file_key(filename))
+        return None if meta is None else meta[1]
+
+    def fieldnames(self, filename):
+        """表格的字段名列表，表格不存在时返回None"""
+        meta = self._meta(self.file_key(filename))
+        return None if meta is None else meta[0]
+
+    def modified_time_us(self, filename):
+        """数据库中没有记录写入时间，返回None（版本号由版本跟踪器按观察时间生成）"""
+        return None
+
+    def list_files(self, data_dir=None):
+        """
+        数据库中 data_dir 目录下（不含子目录）所有表格对应的文件名，与CSV后端一样不含目录
+        Args:
+            data_dir: 目录，默认数据根目录
+        """
+        prefix = self.file_key(os.path.join(data_dir or self.data_dir, '_'))[:-1]
+        files = []
+        for (key,) in self._conn().execute("SELECT file_key FROM _meta ORDER BY file_key"):
+            if key.startswith(prefix) and '/' not in key[len(prefix):]:
+                files.append(key[len(prefix):] + '.csv')
+        return files
+
+    def stats(self):
+        stats = self.cache.stats()
+        stats.update(reads=self.reads, writes=self.writes)
+        return stats
+
+
+def load_storage_config(config_file='config.json'):
+    """读取存储配置，配置文件不存在时使用CSV后端"""
+    config = {'storage_backend': 'csv', 'sqlite_path': 'data/ez_dose.db', 'data_dir': 'data'}
+    try:
+        if os.path.exists(config_file):
+            with open(config_file, 'r', encoding='utf-8') as f:
+                config.update(json.load(f))
+    except Exception as e:
+        log.error("读取存储配置失败，使用CSV后端: %s", e)
+    return config
+
+
+def create_backend(config):
+    """根据配置创建存储后端"""
+    if config.get('storage_backend') == 'sqlite':
+        return SqliteBackend(config.get('sqlite_path', 'data/ez_dose.db'), config.get('data_dir', 'data'))
+    return CsvBackend()
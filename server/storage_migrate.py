@@ -0,0 +1,86 @@
+"""
+CSV <-> SQLite 数据迁移工具
+
+用法（在 server 目录下运行）:
+    python storage_migrate.py import [--data-dir data] [--db data/ez_dose.db]
+        把 data/ 目录下所有CSV文件（包括每天的 tasks_<date>.csv、schedules_<date>.csv）导入SQLite
+    python storage_migrate.py export [--data-dir data] [--db data/ez_dose.db]
+        从SQLite重新生成所有CSV文件
+
+导入完成后把 config.json 中的 storage_backend 改为 "sqlite" 并重启服务器即可。
+"""
+
+import argparse
+import csv
+import os
+
+from storage import CsvBackend, SqliteBackend
+
+
+def import_csv_to_sqlite(data_dir, db_path):
+    """
+    导入 data_dir 下的所有CSV文件
+    Returns:
+        imported: {文件名: 行数}
+    """
+    csv_backend = CsvBackend()
+    sqlite_backend = SqliteBackend(db_path, data_dir)
+    imported = {}
+
+    for filename in sorted(os.listdir(data_dir)):
+        if not filename.endswith('.csv'):
+            continue
+        path = os.path.join(data_dir, filename)
+        rows = csv_backend.read_rows(path)
+        # 只有表头的文件也要保留字段名
+        with open(path, 'r', encoding='utf-8-sig', newline='') as f:
+            fieldnames = [name.strip() for name in next(csv.reader(f), [])]
+        if not fieldnames and rows:
+            fieldnames = list(rows[0].keys())
+
+        sqlite_backend.write_rows(path, rows, fieldnames)
+        imported[filename] = len(rows)
+        print(f"已导入 {filename}: {len(rows)} 行")
+
+    return imported
+
+
+def export_sqlite_to_csv(data_dir, db_path):
+    """
+    从SQLite导出所有表格为CSV文件
+    Returns:
+        exported: {文件名: 行数}
+    """
+    csv_backend = CsvBackend()
+    sqlite_backend = SqliteBackend(db_path, data_dir)
+    exported = {}
+    os.makedirs(data_dir, exist_ok=True)
+
+    for filename in sqlite_backend.list_files():
+        path = os.path.join(data_dir, filename)
+        fieldnames = sqlite_backend.fieldnames(path)
+        rows = sqlite_backend.read_rows(path)
+        csv_backend.write_rows(path, rows, fieldnames)
+        exported[filename] = len(rows)
+        print(f"已导出 {filename}: {len(rows)} 行")
+
+    return exported
+
+
+def main():
+    parser = argparse.ArgumentParser(description='EZ-Dose CSV <-> SQLite 数据迁移工具')
+    parser.add_argument('command', choices=['import', 'export'])
+    parser.add_argument('--data-dir', default='data', help='CSV数据目录')
+    parser.add_argument('--db', default='data/ez_dose.db', help='SQLite数据库路径')
+    args = parser.parse_args()
+
+    if args.command == 'import':
+        result = import_csv_to_sqlite(args.data_dir, args.db)
+        print(f"导入完成，共 {len(result)} 个文件")
+    else:
+        result = export_sqlite_to_csv(args.data_dir, args.db)
+        print(f"导出完成，共 {len(result)} 个文件")
+
+
+if __name__ == '__main__':
+    main()
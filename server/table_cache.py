@@ -0,0 +1,139 @@
+"""
+CSV 表格缓存
+
+所有路由都通过 read_csv_file / read_csv_safe 读取 data/ 目录下的 CSV，
+每次请求都重新解析整张表。这里按文件路径缓存解析结果：
+- 文件的 mtime/size/inode 不变时直接返回缓存的快照（不再解析）
+- 文件被外部修改（mtime/size/inode 变化）时自动重新加载
+- 服务器自己写文件后调用 invalidate() 立即失效
+缓存的每一行都是只读的 FrozenRow，需要修改时先 dict(row) 复制一份。
+"""
+
+import csv
+import os
+import threading
+
+
+class FrozenRow(dict):
+    """只读的CSV行，防止某个路由修改了共享缓存中的数据"""
+
+    def _readonly(self, *args, **kwargs):
+        raise TypeError("缓存中的CSV行是只读的，请先 dict(row) 复制后再修改")
+
+    __setitem__ = _readonly
+    __delitem__ = _readonly
+    clear = _readonly
+    pop = _readonly
+    popitem = _readonly
+    setdefault = _readonly
+    update = _readonly
+
+    def __reduce__(self):
+        return (dict, (dict(self),))
+
+
+class TableCache:
+    def __init__(self, signature=None, loader=None):
+        """
+        初始化表格缓存
+        缓存项格式: {绝对路径: (签名, rows)}
+        Args:
+            signature: 计算文件签名的函数，文件不存在时抛出 FileNotFoundError，
+                       默认使用文件的 (mtime_ns, size, inode)
+            loader: 加载表格的函数，返回 FrozenRow 元组，默认解析CSV文件
+        """
+        self._signature = signature or self._file_signature
+        self._loader = loader or self._parse
+        self._entries = {}
+        self._lock = threading.Lock()
+
+        # 统计计数器
+        self.hits = 0      # 命中缓存，没有读磁盘
+        self.misses = 0    # 第一次读取该文件
+        self.reloads = 0   # 文件发生变化后重新加载
+
+    @staticmethod
+    def _key(filename):
+        return os.path.abspath(filename)
+
+    @staticmethod
+    def _file_signature(filename):
+        # 文件不存在时 os.stat 会抛出 FileNotFoundError
+        stat = os.stat(filename)
+        return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+    @staticmethod
+    def _parse(filename):
+        """
+        解析CSV文件
+        Args:
+            filename: CSV文件路径
+        Returns:
+            rows: FrozenRow 组成的元组
+        """
+        rows = []
+        with open(filename, mode='r', encoding='utf-8-sig', newline='') as csvfile:
+            reader = csv.DictReader(csvfile)
+            for row in reader:
+                # 清理字段名，去除可能的空白和BOM字符
+                rows.append(FrozenRow(
+                    (key.strip().replace('\ufeff', '') if key else key, value)
+                    for key, value in row.items()
+                ))
+        return tuple(rows)
+
+    def get(self, filename):
+        """
+        获取CSV文件的只读快照
+        Args:
+            filename: CSV文件路径
+        Returns:
+            rows: FrozenRow 组成的元组
+        Raises:
+            FileNotFoundError: 文件不存在
+        """
+        key = self._key(filename)
+        signature = self._signature(key)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == signature:
+                self.hits += 1
+                return entry[1]
+
+        rows = self._loader(key)
+
+        with self._lock:
+            if key in self._entries:
+                self.reloads += 1
+            else:
+                self.misses += 1
+            self._entries[key] = (signature, rows)
+        return rows
+
+    def invalidate(self, filename=None):
+        """
+        使缓存失效
+        Args:
+            filename: 要失效的文件路径，为None时清空全部缓存
+        """
+        with self._lock:
+            if filename is None:
+                self._entries.clear()
+            else:
+                entry = self._entries.get(self._key(filename))
+                if entry is not None:
+                    # 保留条目但清掉签名，下一次读取记为 reload
+                    self._entries[self._key(filename)] = (None, entry[1])
+
+    def stats(self):
+        """返回缓存统计信息"""
+        with self._lock:
+            total = self.hits + self.misses + self.reloads
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'reloads': self.reloads,
+                'hit_ratio': self.hits / total if total else 0.0,
+                'cached_files': len(self._entries),
+            }
@@ -0,0 +1,369 @@
+"""
+历史任务归档
+
+每天都会在 data/ 下留下一个 tasks_<date>.csv，查看一段时间的服药情况要打开几百个文件。
+这里把已经结束的日期按月归档为压缩的列式文件 data/archive/tasks_<YYYY-MM>.npz：
+- 每列单独保存：日期（当月第几天）以及 patientId、timeSlotName、status、completionTime、remark
+  五个字符串列，字符串列字典编码（不重复的值 + 每行的编号），再整体压缩，一年的记录只有十几个文件
+- 按日期范围和患者统计服药完成率时，只加载涉及的月份，在编号数组上用 numpy 计数，不逐行解析
+- 已加载的月份按文件签名缓存，其它进程重写归档后自动重新加载
+- 写入时先写临时文件再替换，并持有该月的跨进程锁
+"""
+
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from datetime import date, timedelta
+
+import numpy as np
+
+from app_logging import get_logger
+from process_lock import InterProcessLock, lock_path
+
+log = get_logger(__name__)
+
+STRING_COLUMNS = ('patientId', 'timeSlotName', 'status', 'completionTime', 'remark')
+COMPLETED_STATUS = '已服药'
+
+# 统计时可以分组的列
+GROUP_FIELDS = ('patientId', 'timeSlotName')
+
+
+def _encode(values):
+    """字符串数组 -> (不重复的值（已排序）, 每行的编号)"""
+    values = np.asarray(values, dtype=str)
+    if values.size == 0:
+        return np.array([], dtype=str), np.array([], dtype=np.int32)
+    unique, codes = np.unique(values, return_inverse=True)
+    return unique, codes.astype(np.int32)
+
+
+def _month_of(date_str):
+    return date_str[:7]
+
+
+class MonthBlock:
+    def __init__(self, days, columns):
+        """
+        一个月（或若干天）的列式任务数据
+        Args:
+            days: 每行是当月第几天（int8 数组），行按日期、再按原文件中的顺序排列
+            columns: {列名: (不重复的值, 每行的编号)}
+        """
+        self.days = days
+        self.columns = columns
+
+    def __len__(self):
+        return len(self.days)
+
+    @classmethod
+    def from_tasks(cls, tasks_by_date):
+        """由 {日期: 任务字典列表} 生成"""
+        days = []
+        raw = {column: [] for column in STRING_COLUMNS}
+        for date_str in sorted(tasks_by_date):
+            day = int(date_str[8:10])
+            for task in tasks_by_date[date_str]:
+                days.append(day)
+                for column in STRING_COLUMNS:
+                    raw[column].append(task.get(column) or '')
+        return cls(np.array(days, dtype=np.int8), {column: _encode(raw[column]) for column in STRING_COLUMNS})
+
+    def decoded(self, column):
+        values, codes = self.columns[column]
+        return values[codes]
+
+    def without_days(self, day_numbers):
+        """去掉某几天的行（归档重新归档的日期时替换旧数据）"""
+        keep = ~np.isin(self.days, list(day_numbers))
+        return MonthBlock(self.days[keep], {column: _encode(self.decoded(column)[keep]) for column in STRING_COLUMNS})
+
+    def without_patient(self, patient_id):
+        values, codes = self.columns['patientId']
+        matches = np.nonzero(values == patient_id)[0]
+        if not len(matches):
+            return self, 0
+        keep = codes != matches[0]
+        removed = int(len(keep) - keep.sum())
+        return MonthBlock(self.days[keep], {column: _encode(self.decoded(column)[keep])
+                                            for column in STRING_COLUMNS}), removed
+
+    @staticmethod
+    def concat(blocks):
+        blocks = [block for block in blocks if len(block)]
+        if not blocks:
+            return MonthBlock(np.array([], dtype=np.int8), {column: _encode([]) for column in STRING_COLUMNS})
+        days = np.concatenate([block.days for block in blocks])
+        # 合并后按日期稳定排序，同一天保持原来的顺序
+        order = np.argsort(days, kind='stable')
+        return MonthBlock(days[order], {column: _encode(np.concatenate([block.decoded(column) for block in blocks])[order])
+                                        for column in STRING_COLUMNS})
+
+    def day_numbers(self):
+        return sorted(int(d) for d in np.unique(self.days))
+
+    def rows_for_day(self, day):
+        """某一天的任务字典列表（与原CSV的行顺序相同）"""
+        selected = np.nonzero(self.days == day)[0]
+        decoded = {column: self.columns[column][0][self.columns[column][1][selected]].tolist()
+                   for column in STRING_COLUMNS}
+        return [{column: decoded[column][i] for column in STRING_COLUMNS} for i in range(len(selected))]
+
+    def code_of(self, column, value):
+        """某个值在字典中的编号，不存在时返回None"""
+        values = self.columns[column][0]
+        position = int(np.searchsorted(values, value))
+        if position < len(values) and values[position] == value:
+            return position
+        return None
+
+    def count(self, first_day=1, last_day=31, patient_id=None, group_by=()):
+        """
+        统计任务数和已服药数
+        Args:
+            first_day / last_day: 当月的日期范围（包含两端）
+            patient_id: 只统计这个患者
+            group_by: 分组的列（GROUP_FIELDS 的子集）
+        Returns:
+            {分组值元组: [任务数, 已服药数]}，不分组时键为 ()
+        """
+        mask = (self.days >= first_day) & (self.days <= last_day)
+        if patient_id is not None:
+            code = self.code_of('patientId', patient_id)
+            if code is None:
+                return {}
+            mask &= self.columns['patientId'][1] == code
+        completed_code = self.code_of('status', COMPLETED_STATUS)
+        completed = (self.columns['status'][1] == completed_code) if completed_code is not None \
+            else np.zeros(len(self.days), dtype=bool)
+
+        # 把各分组列的编号组合成一个整数，再一次计数
+        key = np.zeros(len(self.days), dtype=np.int64)
+        sizes = []
+        for column in group_by:
+            values, codes = self.columns[column]
+            key = key * max(len(values), 1) + codes
+            sizes.append(max(len(values), 1))
+        keys, inverse, totals = np.unique(key[mask], return_inverse=True, return_counts=True)
+        done = np.bincount(inverse, weights=completed[mask], minlength=len(keys)) if len(keys) else []
+
+        result = {}
+        for combined, total, finished in zip(keys.tolist(), totals.tolist(), list(done)):
+            group = []
+            for column, size in zip(reversed(group_by), reversed(sizes)):
+                combined, code = divmod(combined, size)
+                group.append(str(self.columns[column][0][code]))
+            result[tuple(reversed(group))] = [total, int(finished)]
+        return result
+
+    def save(self, filename):
+        arrays = {'days': self.days}
+        for column, (values, codes) in self.columns.items():
+            arrays[f'{column}_values'] = values
+            arrays[f'{column}_codes'] = codes
+        np.savez_compressed(filename, **arrays)
+
+    @classmethod
+    def load(cls, filename):
+        with np.load(filename, allow_pickle=False) as data:
+            return cls(data['days'], {column: (data[f'{column}_values'], data[f'{column}_codes'])
+                                      for column in STRING_COLUMNS})
+
+
+class TaskArchive:
+    def __init__(self, archive_dir, cache_months=24, lock_dir=None):
+        """
+        初始化任务归档
+        Args:
+            archive_dir: 归档目录
+            cache_months: 最多缓存多少个月的数据
+            lock_dir: 月份锁文件的目录，默认使用 process_lock 的默认目录
+        """
+        self.archive_dir = archive_dir
+        self.cache_months = cache_months
+        self.lock_dir = lock_dir
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()  # 月份 -> (签名, MonthBlock)
+        self.loads = 0
+
+    def month_filename(self, month):
+        return os.path.join(self.archive_dir, f"tasks_{month}.npz")
+
+    def _month_lock(self, month):
+        return InterProcessLock(lock_path(f"archive_{month}", self.lock_dir))
+
+    @staticmethod
+    def _file_signature(filename):
+        try:
+            stat = os.stat(filename)
+            return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+        except FileNotFoundError:
+            return None
+
+    def signature(self, date_str):
+        """某天所在月份归档文件的签名（没有归档时为None）"""
+        return self._file_signature(self.month_filename(_month_of(date_str)))
+
+    def months(self):
+        """所有已归档的月份（YYYY-MM，升序）"""
+        if not os.path.isdir(self.archive_dir):
+            return []
+        return sorted(f[len('tasks_'):-len('.npz')] for f in os.listdir(self.archive_dir)
+                      if f.startswith('tasks_') and f.endswith('.npz'))
+
+    def _load(self, month):
+        """加载某个月的归档（按签名缓存），没有归档时返回None"""
+        filename = self.month_filename(month)
+        signature = self._file_signature(filename)
+        if signature is None:
+            return None
+        with self._lock:
+            cached = self._cache.get(month)
+            if cached is not None and cached[0] == signature:
+                self._cache.move_to_end(month)
+                return cached[1]
+        block = MonthBlock.load(filename)
+        with self._lock:
+            self.loads += 1
+            self._cache[month] = (signature, block)
+            self._cache.move_to_end(month)
+            while len(self._cache) > self.cache_months:
+                self._cache.popitem(last=False)
+        return block
+
+    def _save(self, month, block):
+        """原子地写入某个月的归档（调用方必须持有该月的锁）"""
+        os.makedirs(self.archive_dir, exist_ok=True)
+        filename = self.month_filename(month)
+        if not len(block):
+            if os.path.exists(filename):
+                os.remove(filename)
+            return
+        fd, tmp_filename = tempfile.mkstemp(dir=self.archive_dir, prefix=f'.tasks_{month}.', suffix='.npz')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                block.save(f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_filename, filename)
+        except BaseException:
+            if os.path.exists(tmp_filename):
+                os.remove(tmp_filename)
+            raise
+
+    def add_days(self, tasks_by_date):
+        """
+        归档若干天的任务（同一天已经归档过时替换）
+        Args:
+            tasks_by_date: {日期: 任务字典列表}
+        """
+        by_month = {}
+        for date_str, tasks in tasks_by_date.items():
+            by_month.setdefault(_month_of(date_str), {})[date_str] = tasks
+        for month, month_tasks in sorted(by_month.items()):
+            with self._month_lock(month):
+                new_block = MonthBlock.from_tasks(month_tasks)
+                existing = self._load(month)
+                if existing is not None:
+                    existing = existing.without_days(int(d[8:10]) for d in month_tasks)
+                self._save(month, MonthBlock.concat([existing, new_block] if existing is not None else [new_block]))
+            log.info("已归档 %s 的 %d 天任务", month, len(month_tasks))
+
+    def has_day(self, date_str):
+        block = self._load(_month_of(date_str))
+        return block is not None and bool(np.any(block.days == int(date_str[8:10])))
+
+    def read_day(self, date_str):
+        """
+        读取某一天归档的任务
+        Returns:
+            任务字典列表，这一天没有归档时返回None
+        """
+        block = self._load(_month_of(date_str))
+        if block is None:
+            return None
+        day = int(date_str[8:10])
+        if not np.any(block.days == day):
+            return None
+        return block.rows_for_day(day)
+
+    def archived_dates(self):
+        """所有已归档的日期"""
+        dates = []
+        for month in self.months():
+            block = self._load(month)
+            if block is not None:
+                dates.extend(f"{month}-{day:02d}" for day in block.day_numbers())
+        return dates
+
+    def remove_patient(self, patient_id):
+        """
+        从所有归档中删除某个患者的任务（删除患者时级联调用）
+        Returns:
+            removed: 删除的任务数
+        """
+        removed = 0
+        for month in self.months():
+            with self._month_lock(month):
+                block = self._load(month)
+                if block is None:
+                    continue
+                remaining, count = block.without_patient(str(patient_id))
+                if count:
+                    self._save(month, remaining)
+                    removed += count
+        return removed
+
+    def count(self, date_from, date_to, patient_id=None, group_by=()):
+        """
+        统计日期范围内已归档的任务
+        Args:
+            date_from / date_to: 日期范围（date，包含两端）
+            patient_id: 只统计这个患者
+            group_by: 分组的列
+        Returns:
+            counts: {分组值元组: [任务数, 已服药数]}
+            dates: 范围内有归档数据的日期集合
+        """
+        counts = {}
+        dates = set()
+        month_start = date_from.replace(day=1)
+        while month_start <= date_to:
+            month = month_start.strftime('%Y-%m')
+            next_month = (month_start + timedelta(days=32)).replace(day=1)
+            block = self._load(month)
+            if block is not None:
+                first_day = date_from.day if month_start <= date_from else 1
+                last_day = date_to.day if date_to < next_month else 31
+                merge_counts(counts, block.count(first_day, last_day, patient_id, group_by))
+                dates.update(f"{month}-{day:02d}" for day in block.day_numbers() if first_day <= day <= last_day)
+            month_start = next_month
+        return counts, dates
+
+    def stats(self):
+        with self._lock:
+            return {'months': len(self.months()), 'cached_months': len(self._cache), 'loads': self.loads}
+
+
+def merge_counts(target, counts):
+    """把 {分组: [任务数, 已服药数]} 累加到 target"""
+    for group, (total, completed) in counts.items():
+        entry = target.setdefault(group, [0, 0])
+        entry[0] += total
+        entry[1] += completed
+    return target
+
+
+def count_tasks(tasks_by_date, patient_id=None, group_by=()):
+    """统计尚未归档的每日任务（与归档使用相同的计数方式）"""
+    block = MonthBlock.from_tasks(tasks_by_date)
+    return block.count(1, 31, patient_id, group_by) if len(block) else {}
+
+
+def parse_date(value):
+    """YYYY-MM-DD -> date，格式错误时返回None"""
+    try:
+        return date.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None
@@ -0,0 +1,139 @@
+"""
+任务变化通知
+
+护工手机以前只能不停地重新请求 /tasks 才能看到同事修改的任务状态。
+这里为每个日期维护一个“代数”（generation），任务发生变化时加1并唤醒等待这一天的所有连接：
+- 同一进程内的修改（PUT /task、PUT /tasks）由路由直接调用 notify，等待者立即被唤醒
+- 其它 worker 进程的修改：后台线程定期检查有人等待的日期的任务文件签名（CSV签名+日志长度），
+  变化时唤醒（只需要 stat，不读取文件）
+等待者被唤醒后自己去读取增量并判断是否和自己有关，所以通知本身不需要携带数据。
+
+用 gevent worker 运行时（见 gunicorn.conf.py），threading 被替换为协程，
+每个等待中的连接只占用一个协程，而不是一个线程。
+"""
+
+import threading
+import time
+
+from app_logging import get_logger
+
+log = get_logger(__name__)
+
+
+class _Channel:
+    def __init__(self, lock):
+        self.cond = threading.Condition(lock)
+        self.generation = 0
+        self.waiters = 0
+        self.signature = None
+
+
+class TaskNotifier:
+    def __init__(self, disk_signature, poll_interval=1.0):
+        """
+        初始化通知器
+        Args:
+            disk_signature: 计算某天任务数据在磁盘上签名的函数 (date_str) -> 签名，用于发现其它进程的修改
+            poll_interval: 检查其它进程修改的间隔秒数
+        """
+        self.disk_signature = disk_signature
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        self._channels = {}
+        self._poller = None
+        self.notifications = 0
+        self.wakeups = 0
+
+    def _channel(self, date_str):
+        """获取（必要时创建）某天的通道（调用方必须持有 self._lock）"""
+        channel = self._channels.get(date_str)
+        if channel is None:
+            channel = self._channels[date_str] = _Channel(self._lock)
+        return channel
+
+    def generation(self, date_str):
+        """某天当前的代数：先记下代数再读取数据，之后用它等待，不会错过两者之间发生的变化"""
+        with self._lock:
+            channel = self._channel(date_str)
+            if channel.signature is not None:
+                return channel.generation
+        # 第一次关注这一天：记下读取数据之前的签名，之后的变化才算数
+        signature = self.disk_signature(date_str)
+        with self._lock:
+            channel = self._channel(date_str)
+            if channel.signature is None:
+                channel.signature = signature
+            return channel.generation
+
+    def notify(self, date_str):
+        """某天的任务发生了变化，唤醒所有等待者"""
+        signature = self.disk_signature(date_str)
+        with self._lock:
+            channel = self._channel(date_str)
+            # 同时记下新的签名，后台线程不会因为同一次修改再唤醒一遍
+            channel.signature = signature
+            channel.generation += 1
+            self.notifications += 1
+            channel.cond.notify_all()
+
+    def wait(self, date_str, generation, timeout):
+        """
+        等待某天的任务发生变化
+        Args:
+            date_str: 日期
+            generation: 调用 generation() 得到的代数
+            timeout: 最长等待秒数
+        Returns:
+            bool: 是否发生了变化（False 表示超时）
+        """
+        self._ensure_poller()
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            channel = self._channel(date_str)
+            channel.waiters += 1
+            try:
+                while channel.generation == generation:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return False
+                    channel.cond.wait(remaining)
+                self.wakeups += 1
+                return True
+            finally:
+                channel.waiters -= 1
+
+    def _ensure_poller(self):
+        with self._lock:
+            if self._poller is None:
+                self._poller = threading.Thread(target=self._poll_loop, name='task-notifier', daemon=True)
+                self._poller.start()
+
+    def _poll_loop(self):
+        while True:
+            time.sleep(self.poll_interval)
+            with self._lock:
+                dates = [date_str for date_str, channel in self._channels.items() if channel.waiters]
+            for date_str in dates:
+                try:
+                    signature = self.disk_signature(date_str)
+                except Exception as e:
+                    log.error("检查 %s 的任务文件失败: %s", date_str, e)
+                    continue
+                with self._lock:
+                    channel = self._channel(date_str)
+                    if signature != channel.signature:
+                        channel.signature = signature
+                        channel.generation += 1
+                        self.notifications += 1
+                        channel.cond.notify_all()
+
+    def stats(self):
+        """等待中的连接数等统计信息"""
+        with self._lock:
+            waiting = {date_str: channel.waiters for date_str, channel in self._channels.items() if channel.waiters}
+            return {
+                'waiters': sum(waiting.values()),
+                'waiting_by_date': waiting,
+                'notifications': self.notifications,
+                'wakeups': self.wakeups,
+            }
@@ -0,0 +1,507 @@
+"""
+每日任务存储
+
+PUT /task 以前每次都读整个 tasks_<date>.csv、线性查找、再整表写回。
+这里把每天的任务常驻内存：
+- 以 (patientId, timeSlotName) 为主键建立索引，更新为 O(1)
+- 每次修改先追加写入 tasks_<date>.journal（一行一个JSON），不重写CSV
+- 日志累积到一定条数（或定时任务调用 compact_all）时再合并写回CSV
+- 每个日期一把锁，不同日期的更新互不阻塞，同一日期的更新不会丢失
+- 内存中最多保留 cache_days 天（最近使用的），今天的任务不会被移出
+- 多进程部署时每个 worker 都有自己的内存副本：日期锁是跨进程锁，
+  读取前检查CSV签名和日志长度，其它进程追加的日志只重放新增的部分
+"""
+
+import json
+import os
+import threading
+from collections import OrderedDict
+from contextlib import ExitStack
+from datetime import date
+
+from app_logging import get_logger
+from process_lock import InterProcessLock, lock_path
+
+log = get_logger(__name__)
+
+TASK_FIELDNAMES = ['patientId', 'timeSlotName', 'status', 'completionTime', 'remark']
+
+
+class DayTasks:
+    def __init__(self, date_str, lock, version=0):
+        """
+        某一天的任务表
+        Args:
+            date_str: 日期字符串 YYYY-MM-DD
+            lock: 这一天的跨进程锁
+            version: 初始版本号
+        """
+        self.date_str = date_str
+        self.lock = lock
+        self.rows = []            # 保持CSV中的原始顺序
+        self.index = {}           # (patientId, timeSlotName) -> row
+        self.pending = 0          # 日志中尚未合并到CSV的修改条数
+        self.signature = None     # 最近一次加载/合并后CSV的签名
+        self.journal_offset = 0   # 已经应用到内存的日志字节数
+        self.version = version    # 内存中任务每次变化（加载、创建、更新）加1
+        self.changed_at = 0       # 最近一次变化的时间（微秒，取CSV和日志的修改时间，各进程一致）
+
+    def rebuild_index(self):
+        self.index = {(row.get('patientId'), row.get('timeSlotName')): row for row in self.rows}
+
+
+class TaskStore:
+    def __init__(self, read_csv, write_csv, signature=None, data_dir='data', compact_threshold=50, lock_dir=None,
+                 remove_csv=None, cache_days=31):
+        """
+        初始化任务存储
+        Args:
+            read_csv: 读取CSV的函数，返回可修改的字典列表
+            write_csv: 写入CSV的函数 (filename, data, fieldnames)，写入失败时必须抛出异常，
+                       否则合并时会在CSV没有写成功的情况下删除日志
+            signature: 计算任务表版本签名的函数，表不存在时返回None，默认使用文件的 (mtime_ns, size, inode)
+            data_dir: 数据目录
+            compact_threshold: 日志累积多少条修改后自动合并回CSV
+            lock_dir: 日期锁文件的目录，默认 <data_dir>/.locks
+            remove_csv: 删除CSV的函数 (filename)，归档后删除每日任务文件，默认直接删除文件
+            cache_days: 内存中最多保留多少天的任务
+        """
+        self.read_csv = read_csv
+        self.write_csv = write_csv
+        self.remove_csv = remove_csv or self._remove_file
+        self._signature = signature or self._file_signature
+        self.data_dir = data_dir
+        self.compact_threshold = compact_threshold
+        self.lock_dir = lock_dir or os.path.join(data_dir, '.locks')
+
+        self.cache_days = cache_days
+        self._days = OrderedDict()  # 日期 -> DayTasks，最近使用的在最后
+        self._days_lock = threading.Lock()
+        # 被移出的日期中最大的版本号，重新加载的日期从这里继续，版本号不会倒退
+        self._version_floor = 0
+
+    def task_filename(self, date_str):
+        return os.path.join(self.data_dir, f"tasks_{date_str}.csv")
+
+    def journal_filename(self, date_str):
+        return os.path.join(self.data_dir, f"tasks_{date_str}.journal")
+
+    @staticmethod
+    def _file_signature(filename):
+        try:
+            stat = os.stat(filename)
+            return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+        except FileNotFoundError:
+            return None
+
+    @staticmethod
+    def _remove_file(filename):
+        try:
+            os.remove(filename)
+        except FileNotFoundError:
+            pass
+
+    def _get_day(self, date_str):
+        """获取（必要时创建）某一天的任务表对象，只负责取对象，不加载数据"""
+        with self._days_lock:
+            day = self._days.get(date_str)
+            if day is None:
+                day = DayTasks(date_str, InterProcessLock(lock_path(f"tasks_{date_str}", self.lock_dir)),
+                               self._version_floor)
+                self._days[date_str] = day
+                self._evict_days()
+            else:
+                self._days.move_to_end(date_str)
+            return day
+
+    def _evict_days(self):
+        """
+        超过 cache_days 时移出最久没有使用的日期（调用方必须持有 _days_lock）
+        今天和正在被使用（锁被持有）的日期不移出；未合并的修改都在日志中，再次使用时会重放
+        """
+        excess = len(self._days) - self.cache_days
+        if excess <= 0:
+            return
+        today = date.today().strftime('%Y-%m-%d')
+        for date_str, day in list(self._days.items())[:-1]:
+            if excess <= 0:
+                break
+            if date_str == today or day.lock.locked():
+                continue
+            del self._days[date_str]
+            self._version_floor = max(self._version_floor, day.version)
+            excess -= 1
+
+    @staticmethod
+    def _mtime_us(filename):
+        try:
+            return os.stat(filename).st_mtime_ns // 1000
+        except FileNotFoundError:
+            return 0
+
+    def _journal_size(self, day):
+        try:
+            return os.path.getsize(self.journal_filename(day.date_str))
+        except FileNotFoundError:
+            return 0
+
+    def _ensure_loaded(self, day):
+        """
+        确保内存中的数据是最新的（调用方必须持有 day.lock）
+        - CSV 被重写过（合并、创建、删除患者，可能是其它进程做的）：重新加载并重放日志
+        - CSV 没变但日志变长了（其它进程追加了修改）：只重放新增的日志
+        """
+        task_filename = self.task_filename(day.date_str)
+        signature = self._signature(task_filename)
+        journal_size = self._journal_size(day)
+        if day.signature is not None and day.signature == signature:
+            if journal_size == day.journal_offset:
+                return
+            if journal_size > day.journal_offset:
+                self._replay_journal(day)
+                return
+
+        day.rows = self.read_csv(task_filename) if signature is not None else []
+        day.rebuild_index()
+        day.signature = signature
+        day.pending = 0
+        day.journal_offset = 0
+        day.version += 1
+        day.changed_at = self._mtime_us(task_filename)
+
+        # 重放上次未合并的日志（例如服务器在合并前重启）
+        replayed = self._replay_journal(day)
+        if replayed:
+            log.info("已从日志恢复 %s 的 %d 条任务修改", day.date_str, replayed)
+
+    def _replay_journal(self, day):
+        """
+        把日志中 day.journal_offset 之后的修改应用到内存（调用方必须持有 day.lock）
+        Returns:
+            replayed: 应用的修改条数
+        """
+        journal_filename = self.journal_filename(day.date_str)
+        if not os.path.exists(journal_filename):
+            return 0
+        self._truncate_torn_tail(journal_filename)
+        replayed = 0
+        with open(journal_filename, 'rb') as f:
+            f.seek(day.journal_offset)
+            data = f.read()
+        for line in data.decode('utf-8').splitlines():
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                change = json.loads(line)
+            except ValueError:
+                continue
+            # 批量更新整批写成一行，要么全部重放要么全部丢弃
+            for item in change.get('changes', [change]):
+                row = day.index.get((item.get('patientId'), item.get('timeSlotName')))
+                if row is not None:
+                    row.update({k: item.get(k, '') for k in ('status', 'completionTime', 'remark')})
+                    replayed += 1
+        day.journal_offset += len(data)
+        if data:
+            day.pending += replayed
+            day.version += 1
+            day.changed_at = max(day.changed_at, self._mtime_us(journal_filename))
+        return replayed
+
+    @staticmethod
+    def _truncate_torn_tail(journal_filename):
+        """
+        截掉日志末尾因断电只写了一半的行
+        否则之后追加的修改会接在半行后面，下次重放时连同新的修改一起被当作无效行丢弃
+        """
+        with open(journal_filename, 'rb+') as f:
+            data = f.read()
+            if not data or data.endswith(b'\n'):
+                return
+            f.truncate(data.rfind(b'\n') + 1)
+            f.flush()
+            os.fsync(f.fileno())
+        log.warning("已截掉 %s 末尾写了一半的记录", journal_filename)
+
+    def disk_signature(self, date_str):
+        """某天任务数据在磁盘上的签名（CSV签名和日志长度），任何进程修改任务后都会变化"""
+        try:
+            journal_size = os.path.getsize(self.journal_filename(date_str))
+        except FileNotFoundError:
+            journal_size = 0
+        return self._signature(self.task_filename(date_str)), journal_size
+
+    def exists(self, date_str):
+        """某天的任务文件是否存在"""
+        return self._signature(self.task_filename(date_str)) is not None
+
+    def create_day(self, date_str, tasks):
+        """
+        创建某一天的任务文件
+        Args:
+            date_str: 日期字符串
+            tasks: 任务字典列表
+        """
+        day = self._get_day(date_str)
+        with day.lock:
+            self._write_day(day, tasks)
+
+    def rebuild_if_pending(self, date_str, tasks, pending_status='待服药'):
+        """
+        任务还没有任何记录（全部为 pending_status）时用 tasks 重建某一天的任务文件。
+        检查和重写在同一把锁内进行，不会覆盖检查之后才写入的记录
+        Args:
+            date_str: 日期字符串
+            tasks: 新的任务字典列表
+            pending_status: 未记录的任务状态
+        Returns:
+            bool: 是否已重建（任务文件不存在或已有记录时不重建）
+        """
+        day = self._get_day(date_str)
+        with day.lock:
+            if not self.exists(date_str):
+                return False
+            self._ensure_loaded(day)
+            if any(row.get('status') != pending_status for row in day.rows):
+                return False
+            self._write_day(day, tasks)
+            return True
+
+    def _write_day(self, day, tasks):
+        """整表写入某一天的任务并清空日志（调用方必须持有 day.lock）"""
+        task_filename = self.task_filename(day.date_str)
+        self.write_csv(task_filename, tasks, TASK_FIELDNAMES)
+        journal_filename = self.journal_filename(day.date_str)
+        if os.path.exists(journal_filename):
+            os.remove(journal_filename)
+        day.rows = [dict(task) for task in tasks]
+        day.rebuild_index()
+        day.pending = 0
+        day.journal_offset = 0
+        day.version += 1
+        day.signature = self._signature(task_filename)
+        day.changed_at = self._mtime_us(task_filename)
+
+    def get_tasks(self, date_str):
+        """
+        获取某一天的所有任务
+        Returns:
+            tasks: 字典列表（副本）
+        """
+        day = self._get_day(date_str)
+        with day.lock:
+            self._ensure_loaded(day)
+            return [dict(row) for row in day.rows]
+
+    def get_tasks_with_version(self, date_str):
+        """
+        获取某一天的所有任务以及版本信息（用于ETag和增量同步）
+        Returns:
+            version: 本进程内的版本号，任务每次变化都会增大
+            changed_at: 最近一次变化的时间（微秒），多个进程对同样的数据得到相同的值
+            tasks: 字典列表（副本）
+        """
+        day = self._get_day(date_str)
+        with day.lock:
+            self._ensure_loaded(day)
+            return day.version, day.changed_at, [dict(row) for row in day.rows]
+
+    def remove_patient(self, date_str, patient_id):
+        """
+        删除某一天中某个患者的所有任务（先合并日志中的修改，再整表写回）
+        Returns:
+            removed: 删除的任务数量
+        """
+        day = self._get_day(date_str)
+        with day.lock:
+            self._ensure_loaded(day)
+            remaining = [row for row in day.rows if row.get('patientId') != str(patient_id)]
+            removed = len(day.rows) - len(remaining)
+            if not removed:
+                return 0
+            task_filename = self.task_filename(date_str)
+            self.write_csv(task_filename, remaining, TASK_FIELDNAMES)
+            journal_filename = self.journal_filename(date_str)
+            if os.path.exists(journal_filename):
+                os.remove(journal_filename)
+            day.rows = remaining
+            day.rebuild_index()
+            day.pending = 0
+            day.journal_offset = 0
+            day.version += 1
+            day.signature = self._signature(task_filename)
+            day.changed_at = self._mtime_us(task_filename)
+            return removed
+
+    def archive_days(self, date_strs, archive):
+        """
+        把若干天的任务（包括日志中尚未合并的修改）交给 archive 保存，然后删除这些天的任务文件和日志
+        保存期间持有这些天的锁，不会有修改在保存之后、删除之前写入而丢失
+        Args:
+            date_strs: 日期字符串列表
+            archive: 保存函数 ({日期: 任务字典列表}) -> None，抛出异常时不删除任何文件
+        Returns:
+            archived: 实际归档的天数（任务文件不存在的日期会跳过）
+        """
+        days = [self._get_day(date_str) for date_str in sorted(set(date_strs))]
+        with ExitStack() as stack:
+            # 按日期顺序加锁，不会和其它同时持有多把日期锁的调用死锁
+            for day in days:
+                stack.enter_context(day.lock)
+            tasks = {}
+            for day in days:
+                self._ensure_loaded(day)
+                if day.signature is not None:
+                    tasks[day.date_str] = [dict(row) for row in day.rows]
+            if not tasks:
+                return 0
+            archive(tasks)
+
+            for day in days:
+                if day.date_str not in tasks:
+                    continue
+                self.remove_csv(self.task_filename(day.date_str))
+                self._remove_file(self.journal_filename(day.date_str))
+                day.rows = []
+                day.rebuild_index()
+                day.signature = None
+                day.pending = 0
+                day.journal_offset = 0
+                day.version += 1
+        with self._days_lock:
+            for date_str in tasks:
+                day = self._days.pop(date_str, None)
+                if day is not None:
+                    self._version_floor = max(self._version_floor, day.version)
+        return len(tasks)
+
+    def update_task(self, date_str, patient_id, time_slot_name, status, completion_time='', remark=''):
+        """
+        更新单个任务的状态
+        Returns:
+            bool: 是否找到并更新了任务
+        """
+        day = self._get_day(date_str)
+        with day.lock:
+            self._ensure_loaded(day)
+            row = day.index.get((str(patient_id), time_slot_name))
+            if row is None:
+                return False
+
+            change = {
+                'patientId': str(patient_id),
+                'timeSlotName': time_slot_name,
+                'status': status,
+                'completionTime': completion_time,
+                'remark': remark
+            }
+            self._apply_changes(day, [(row, change)], change)
+            return True
+
+    def update_tasks(self, date_str, updates):
+        """
+        批量更新同一天的多个任务，所有找到的任务在一次日志写入中原子地生效
+        Args:
+            date_str: 日期字符串
+            updates: 字典列表，每项包含 patientId、timeSlotName、status，可选 completionTime、remark
+        Returns:
+            results: 与 updates 一一对应的结果列表 {'patientId', 'timeSlotName', 'success', 'error'}
+        """
+        day = self._get_day(date_str)
+        with day.lock:
+            self._ensure_loaded(day)
+            results = []
+            matched = []
+            for update in updates:
+                if not isinstance(update, dict):
+                    update = {}
+                patient_id = str(update.get('patientId', ''))
+                time_slot_name = update.get('timeSlotName', '')
+                result = {'patientId': patient_id, 'timeSlotName': time_slot_name, 'success': False}
+                results.append(result)
+
+                if any(update.get(k) in (None, '') for k in ('patientId', 'timeSlotName', 'status')):
+                    result['error'] = '缺少必需字段: patientId, timeSlotName, status'
+                    continue
+                row = day.index.get((patient_id, time_slot_name))
+                if row is None:
+                    result['error'] = '未找到要更新的任务'
+                    continue
+
+                matched.append((row, {
+                    'patientId': patient_id,
+                    'timeSlotName': time_slot_name,
+                    'status': update['status'],
+                    'completionTime': update.get('completionTime', ''),
+                    'remark': update.get('remark', '')
+                }))
+                result['success'] = True
+
+            if matched:
+                self._apply_changes(day, matched, {'changes': [change for _, change in matched]})
+            return results
+
+    def _apply_changes(self, day, matched, journal_entry):
+        """
+        写日志并修改内存中的任务（调用方必须持有 day.lock）
+        Args:
+            matched: [(row, change), ...]
+            journal_entry: 写入日志的一行内容
+        """
+        # 先写日志再改内存，保证断电后可以恢复
+        journal_filename = self.journal_filename(day.date_str)
+        with open(journal_filename, 'ab') as f:
+            f.write((json.dumps(journal_entry, ensure_ascii=False) + '\n').encode('utf-8'))
+            f.flush()
+            os.fsync(f.fileno())
+            day.journal_offset = f.tell()
+        day.changed_at = max(day.changed_at + 1, self._mtime_us(journal_filename))
+
+        for row, change in matched:
+            row['status'] = change['status']
+            row['completionTime'] = change['completionTime']
+            row['remark'] = change['remark']
+        day.pending += len(matched)
+        day.version += 1
+
+        if day.pending >= self.compact_threshold:
+            self._compact_day(day)
+
+    def _compact_day(self, day):
+        """把内存中的任务写回CSV并清空日志（调用方必须持有 day.lock）"""
+        if not day.pending:
+            return
+        task_filename = self.task_filename(day.date_str)
+        self.write_csv(task_filename, day.rows, TASK_FIELDNAMES)
+        journal_filename = self.journal_filename(day.date_str)
+        if os.path.exists(journal_filename):
+            os.remove(journal_filename)
+        day.signature = self._signature(task_filename)
+        day.pending = 0
+        day.journal_offset = 0
+
+    def compact(self, date_str):
+        """把某一天的日志合并回CSV"""
+        day = self._get_day(date_str)
+        with day.lock:
+            self._ensure_loaded(day)
+            self._compact_day(day)
+
+    def compact_all(self):
+        """把所有日期的日志合并回CSV（由定时任务周期性调用）"""
+        with self._days_lock:
+            date_strs = list(self._days)
+        # 服务器重启前遗留的日志、已经移出内存的日期的日志也要合并
+        if os.path.isdir(self.data_dir):
+            for filename in os.listdir(self.data_dir):
+                if filename.startswith('tasks_') and filename.endswith('.journal'):
+                    date_str = filename[len('tasks_'):-len('.journal')]
+                    if date_str not in date_strs:
+                        date_strs.append(date_str)
+
+        for date_str in date_strs:
+            day = self._get_day(date_str)
+            with day.lock:
+                self._ensure_loaded(day)
+                self._compact_day(day)
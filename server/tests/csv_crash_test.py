@@ -0,0 +1,230 @@
+"""
+CSV写入崩溃安全测试（故障注入）
+
+用法（在 server 目录下运行）:
+    python tests/csv_crash_test.py [--rounds 30] [--rows 2000]
+
+在临时目录中测试 CsvBackend.write_rows 和任务日志：
+1. 进程内故障注入：分别在写入一半、fsync、重命名时抛出异常，
+   检查目标文件仍是完整的旧版本，并且没有遗留临时文件
+2. 随机杀进程：子进程不停地整表重写同一个CSV，父进程同时不停地读取，
+   在随机时刻用 SIGKILL 杀掉子进程；读者任何时候都不能读到不完整的表，杀掉后文件也必须完整
+3. 任务日志：日志最后一行写了一半时，重放应忽略这一行，之后追加的修改也不能丢失
+
+也可以用 pytest 运行（pytest tests/csv_crash_test.py），使用较小的固定参数（500行、5轮）。
+"""
+
+import argparse
+import csv
+import json
+import os
+import random
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from unittest import mock
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SERVER_DIR)
+
+from storage import CsvBackend  # noqa: E402
+from task_store import TaskStore, TASK_FIELDNAMES  # noqa: E402
+
+FIELDNAMES = ['version', 'idx', 'payload']
+
+failures = []
+
+
+def check(ok, message):
+    print(f"   {'✅' if ok else '❌'} {message}")
+    if not ok:
+        failures.append(message)
+
+
+def make_rows(version, n_rows):
+    return [{'version': version, 'idx': i, 'payload': f'患者{i}-' + 'x' * 40} for i in range(n_rows)]
+
+
+def read_raw(filename):
+    """不经过缓存直接解析文件"""
+    with open(filename, 'r', encoding='utf-8-sig', newline='') as f:
+        return list(csv.DictReader(f))
+
+
+def verify_table(rows, n_rows):
+    """完整的表：行数正确、序号连续、所有行属于同一个版本"""
+    if len(rows) != n_rows:
+        return False
+    versions = {row['version'] for row in rows}
+    return len(versions) == 1 and all(row['idx'] == str(i) for i, row in enumerate(rows))
+
+
+def leftover_temp_files(directory):
+    return [f for f in os.listdir(directory) if f.endswith('.tmp')]
+
+
+def check_injected_faults(directory, n_rows):
+    print("\n📍 进程内故障注入")
+    filename = os.path.join(directory, 'patients.csv')
+    backend = CsvBackend()
+    backend.write_rows(filename, make_rows(0, n_rows), FIELDNAMES)
+
+    class Crash(Exception):
+        pass
+
+    def crash(*args, **kwargs):
+        raise Crash()
+
+    def crash_halfway(self, rows):
+        rows = list(rows)
+        for row in rows[:len(rows) // 2]:
+            self.writerow(row)
+        raise Crash()
+
+    faults = {
+        '写入一半时崩溃': mock.patch.object(csv.DictWriter, 'writerows', crash_halfway),
+        'fsync 时崩溃': mock.patch('storage.os.fsync', crash),
+        '重命名时崩溃': mock.patch('storage.os.replace', crash),
+    }
+    for name, patch in faults.items():
+        with patch:
+            try:
+                backend.write_rows(filename, make_rows(1, n_rows), FIELDNAMES)
+                check(False, f"{name}: 没有抛出异常")
+            except Crash:
+                pass
+        rows = read_raw(filename)
+        check(verify_table(rows, n_rows) and rows[0]['version'] == '0', f"{name}: 目标文件仍是完整的旧版本")
+        check(not leftover_temp_files(directory), f"{name}: 没有遗留临时文件")
+        check(len(backend.read_rows(filename)) == n_rows, f"{name}: 缓存读取结果完整")
+
+
+def writer_main(filename, n_rows):
+    """子进程：不停地整表重写"""
+    backend = CsvBackend()
+    version = 1
+    while True:
+        backend.write_rows(filename, make_rows(version, n_rows), FIELDNAMES)
+        version += 1
+
+
+def check_random_kills(directory, n_rows, rounds):
+    print(f"\n📍 随机杀进程 ({rounds} 轮)")
+    filename = os.path.join(directory, 'tasks_2025-01-01.csv')
+    CsvBackend().write_rows(filename, make_rows(0, n_rows), FIELDNAMES)
+
+    reads = 0
+    bad_reads = 0
+    for _ in range(rounds):
+        writer = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--writer', filename,
+                                   '--rows', str(n_rows)])
+        stop = threading.Event()
+        reader_stats = {'reads': 0, 'bad': 0}
+
+        def reader():
+            while not stop.is_set():
+                try:
+                    rows = read_raw(filename)
+                except FileNotFoundError:
+                    reader_stats['bad'] += 1
+                    continue
+                reader_stats['reads'] += 1
+                if not verify_table(rows, n_rows):
+                    reader_stats['bad'] += 1
+
+        thread = threading.Thread(target=reader)
+        thread.start()
+        time.sleep(random.uniform(0.05, 0.5))
+        writer.send_signal(signal.SIGKILL)
+        writer.wait()
+        stop.set()
+        thread.join()
+
+        reads += reader_stats['reads']
+        bad_reads += reader_stats['bad']
+        if not verify_table(read_raw(filename), n_rows):
+            check(False, "杀掉写入进程后文件不完整")
+            return
+
+    check(bad_reads == 0, f"并发读取 {reads} 次，读到不完整数据 {bad_reads} 次")
+    check(True, f"{rounds} 次杀进程后文件均完整")
+    # 被杀时正在写的临时文件会留下，但不会影响数据文件
+    print(f"   ℹ️  遗留临时文件 {len(leftover_temp_files(directory))} 个（被杀时正在写入）")
+
+
+def check_torn_journal(directory):
+    print("\n📍 任务日志末尾写了一半")
+    backend = CsvBackend()
+    tasks = [{'patientId': str(i), 'timeSlotName': 'AFTER_BREAKFAST', 'status': '待服药',
+              'completionTime': '', 'remark': ''} for i in range(3)]
+    backend.write_rows(os.path.join(directory, 'tasks_2025-01-02.csv'), tasks, TASK_FIELDNAMES)
+
+    def read_csv(filename):
+        return [dict(row) for row in backend.read_rows(filename)]
+
+    store = TaskStore(read_csv, backend.write_rows, signature=backend.signature, data_dir=directory)
+    store.update_task('2025-01-02', '0', 'AFTER_BREAKFAST', '已服药', '08:00', '')
+    with open(store.journal_filename('2025-01-02'), 'a', encoding='utf-8') as f:
+        f.write('{"patientId": "1", "timeSlotName": "AFTER_BRE')
+
+    # 模拟重启：新的 TaskStore 重放日志，然后继续追加修改
+    store = TaskStore(read_csv, backend.write_rows, signature=backend.signature, data_dir=directory)
+    store.update_task('2025-01-02', '2', 'AFTER_BREAKFAST', '已服药', '08:05', '')
+    store = TaskStore(read_csv, backend.write_rows, signature=backend.signature, data_dir=directory)
+    statuses = [task['status'] for task in store.get_tasks('2025-01-02')]
+    check(statuses == ['已服药', '待服药', '已服药'], f"重放结果正确: {statuses}")
+
+    store.compact_all()
+    check(not os.path.exists(store.journal_filename('2025-01-02')), "合并后日志被删除")
+    statuses = [row['status'] for row in read_raw(store.task_filename('2025-01-02'))]
+    check(statuses == ['已服药', '待服药', '已服药'], "合并后CSV内容正确")
+
+
+def _assert_no_new_failures(check_function, *args):
+    """pytest 用：运行一组检查，断言其中没有失败项"""
+    start = len(failures)
+    check_function(*args)
+    assert failures[start:] == []
+
+
+def test_injected_faults(tmp_path):
+    _assert_no_new_failures(check_injected_faults, str(tmp_path), 500)
+
+
+def test_random_kills(tmp_path):
+    _assert_no_new_failures(check_random_kills, str(tmp_path), 500, 5)
+
+
+def test_torn_journal(tmp_path):
+    _assert_no_new_failures(check_torn_journal, str(tmp_path))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='CSV写入崩溃安全测试')
+    parser.add_argument('--rounds', type=int, default=30, help='随机杀进程的轮数')
+    parser.add_argument('--rows', type=int, default=2000, help='每张表的行数')
+    parser.add_argument('--writer', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.writer:
+        writer_main(args.writer, args.rows)
+        return
+
+    random.seed()
+    print("=== CSV写入崩溃安全测试 ===")
+    with tempfile.TemporaryDirectory() as directory:
+        check_injected_faults(directory, args.rows)
+    with tempfile.TemporaryDirectory() as directory:
+        check_random_kills(directory, args.rows, args.rounds)
+    with tempfile.TemporaryDirectory() as directory:
+        check_torn_journal(directory)
+
+    print(f"\n{'全部通过' if not failures else f'{len(failures)} 项失败'}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,24 @@
+"""
+生产环境 WSGI 入口
+
+Linux（多进程）:
+    gunicorn -c gunicorn.conf.py wsgi:app
+Windows（单进程多线程）:
+    waitress-serve --listen=0.0.0.0:5050 --threads=8 wsgi:app
+
+每个 worker 进程导入本模块时创建应用，并通过 data/.locks/scheduler.lock 竞选主进程，
+只有主进程运行后台任务调度器。
+"""
+
+import os
+import sys
+
+# gunicorn 可以从其它目录启动（--chdir），数据路径都是相对 server 目录的
+SERVER_DIR = os.path.dirname(os.path.abspath(__file__))
+os.chdir(SERVER_DIR)
+if SERVER_DIR not in sys.path:
+    sys.path.insert(0, SERVER_DIR)
+
+from main_packer import create_app  # noqa: E402
+
+app = create_app(start_scheduler=os.environ.get('EZDOSE_SCHEDULER', '1') != '0')